@@ -5,25 +5,56 @@ from flask import Flask, redirect, url_for, render_template, request, jsonify
 from flask_bootstrap import Bootstrap5
 from flask_login import current_user, LoginManager
 
-from data import db_session
-from data.users import User
-from data.dishes import Dish
-from data.dish_ratings import DishRating
-from data.favourites import Favourite
-from sqlalchemy import func, desc, text
+from data import db_session, writes, trending, maintenance, backup, shared_cache
+from data.users import User, get_user
 from blueprints.auth import auth_bp
 from blueprints.dishes import dishes_bp
 from blueprints.api import api_bp
+from extensions import timing, admission, compression, assets, template_cache
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'my_secret_key'
+# Каталог сжатых снимков БД (flask api backup, POST /api/backups)
+app.config['BACKUP_DIR'] = os.environ.get("BACKUP_DIR", backup.DEFAULT_DIR)
+# Списки блюд из каталога в памяти процесса (см. data/catalog.py)
+app.config['CATALOG_IN_MEMORY'] = os.environ.get("CATALOG_IN_MEMORY") == "1"
+# Байткод шаблонов на диске (по умолчанию — во временном каталоге системы)
+app.config['TEMPLATE_BYTECODE_DIR'] = os.environ.get("TEMPLATE_BYTECODE_DIR")
 bootstrap = Bootstrap5(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
+timing.init_app(app)
+admission.init_app(app)
+compression.init_app(app)
+assets.init_app(app)
+template_cache.init_app(app)
 
 # Инициализация базы данных
 if os.environ.get("FLASK_ENV") != "testing":
-    db_session.global_init("db/my.db")
+    # Общий кэш воркеров: путь к SQLite-файлу или redis://... (по умолчанию — память процесса)
+    shared_cache.configure(os.environ.get("CACHE_URL"),
+                           int(os.environ.get("CACHE_MAX_BYTES", shared_cache.DEFAULT_MAX_BYTES)))
+    db_session.global_init(os.environ.get("DB_FILE", "db/my.db"))
+    # Реплики для чтения: пути к SQLite-снимкам или URL, через запятую
+    # Все записи процесса через одно соединение по очереди (см. data/writes.py)
+    if os.environ.get("DB_WRITE_LANE"):
+        writes.enable_lane()
+    for replica in filter(None, os.environ.get("DB_REPLICAS", "").split(",")):
+        db_session.add_replica(replica,
+                               snapshot_interval=float(os.environ.get("DB_SNAPSHOT_INTERVAL", 0)) or None)
+    # Затухание и очистка трендов (0 — только командой flask api trending-refresh)
+    trending_interval = float(os.environ.get("TRENDING_REFRESH_INTERVAL", trending.REFRESH_INTERVAL))
+    if trending_interval:
+        trending.start_refresher(trending_interval)
+    # ANALYZE, incremental vacuum и чекпойнты WAL в тихие часы (0 — только командой flask api maintenance)
+    maintenance_window = os.environ.get("MAINTENANCE_WINDOW", maintenance.DEFAULT_WINDOW)
+    if maintenance_window != "0":
+        maintenance.start_scheduler(maintenance.parse_window(maintenance_window))
+    # Снимки по расписанию с ротацией (0 — только командой flask api backup)
+    backup_interval = float(os.environ.get("BACKUP_INTERVAL", 0))
+    if backup_interval:
+        backup.start_scheduler(app.config['BACKUP_DIR'], backup_interval,
+                               int(os.environ.get("BACKUP_KEEP", backup.KEEP)))
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(dishes_bp)
@@ -140,8 +171,8 @@ def get_footer():
 
 @login_manager.user_loader
 def load_user(user_id):
-    session = db_session.create_session()
-    return session.query(User).get(int(user_id))
+    # Кэш пользователей (общий для воркеров при CACHE_URL)
+    return get_user(int(user_id))
 
 
 @login_manager.unauthorized_handler
@@ -154,6 +185,10 @@ def unauthorized():
 
 
 def seed_database():
+    from data.dishes import Dish
+    from data.dish_ratings import DishRating
+    from data.favourites import Favourite
+
     session = db_session.create_session()
 
     # Создаем тестового пользователя если его нет
@@ -255,48 +290,6 @@ def seed_database():
     print("База данных успешно заполнена тестовыми данными!")
 
 
-def create_views():
-    """Создает необходимые представления в базе данных"""
-    session = db_session.create_session()
-    try:
-        # Пробуем удалить как таблицу
-        session.execute(text("DROP TABLE IF EXISTS dishes_with_ratings"))
-        print("Таблица dishes_with_ratings удалена")
-    except:
-        # Пробуем удалить как представление
-        try:
-            session.execute(text("DROP VIEW IF EXISTS dishes_with_ratings"))
-            print("Представление dishes_with_ratings удалено")
-        except:
-            pass
-    finally:
-        session.close()
-    try:
-        session = db_session.create_session()
-        # Создаем представление dishes_with_ratings
-        session.execute(text("""
-            CREATE VIEW dishes_with_ratings AS
-            SELECT 
-                d.id,
-                d.name,
-                d.ingredients,
-                d.url,
-                COALESCE(AVG(dr.rating), 0) as average_rating,
-                COUNT(dr.rating) as rating_count
-            FROM dishes d
-            LEFT JOIN dish_ratings dr ON d.id = dr.dish_id
-            GROUP BY d.id
-        """))
-
-        session.commit()
-        print("Представление dishes_with_ratings успешно создано")
-    except Exception as e:
-        print(f"Ошибка при создании представления: {e}")
-        session.rollback()
-    finally:
-        session.close()
-
-
 @app.route('/')
 @app.route('/index')
 def index():
@@ -311,9 +304,6 @@ def index():
 
 if __name__ == '__main__':
     if not os.path.exists("db/my.db"):
-        # Создаем необходимые представления
-        create_views()
-
         # Заполняем базу тестовыми данными
         seed_database()
     # Запускаем приложение
@@ -0,0 +1,326 @@
+"""ASGI-точка входа для read-only части API.
+
+GET /api/dishes, /api/dishes/<id> и /api/user/favourites обслуживаются
+асинхронными обработчиками поверх aiosqlite, все остальные запросы
+(в том числе любые изменения данных) уходят в существующее Flask-приложение.
+
+GET /api/dishes/stream — поток Server-Sent Events с изменениями рейтингов
+(см. extensions/live.py); держится только здесь, без потока на соединение.
+
+Запуск:
+    uvicorn asgi:application --port 8080
+"""
+import asyncio
+import re
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from flask_login.utils import decode_cookie
+from sqlalchemy import select
+
+from app import app as flask_app
+from blueprints.api import dump_json, FAVOURITES_PER_PAGE, FAVOURITES_MAX_PER_PAGE
+from data import db_session
+from data.catalog import catalog
+from data.dishes import Dish
+from data.dish_ratings import DishRating
+from data.favourites import Favourite
+from data.dish_query import DishQueryPlan, parse_fields, parse_ids, in_requested_order, LIST_FIELDS, \
+    DETAIL_FIELDS
+from data.users import User, user_cache
+from extensions import http_cache, live
+
+DISH_DETAIL_RE = re.compile(r'^/api/dishes/(\d+)$')
+
+wsgi_application = WsgiToAsgi(flask_app)
+
+
+def _parse_cookies(headers):
+    cookies = {}
+    for name, value in headers:
+        if name != b'cookie':
+            continue
+        for part in value.decode('latin-1').split(';'):
+            if '=' in part:
+                key, val = part.strip().split('=', 1)
+                cookies[key] = val
+    return cookies
+
+
+def _get_user_id(headers):
+    """Достает id пользователя из той же cookie, что использует Flask-Login"""
+    cookies = _parse_cookies(headers)
+
+    session_cookie = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if session_cookie:
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        try:
+            data = serializer.loads(session_cookie, max_age=max_age)
+        except Exception:
+            data = {}
+        if data.get('_user_id'):
+            return int(data['_user_id'])
+
+    # Cookie "Запомнить меня"
+    remember_cookie = cookies.get(flask_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token'))
+    if remember_cookie:
+        with flask_app.app_context():
+            user_id = decode_cookie(remember_cookie)
+        if user_id:
+            return int(user_id)
+
+    return None
+
+
+async def _load_user_id(session, headers):
+    user_id = _get_user_id(headers)
+    if user_id is None:
+        return None
+    # Тот же кэш пользователей, что у load_user
+    if user_cache.get(user_id) is not None:
+        return user_id
+    user = await session.get(User, user_id)
+    if user is None:
+        return None
+    user_cache.set(user_id, {'id': user.id, 'login': user.login})
+    return user.id
+
+
+async def _dishes_to_dicts(session, plan, where=None, round_average=True):
+    """Асинхронный аналог api.dishes_to_dicts: тот же план запроса"""
+    stmt = plan.statement()
+    if where is not None:
+        stmt = stmt.where(where)
+    return plan.dicts(await session.execute(stmt), round_average=round_average)
+
+
+async def get_dishes_by_ids(session, user_id, ids, fields):
+    plan = DishQueryPlan(fields, user_id=user_id, per_row=True)
+    result = await session.execute(plan.statement().where(Dish.id.in_(ids)))
+    serialize = plan.serializer(result.keys(), round_average=True)
+    # id выбирается всегда, даже если его нет в fields
+    dishes, missing = in_requested_order({row.id: serialize(row) for row in result}, ids)
+    return 200, {'dishes': dishes, 'count': len(dishes), 'missing': missing}
+
+
+async def _dishes_from_catalog(session, user_id, fields, sort, updated_since):
+    """Асинхронный аналог api.dishes_from_catalog; синхронизация каталога — в потоке"""
+    await asyncio.to_thread(catalog.ensure_current)
+    favourite_ids = ratings = None
+    if user_id:
+        if 'is_favourite' in fields:
+            favourite_ids = set((await session.execute(
+                select(Favourite.dishes_id).where(Favourite.user_id == user_id))).scalars())
+        if 'user_rating' in fields:
+            ratings = dict((await session.execute(
+                select(DishRating.dish_id, DishRating.rating).where(DishRating.user_id == user_id))).all())
+    return catalog.dicts(fields, sort, updated_since, favourite_ids, ratings)
+
+
+async def get_dishes(session, user_id, query):
+    default_fields = LIST_FIELDS if user_id else \
+        [field for field in LIST_FIELDS if field != 'is_favourite']
+    try:
+        if query.get('ids'):
+            return await get_dishes_by_ids(session, user_id, parse_ids(query['ids']),
+                                           parse_fields(query.get('fields'), DETAIL_FIELDS))
+        fields = parse_fields(query.get('fields'), default_fields)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    updated_since = None
+    if query.get('updated_since'):
+        try:
+            updated_since = http_cache.parse_since(query['updated_since'])
+        except ValueError:
+            return 400, {'error': 'Invalid updated_since'}
+
+    sort = query.get('sort', 'default')
+    if flask_app.config['CATALOG_IN_MEMORY'] and sort != 'trending':
+        dishes_list = await _dishes_from_catalog(session, user_id, fields, sort, updated_since)
+        return 200, {'dishes': dishes_list, 'count': len(dishes_list)}
+
+    where = Dish.updated_at > updated_since if updated_since is not None else None
+    plan = DishQueryPlan(fields, user_id=user_id, sort=sort)
+    dishes_list = await _dishes_to_dicts(session, plan, where, round_average=False)
+    return 200, {'dishes': dishes_list, 'count': len(dishes_list)}
+
+
+async def get_dish(session, user_id, dish_id, query, headers):
+    try:
+        fields = parse_fields(query.get('fields'), DETAIL_FIELDS)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    updated_at = (await session.execute(select(Dish.updated_at).where(Dish.id == dish_id))).first()
+    if not updated_at:
+        return 404, {'error': 'Dish not found'}
+
+    # Те же валидаторы, что у Flask-маршрута: ETag совпадает в обоих режимах
+    etag, last_modified = http_cache.validators(updated_at[0], user_id, *fields)
+    cache_headers = http_cache.asgi_headers(etag, last_modified)
+    if http_cache.is_not_modified_asgi(etag, last_modified, headers):
+        return 304, None, cache_headers
+
+    plan = DishQueryPlan(fields, user_id=user_id, per_row=True)
+    dishes = await _dishes_to_dicts(session, plan, Dish.id == dish_id)
+    return 200, {'dish': dishes[0]}, cache_headers
+
+
+async def get_user_favourites(session, user_id, query):
+    if not user_id:
+        return 401, {'error': 'Authentication required'}
+    try:
+        fields = parse_fields(query.get('fields'), LIST_FIELDS)
+        page = int(query.get('page', 1))
+        per_page = min(int(query.get('per_page', FAVOURITES_PER_PAGE)), FAVOURITES_MAX_PER_PAGE)
+        if page < 1 or per_page < 1:
+            raise ValueError('page and per_page must be positive')
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    plan = DishQueryPlan(fields, user_id=user_id, per_row=True, favourites_only=True)
+    stmt = plan.statement().limit(per_page).offset((page - 1) * per_page)
+    dishes = plan.dicts(await session.execute(stmt), round_average=True)
+    total = (await session.execute(plan.count_statement())).scalar()
+    return 200, {'favourites': dishes, 'count': len(dishes), 'total': total,
+                 'page': page, 'per_page': per_page}
+
+
+def _match_read_route(scope):
+    """Возвращает корутину-обработчик для read-only маршрута или None"""
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None
+
+    path = scope['path']
+    query = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    if path == '/api/dishes':
+        return lambda session, user_id: get_dishes(session, user_id, query)
+    if path == '/api/user/favourites':
+        return lambda session, user_id: get_user_favourites(session, user_id, query)
+    match = DISH_DETAIL_RE.match(path)
+    if match:
+        dish_id = int(match.group(1))
+        return lambda session, user_id: get_dish(session, user_id, dish_id, query, scope.get('headers', []))
+    return None
+
+
+def _last_event_id(scope, query):
+    for name, value in scope.get('headers', []):
+        if name == b'last-event-id':
+            return value.decode('latin-1')
+    return query.get('last_event_id')
+
+
+async def stream_ratings(scope, receive, send):
+    """SSE: события rating с текущей средней оценкой и числом оценок блюда"""
+    query = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+    try:
+        last_id = _last_event_id(scope, query)
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+
+    db_session.global_init_async()
+    # Подписываемся до чтения пропущенного, чтобы ничего не потерять между ними
+    subscriber = live.hub.subscribe()
+    live.hub.ensure_poller(db_session.create_async_session)
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+        subscriber.wake.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        # Переподключение: состояние блюд, оценки которых менялись после Last-Event-ID
+        if last_id is not None:
+            async with db_session.create_async_session() as session:
+                missed = await live.changed_since(session, last_id)
+            if missed is None:
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': b'event: reset\ndata: {}\n\n'})
+            else:
+                for event in missed:
+                    subscriber.offer(event)
+
+        while not disconnected.is_set():
+            try:
+                await asyncio.wait_for(subscriber.wake.wait(), live.HEARTBEAT)
+            except asyncio.TimeoutError:
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+            if disconnected.is_set():
+                break
+            if subscriber.overflowed:
+                # Клиент не успевает читать — закрываем, он вернется с Last-Event-ID
+                break
+            body = b''.join(live.format_event(event) for event in subscriber.drain())
+            if body:
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        live.hub.unsubscribe(subscriber)
+        watcher.cancel()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            db_session.global_init_async()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await db_session.dispose_async()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/api/dishes/stream':
+        return await stream_ratings(scope, receive, send)
+
+    handler = _match_read_route(scope)
+    if handler is None:
+        # Запись и HTML-страницы обслуживает Flask
+        return await wsgi_application(scope, receive, send)
+
+    db_session.global_init_async()
+    async with db_session.create_async_session() as session:
+        user_id = await _load_user_id(session, scope.get('headers', []))
+        # Обработчик может добавить заголовки третьим элементом (ETag и т.п.)
+        status, data, *extra_headers = await handler(session, user_id)
+    extra_headers = extra_headers[0] if extra_headers else []
+
+    if data is None:
+        await send({'type': 'http.response.start', 'status': status, 'headers': extra_headers})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    body = dump_json(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json; charset=utf-8'),
+            (b'content-length', str(len(body)).encode()),
+        ] + extra_headers,
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,99 @@
+"""Сравнение read-only API в WSGI (Flask) и ASGI (asgi.py) режимах.
+
+Оба варианта вызываются в процессе, без сетевого стека: WSGI — через
+пул потоков с тестовым клиентом Flask, ASGI — через asyncio.gather.
+Для каждого уровня конкурентности выводится пропускная способность.
+
+Запуск:
+    python benchmarks/asgi_vs_wsgi.py [путь к базе] [кол-во запросов]
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["FLASK_ENV"] = "testing"
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app import app  # noqa: E402
+from data import db_session  # noqa: E402
+
+CONCURRENCY_LEVELS = [1, 8, 32, 128]
+PATHS = ['/api/dishes', '/api/dishes/1', '/api/dishes?sort=rating']
+
+
+def run_wsgi(total, concurrency):
+    def worker(i):
+        with app.test_client() as client:
+            return client.get(PATHS[i % len(PATHS)]).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        statuses = list(pool.map(worker, range(total)))
+        elapsed = time.perf_counter() - start
+    assert all(status in (200, 404) for status in statuses)
+    return elapsed
+
+
+async def _asgi_request(application, path):
+    raw_path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': raw_path,
+        'query_string': query.encode(), 'headers': [],
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await application(scope, receive, send)
+    return status
+
+
+async def _run_asgi(application, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(i):
+        async with semaphore:
+            return await _asgi_request(application, PATHS[i % len(PATHS)])
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(worker(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    assert all(status in (200, 404) for status in statuses)
+    await db_session.dispose_async()
+    return elapsed
+
+
+def run_asgi(total, concurrency):
+    from asgi import application
+    return asyncio.run(_run_asgi(application, total, concurrency))
+
+
+def main():
+    source_db = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, 'db', 'my.db')
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 600
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copy(source_db, db_path)
+        db_session.global_init(db_path)
+
+        print(f"{'конкурентность':>15} {'WSGI, rps':>12} {'ASGI, rps':>12}")
+        for concurrency in CONCURRENCY_LEVELS:
+            wsgi_time = run_wsgi(total, concurrency)
+            asgi_time = run_asgi(total, concurrency)
+            print(f"{concurrency:>15} {total / wsgi_time:>12.1f} {total / asgi_time:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
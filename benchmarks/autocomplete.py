@@ -0,0 +1,63 @@
+"""Задержка автодополнения названий на синтетическом каталоге.
+
+Индекс заполняется без БД (как после загрузки), затем для случайных
+префиксов длиной 1–6 символов замеряется время search(). Выводятся
+медиана, 99-й перцентиль и максимум.
+
+Запуск:
+    python benchmarks/autocomplete.py [кол-во названий] [кол-во запросов]
+"""
+import os
+import random
+import sys
+import time
+
+os.environ["FLASK_ENV"] = "testing"
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from data.name_index import NameIndex, normalize, weight  # noqa: E402
+
+WORDS = ['суп', 'салат', 'паста', 'пирог', 'борщ', 'плов', 'каша', 'рагу', 'омлет', 'пицца',
+         'с', 'из', 'по-домашнему', 'грибами', 'курицей', 'сыром', 'овощами', 'тыквой']
+
+
+def build(count):
+    random.seed(1)
+    index = NameIndex()
+    dishes = {}
+    for dish_id in range(count):
+        name = ' '.join(random.choice(WORDS) for _ in range(3)) + f' {dish_id}'
+        average, rated = random.uniform(1, 5), random.randint(0, 50)
+        dishes[dish_id] = (name, normalize(name), average, rated, weight(average, rated))
+    index._dishes = dishes
+    index._keys = sorted((entry[1], dish_id) for dish_id, entry in dishes.items())
+    index._by_key = {key: dish_id for key, dish_id in index._keys}
+    index.loaded = True
+    return index
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    started = time.perf_counter()
+    index = build(count)
+    print(f"названий: {count}, построение: {time.perf_counter() - started:.2f} с")
+
+    keys = [key for key, _ in index._keys]
+    timings = []
+    for _ in range(queries):
+        prefix = random.choice(keys)[:random.randint(1, 6)]
+        started = time.perf_counter()
+        index.search(prefix)
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    print(f"медиана: {timings[len(timings) // 2] * 1e6:.0f} мкс, "
+          f"p99: {timings[int(len(timings) * 0.99)] * 1e6:.0f} мкс, "
+          f"максимум: {timings[-1] * 1e6:.0f} мкс")
+
+
+if __name__ == '__main__':
+    main()
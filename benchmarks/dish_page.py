@@ -0,0 +1,84 @@
+"""Рендер страницы списка блюд с кэшем фрагментов и без него.
+
+Шаблон dishes.html рендерится для синтетического списка DishRow без БД:
+- без кэша — каждая карточка выполняет url_for и условия заново;
+- холодный кэш — первый рендер (тело выполняется и сохраняется);
+- теплый кэш — повторный рендер собирает готовые фрагменты.
+Отдельно замеряется загрузка шаблона новым окружением: компиляция
+исходника против байткода с диска.
+
+Запуск:
+    python benchmarks/dish_page.py [кол-во блюд] [повторов]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ["FLASK_ENV"] = "testing"
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import jinja2  # noqa: E402
+from flask import render_template  # noqa: E402
+
+from app import app  # noqa: E402
+from data.dish_rows import DishRow  # noqa: E402
+from extensions.template_cache import FragmentCacheExtension  # noqa: E402
+
+
+def dishes(count):
+    now = datetime(2025, 1, 1)
+    return [DishRow(dish_id, f'Блюдо {dish_id}', 'мука, яйца', '', 1 + dish_id % 3, now,
+                    3.5, 10, dish_id % 5 or None, dish_id % 7 == 0, dish_id % 3 == 0)
+            for dish_id in range(1, count + 1)]
+
+
+def render(rows):
+    started = time.perf_counter()
+    render_template('dishes.html', title='Список блюд', dishes=rows, current_sort='default',
+                    get_navbar='', get_footer='')
+    return time.perf_counter() - started
+
+
+def load_template(directory, precompiled):
+    bytecode_cache = jinja2.FileSystemBytecodeCache(directory) if precompiled else None
+    env = jinja2.Environment(loader=app.jinja_loader, extensions=[FragmentCacheExtension],
+                             bytecode_cache=bytecode_cache)
+    started = time.perf_counter()
+    env.get_template('dishes.html')
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rows = dishes(count)
+    fragments = app.jinja_env.fragment_cache
+
+    with app.test_request_context('/dishes'):
+        app.jinja_env.fragment_cache = None
+        render(rows)
+        plain = [render(rows) for _ in range(repeats)]
+
+        app.jinja_env.fragment_cache = fragments
+        fragments.clear()
+        cold = render(rows)
+        warm = [render(rows) for _ in range(repeats)]
+
+    print(f"{count} карточек:")
+    print(f"  без кэша:       {statistics.median(plain) * 1000:.2f} мс")
+    print(f"  холодный кэш:   {cold * 1000:.2f} мс")
+    print(f"  теплый кэш:     {statistics.median(warm) * 1000:.2f} мс")
+
+    directory = tempfile.mkdtemp()
+    load_template(directory, precompiled=True)
+    compiled = statistics.median(load_template(directory, precompiled=False) for _ in range(repeats))
+    cached = statistics.median(load_template(directory, precompiled=True) for _ in range(repeats))
+    print(f"Загрузка dishes.html: компиляция {compiled * 1000:.2f} мс, байткод {cached * 1000:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Список блюд: ORM-сущности против DishRow на большом каталоге.
+
+Во временной базе создается каталог блюд с оценками, затем для каждого
+способа загружается весь список и превращается в словари, как для
+страницы:
+- orm   — session.query(DishWithRating).all() и копирование атрибутов;
+- rows  — dish_rows.load() (Core-запрос, DishRow со __slots__);
+- dicts — DishQueryPlan.dicts() (сразу словари ответа API);
+- catalog — словари из каталога в памяти (data/catalog.py; загрузка —
+  на прогреве, как при первом запросе воркера).
+
+Выводится процессорное время и пик памяти (tracemalloc) на строку.
+
+Запуск:
+    python benchmarks/listing_rows.py [кол-во блюд]
+"""
+import gc
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ["FLASK_ENV"] = "testing"
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from data import db_session, dish_rows  # noqa: E402
+from data.catalog import catalog  # noqa: E402
+from data.dish_query import DishQueryPlan, LIST_FIELDS  # noqa: E402
+from data.dishes import DishWithRating  # noqa: E402
+
+USER_ID = 1
+
+
+def fill(path, count):
+    random.seed(1)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, login) VALUES (1, 'admin')")
+    conn.executemany(
+        "INSERT INTO dishes (id, name, ingredients, url, author_id, created_at, updated_at) "
+        "VALUES (?, ?, ?, '', 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+        ((i, f'Блюдо {i}', 'мука, яйца, соль') for i in range(1, count + 1)))
+    conn.executemany(
+        "INSERT INTO dish_ratings (user_id, dish_id, rating, created_at, updated_at) "
+        "VALUES (1, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+        ((i, random.randint(1, 5)) for i in range(1, count + 1) if i % 3))
+    conn.commit()
+    conn.close()
+
+
+def orm(session):
+    return [{'id': dish.id, 'name': dish.name, 'ingredients': dish.ingredients, 'url': dish.url,
+             'average_rating': dish.average_rating, 'rating_count': dish.rating_count}
+            for dish in session.query(DishWithRating).all()]
+
+
+def rows(session):
+    return dish_rows.load(session, USER_ID)
+
+
+def dicts(session):
+    plan = DishQueryPlan(LIST_FIELDS, user_id=USER_ID, favourite_ids=set())
+    return plan.dicts(session.execute(plan.statement()))
+
+
+def from_catalog(session):
+    catalog.ensure_current()
+    return catalog.dicts(LIST_FIELDS, favourite_ids=set())
+
+
+def measure(name, func, count):
+    # Сначала прогрев (кэш компиляции SQL), затем отдельно время и память
+    session = db_session.create_session()
+    func(session)
+    session.close()
+
+    gc.collect()
+    session = db_session.create_session()
+    started = time.process_time()
+    result = func(session)
+    cpu = time.process_time() - started
+    session.close()
+    del result
+
+    gc.collect()
+    session = db_session.create_session()
+    tracemalloc.start()
+    result = func(session)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    session.close()
+    print(f"{name:>7}: {len(result)} строк, {cpu / count * 1e6:.2f} мкс CPU/строку, "
+          f"пик {peak / count:.0f} байт/строку")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'listing.db')
+    db_session.global_init(path)
+    fill(path, count)
+
+    for name, func in (('orm', orm), ('rows', rows), ('dicts', dicts), ('catalog', from_catalog)):
+        measure(name, func, count)
+    db_session.reset()
+
+
+if __name__ == '__main__':
+    main()
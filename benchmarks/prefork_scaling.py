@@ -0,0 +1,101 @@
+"""Масштабирование serve.py по числу воркеров.
+
+Для каждого числа воркеров поднимается serve.py на копии базы, и
+нагрузка подается из отдельных процессов (чтобы клиент не упирался в
+свой GIL). Выводится пропускная способность и ускорение относительно
+одного воркера. Ускорение ограничено числом ядер машины.
+
+Запуск:
+    python benchmarks/prefork_scaling.py [путь к базе] [секунд на замер]
+"""
+import http.client
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER_COUNTS = [1, 2, 4, 8]
+CLIENT_PROCESSES = 8
+PATHS = ['/api/dishes', '/api/dishes/1', '/api/dishes?sort=rating']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/dishes/1')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('serve.py не поднялся')
+
+
+def client(port, seconds, result):
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.request('GET', PATHS[done % len(PATHS)])
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        if response.status in (200, 404):
+            done += 1
+    with result.get_lock():
+        result.value += done
+
+
+def measure(db_path, workers, seconds):
+    port = free_port()
+    env = dict(os.environ, DB_FILE=db_path)
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py', '--workers', str(workers), '--port', str(port)],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_ready(port)
+        result = multiprocessing.Value('i', 0)
+        clients = [multiprocessing.Process(target=client, args=(port, seconds, result))
+                   for _ in range(CLIENT_PROCESSES)]
+        for process in clients:
+            process.start()
+        for process in clients:
+            process.join()
+        return result.value / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, 'db', 'my.db')
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    print(f"ядер: {os.cpu_count()}, клиентских процессов: {CLIENT_PROCESSES}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        shutil.copy(source, db_path)
+
+        baseline = None
+        for workers in WORKER_COUNTS:
+            rps = measure(db_path, workers, seconds)
+            baseline = baseline or rps
+            print(f"воркеров: {workers:>2}  {rps:8.0f} зап/с  x{rps / baseline:.2f}")
+
+
+if __name__ == '__main__':
+    main()
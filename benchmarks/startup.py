@@ -0,0 +1,66 @@
+"""Время старта воркера: от запуска процесса до ответа на первый запрос.
+
+Замеряется холодный старт (пустая база, применяются все миграции) и
+теплый (схема актуальна, проверяется только schema_version). Каждый
+замер — отдельный процесс, выводится медиана.
+
+Запуск:
+    python benchmarks/startup.py [кол-во запусков] [--max-ms N]
+
+С --max-ms скрипт завершается с ошибкой, если теплый старт медленнее N мс.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import os, sys, time
+os.environ["FLASK_ENV"] = "testing"
+sys.path.insert(0, {base_dir!r})
+from app import app
+from data import db_session
+db_session.global_init({db_path!r})
+response = app.test_client().get('/api/dishes')
+assert response.status_code == 200
+"""
+
+
+def time_to_first_request(db_path):
+    code = WORKER.format(base_dir=BASE_DIR, db_path=db_path)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True,
+                   stdout=subprocess.DEVNULL, cwd=BASE_DIR)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    args = sys.argv[1:]
+    max_ms = None
+    if '--max-ms' in args:
+        index = args.index('--max-ms')
+        max_ms = float(args[index + 1])
+        del args[index:index + 2]
+    runs = int(args[0]) if args else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cold, warm = [], []
+        for i in range(runs):
+            db_path = os.path.join(tmp, f'startup_{i}.db')
+            cold.append(time_to_first_request(db_path))
+            warm.append(time_to_first_request(db_path))
+
+    print(f"холодный старт: {statistics.median(cold):.1f} мс")
+    print(f"теплый старт:   {statistics.median(warm):.1f} мс")
+
+    if max_ms is not None and statistics.median(warm) > max_ms:
+        print(f"Теплый старт превышает бюджет {max_ms:.0f} мс")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,32 @@
-from flask import Blueprint, jsonify, request, abort
+from flask import Blueprint, jsonify, request, abort, current_app
 from flask_login import login_required, current_user
 import json
+import os
+import sqlite3
+
+import click
 
 from data import db_session
-from data.dishes import Dish, DishWithRating
+from data.dishes import Dish
+from data.dish_query import DishQueryPlan, parse_fields, parse_ids, in_requested_order, LIST_FIELDS, \
+    DETAIL_FIELDS
 from data.dish_ratings import DishRating
 from data.favourites import Favourite
-from data.users import User
+from data.favourite_cache import favourite_cache
+from data.catalog import catalog, user_ratings
+from data.name_index import name_index, TOP_K as AUTOCOMPLETE_TOP_K, MAX_TOP_K as AUTOCOMPLETE_MAX_TOP_K
+from data.user_state import UserState, parse_version
+from data import writes, change_log, trending, similar_dishes, maintenance, backup, shared_cache
+from data.writes import write_session
+from extensions import http_cache, admission, compression, live
 
 api_bp = Blueprint('api', __name__)
 
+FAVOURITES_PER_PAGE = 50
+FAVOURITES_MAX_PER_PAGE = 200
+CHANGES_PER_PAGE = 100
+CHANGES_MAX_PER_PAGE = 1000
+
 
 def can_edit_dish(dish, user):
     """Проверяет, может ли пользователь редактировать/удалять блюдо"""
@@ -31,86 +48,106 @@ def is_youtube_link(url):
     return "youtube.com" in url or "youtu.be" in url
 
 
-def create_json_response(data, status=200):
+def dump_json(data, compact=False):
+    """Сериализует ответ API (общий формат для WSGI и ASGI режимов).
+
+    compact=True — без отступов, для больших массивов чисел.
+    """
+    if compact:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def create_json_response(data, status=200, compact=False):
     from flask import make_response
-    response = make_response(json.dumps(data, ensure_ascii=False, indent=2))
+    response = make_response(dump_json(data, compact))
     response.headers['Content-Type'] = 'application/json; charset=utf-8'
     response.status_code = status
     return response
 
 
-def dish_to_dict(dish, include_details=False, session=None):
-    close_session = False
-    if session is None:
-        session = db_session.create_session()
-        close_session = True
-    data = {
-        'id': dish.id,
-        'name': dish.name,
-        'average_rating': dish.get_average_rating(session),
-        'rating_count': dish.get_rating_count(session),
-        'is_favourite': dish.is_favourite(current_user.id, session) if current_user.is_authenticated else False,
-        # 'author_id': dish.author_id
-    }
-    # Получаем информацию об авторе
-    # if dish.author_id:
-    #     author = session.query(User).get(dish.author_id)
-    #     if author:
-    #         data['author'] = {
-    #             'id': author.id,
-    #             'login': author.login,
-    #             'is_current_user': current_user.is_authenticated and author.id == current_user.id
-    #         }
-    if include_details:
-        data.update({
-            'ingredients': dish.ingredients,
-            'url': dish.url,
-            'user_rating': None
-        })
+def current_user_id():
+    return current_user.id if current_user.is_authenticated else None
 
-        if current_user.is_authenticated:
-            user_rating = session.query(DishRating).filter(
-                DishRating.user_id == current_user.id,
-                DishRating.dish_id == dish.id
-            ).first()
-            data['user_rating'] = user_rating.rating if user_rating else None
 
-    if close_session:
-        session.close()
+def dishes_to_dicts(session, plan, where=None, round_average=True):
+    """Выполняет план запроса и превращает строки в словари ответа"""
+    stmt = plan.statement()
+    if where is not None:
+        stmt = stmt.where(where)
+    return plan.dicts(session.execute(stmt), round_average=round_average)
 
-    return data
+
+def get_dishes_by_ids(ids, fields):
+    """Мульти-получение: все блюда, агрегаты и состояние пользователя одним запросом"""
+    session = db_session.create_session()
+    plan = DishQueryPlan(fields, user_id=current_user_id(), per_row=True)
+    result = session.execute(plan.statement().where(Dish.id.in_(ids)))
+    serialize = plan.serializer(result.keys(), round_average=True)
+    # id выбирается всегда, даже если его нет в fields
+    dishes_by_id = {row.id: serialize(row) for row in result}
+    session.close()
+
+    dishes, missing = in_requested_order(dishes_by_id, ids)
+    return create_json_response({
+        'dishes': dishes,
+        'count': len(dishes),
+        'missing': missing
+    })
+
+
+def dishes_from_catalog(fields, sort, updated_since):
+    """Список из каталога в памяти; из БД — только оценки пользователя, если они запрошены"""
+    catalog.ensure_current()
+    favourite_ids = ratings = None
+    if current_user.is_authenticated:
+        if 'is_favourite' in fields:
+            favourite_ids = favourite_cache.get(current_user.id)
+        if 'user_rating' in fields:
+            session = db_session.create_session()
+            ratings = user_ratings(session, current_user.id)
+            session.close()
+    return catalog.dicts(fields, sort, updated_since, favourite_ids, ratings)
 
 
 # Блюда
 @api_bp.route('/dishes', methods=['GET'])
 def get_dishes():
     sort_by = request.args.get('sort', 'default')
-    session = db_session.create_session()
 
-    if sort_by == 'rating':
-        dishes_query = session.query(DishWithRating).order_by(
-            DishWithRating.average_rating.desc()
-        ).all()
-    else:
-        dishes_query = session.query(DishWithRating).all()
-
-    dishes_list = []
-    for dish_view in dishes_query:
-        dish_data = {
-            'id': dish_view.id,
-            'name': dish_view.name,
-            'average_rating': dish_view.average_rating,
-            'rating_count': dish_view.rating_count
-        }
-
-        if current_user.is_authenticated:
-            favourite = session.query(Favourite).filter(
-                Favourite.user_id == current_user.id,
-                Favourite.dishes_id == dish_view.id
-            ).first()
-            dish_data['is_favourite'] = favourite is not None
+    default_fields = LIST_FIELDS if current_user.is_authenticated else \
+        [field for field in LIST_FIELDS if field != 'is_favourite']
+    try:
+        if request.args.get('ids'):
+            return get_dishes_by_ids(parse_ids(request.args['ids']),
+                                     parse_fields(request.args.get('fields'), DETAIL_FIELDS))
+        fields = parse_fields(request.args.get('fields'), default_fields)
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, 400)
+
+    updated_since = None
+    if request.args.get('updated_since'):
+        try:
+            updated_since = http_cache.parse_since(request.args['updated_since'])
+        except ValueError:
+            return create_json_response({'error': 'Invalid updated_since'}, 400)
+
+    if current_app.config['CATALOG_IN_MEMORY'] and sort_by != 'trending':
+        dishes_list = dishes_from_catalog(fields, sort_by, updated_since)
+        return create_json_response({
+            'dishes': dishes_list,
+            'count': len(dishes_list)
+        })
+
+    session = db_session.create_session()
 
-        dishes_list.append(dish_data)
+    favourite_ids = favourite_cache.get(current_user.id) \
+        if current_user.is_authenticated and 'is_favourite' in fields else None
+    plan = DishQueryPlan(fields, user_id=current_user_id(), sort=sort_by, favourite_ids=favourite_ids)
+    # Фильтр идет по индексу ix_dishes_updated_at
+    where = Dish.updated_at > updated_since if updated_since is not None else None
+    # Как и раньше у представления dishes_with_ratings, средний рейтинг без округления
+    dishes_list = dishes_to_dicts(session, plan, where, round_average=False)
 
     session.close()
     return create_json_response({
@@ -121,15 +158,69 @@ def get_dishes():
 
 @api_bp.route('/dishes/<int:dish_id>', methods=['GET'])
 def get_dish(dish_id):
+    try:
+        fields = parse_fields(request.args.get('fields'), DETAIL_FIELDS)
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, 400)
+
     session = db_session.create_session()
-    dish = session.query(Dish).get(dish_id)
-    if not dish:
+    updated_at = session.query(Dish.updated_at).filter(Dish.id == dish_id).first()
+    if not updated_at:
         session.close()
         return create_json_response({'error': 'Dish not found'}, 404)
 
-    dish_data = dish_to_dict(dish, include_details=True, session=session)
+    etag, last_modified = http_cache.validators(updated_at[0], current_user_id(), *fields)
+    if http_cache.is_not_modified(etag, last_modified):
+        session.close()
+        return http_cache.not_modified_response(etag, last_modified)
+
+    plan = DishQueryPlan(fields, user_id=current_user_id(), per_row=True)
+    dish_data = dishes_to_dicts(session, plan, Dish.id == dish_id)[0]
     session.close()
-    return create_json_response({'dish': dish_data})
+    return http_cache.apply(create_json_response({'dish': dish_data}), etag, last_modified)
+
+
+@api_bp.route('/dishes/autocomplete', methods=['GET'])
+def autocomplete_dishes():
+    """Подсказки названий по префиксу из индекса в памяти (без запроса к блюдам)"""
+    prefix = request.args.get('prefix', '')
+    try:
+        limit = int(request.args.get('limit', AUTOCOMPLETE_TOP_K))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return create_json_response({'error': 'limit must be a positive integer'}, 400)
+
+    name_index.ensure_current()
+    suggestions = name_index.search(prefix, min(limit, AUTOCOMPLETE_MAX_TOP_K))
+    match = name_index.find(prefix)
+    return create_json_response({
+        'suggestions': [
+            {'id': dish_id, 'name': name,
+             'average_rating': round(average, 2) if average else 0, 'rating_count': count}
+            for dish_id, name, average, count in suggestions
+        ],
+        # Блюдо с таким же (без учета регистра) названием — форма предупреждает до отправки
+        'match': match
+    }, compact=True)
+
+
+@api_bp.route('/dishes/batch', methods=['POST'])
+def get_dishes_batch():
+    """POST-вариант мульти-получения для длинных списков id"""
+    if not request.json:
+        return create_json_response({'error': 'Empty request'}, 400)
+    if not isinstance(request.json, dict):
+        return create_json_response({'error': 'Expected a JSON object with ids'}, 400)
+    try:
+        ids = parse_ids(request.json.get('ids'))
+        fields = request.json.get('fields')
+        if isinstance(fields, list):
+            fields = ','.join(str(field) for field in fields)
+        fields = parse_fields(fields, DETAIL_FIELDS)
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, 400)
+    return get_dishes_by_ids(ids, fields)
 
 
 @api_bp.route('/dishes', methods=['POST'])
@@ -142,28 +233,25 @@ def create_dish():
     if not all(field in request.json for field in required_fields):
         return create_json_response({'error': 'Missing required fields'}, 400)
 
-    session = db_session.create_session()
+    with write_session() as session:
+        # Проверка уникальности названия
+        existing_dish = session.query(Dish).filter(
+            Dish.name == request.json['name']
+        ).first()
 
-    # Проверка уникальности названия
-    existing_dish = session.query(Dish).filter(
-        Dish.name == request.json['name']
-    ).first()
+        if existing_dish:
+            return create_json_response({'error': 'Dish with this name already exists'}, 400)
+        dish = Dish(
+            name=request.json['name'],
+            ingredients=request.json['ingredients'],
+            url=request.json.get('url')
+        )
+        if not is_youtube_link(dish.url) and dish.url != "":
+            return create_json_response({'error': 'The link should lead to YouTube'}, 400)
 
-    if existing_dish:
-        session.close()
-        return create_json_response({'error': 'Dish with this name already exists'}, 400)
-    dish = Dish(
-        name=request.json['name'],
-        ingredients=request.json['ingredients'],
-        url=request.json.get('url')
-    )
-    if not is_youtube_link(dish.url) and dish.url != "":
-        return create_json_response({'error': 'The link should lead to YouTube'}, 400)
-
-    session.add(dish)
-    session.commit()
-    dish_id = dish.id
-    session.close()
+        session.add(dish)
+        session.flush()
+        dish_id = dish.id
 
     return get_dish(dish_id)
 
@@ -173,57 +261,73 @@ def create_dish():
 def update_dish(dish_id):
     if not request.json:
         return create_json_response({'error': 'Empty request'}, 400)
-    session = db_session.create_session()
-    dish = session.query(Dish).get(dish_id)
-    if not dish:
-        session.close()
-        return create_json_response({'error': 'Dish not found'}, 404)
-    # Проверяем права
-    if not can_edit_dish(dish, current_user):
-        session.close()
-        return create_json_response({'error': 'Permission denied'}, 403)
-    url = request.json.get("url", "")
-    if not is_youtube_link(url) and url != "":
-        return create_json_response({'error': 'The link should lead to YouTube'}, 400)
-    if dish.name != request.json["name"]:
-        existing_dish = session.query(Dish).filter(
-            Dish.name == request.json["name"],
-            Dish.id != dish.name
-        ).first()
-        if existing_dish:
-            return create_json_response({'error': 'Dish with this name already exists'}, 400)
-    # Обновляем поля
-    fields = ['name', 'ingredients', 'url']
-    for field in fields:
-        if field in request.json:
-            setattr(dish, field, request.json[field])
-    session.commit()
-    session.close()
+    with write_session() as session:
+        dish = session.query(Dish).get(dish_id)
+        if not dish:
+            return create_json_response({'error': 'Dish not found'}, 404)
+        # Проверяем права
+        if not can_edit_dish(dish, current_user):
+            return create_json_response({'error': 'Permission denied'}, 403)
+        url = request.json.get("url", "")
+        if not is_youtube_link(url) and url != "":
+            return create_json_response({'error': 'The link should lead to YouTube'}, 400)
+        if dish.name != request.json["name"]:
+            existing_dish = session.query(Dish).filter(
+                Dish.name == request.json["name"],
+                Dish.id != dish.name
+            ).first()
+            if existing_dish:
+                return create_json_response({'error': 'Dish with this name already exists'}, 400)
+        # Обновляем поля
+        fields = ['name', 'ingredients', 'url']
+        for field in fields:
+            if field in request.json:
+                setattr(dish, field, request.json[field])
     return get_dish(dish_id)
 
 
 @api_bp.route('/dishes/<int:dish_id>', methods=['DELETE'])
 @login_required
 def delete_dish(dish_id):
-    session = db_session.create_session()
-    dish = session.query(Dish).get(dish_id)
+    with write_session() as session:
+        dish = session.query(Dish).get(dish_id)
 
-    if not dish:
-        session.close()
-        return create_json_response({'error': 'Dish not found'}, 404)
+        if not dish:
+            return create_json_response({'error': 'Dish not found'}, 404)
 
-    # Проверяем права
-    if not can_edit_dish(dish, current_user):
-        session.close()
-        return create_json_response({'error': 'Permission denied'}, 403)
+        # Проверяем права
+        if not can_edit_dish(dish, current_user):
+            return create_json_response({'error': 'Permission denied'}, 403)
 
-    session.delete(dish)
-    session.commit()
-    session.close()
+        session.delete(dish)
+    favourite_cache.discard_dish(dish_id)
 
     return create_json_response({'success': 'Dish deleted'})
 
 
+@api_bp.route('/dishes/<int:dish_id>/similar-ingredients', methods=['GET'])
+def get_similar_dishes(dish_id):
+    """Блюда с похожими ингредиентами (приближенно, через LSH-корзины)"""
+    try:
+        limit = int(request.args.get('limit', similar_dishes.SIMILAR_LIMIT))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return create_json_response({'error': 'limit must be a positive integer'}, 400)
+
+    session = db_session.create_session()
+    if not session.query(Dish.id).filter(Dish.id == dish_id).first():
+        session.close()
+        return create_json_response({'error': 'Dish not found'}, 404)
+    similar = similar_dishes.find_similar(session, dish_id, min(limit, similar_dishes.MAX_SIMILAR_LIMIT))
+    session.close()
+    return create_json_response({
+        'dish_id': dish_id,
+        'similar': [{'id': other_id, 'name': name, 'similarity': similarity}
+                    for other_id, name, similarity in similar]
+    })
+
+
 # Рейтинги
 @api_bp.route('/dishes/<int:dish_id>/rate', methods=['POST'])
 @login_required
@@ -235,25 +339,24 @@ def rate_dish_api(dish_id):
     if not isinstance(rating, int) or rating < 1 or rating > 5:
         return create_json_response({'error': 'Rating must be integer between 1 and 5'}, 400)
 
-    session = db_session.create_session()
-
-    dish_rating = session.query(DishRating).filter(
-        DishRating.user_id == current_user.id,
-        DishRating.dish_id == dish_id
-    ).first()
-
-    if dish_rating:
-        dish_rating.rating = rating
-    else:
-        dish_rating = DishRating(
-            user_id=current_user.id,
-            dish_id=dish_id,
-            rating=rating
-        )
-        session.add(dish_rating)
+    with write_session() as session:
+        dish_rating = session.query(DishRating).filter(
+            DishRating.user_id == current_user.id,
+            DishRating.dish_id == dish_id
+        ).first()
 
-    session.commit()
-    session.close()
+        previous = dish_rating.rating if dish_rating else None
+        if dish_rating:
+            dish_rating.rating = rating
+        else:
+            dish_rating = DishRating(
+                user_id=current_user.id,
+                dish_id=dish_id,
+                rating=rating
+            )
+            session.add(dish_rating)
+        trending.record(session, dish_id, rating, previous)
+        live.rating_changed(session, dish_id)
 
     return create_json_response({'message': 'Rating saved', 'rating': rating})
 
@@ -279,26 +382,27 @@ def get_user_rating(dish_id):
 @api_bp.route('/dishes/<int:dish_id>/favourite', methods=['POST'])
 @login_required
 def toggle_favourite_api(dish_id):
-    session = db_session.create_session()
-
-    favourite = session.query(Favourite).filter(
-        Favourite.user_id == current_user.id,
-        Favourite.dishes_id == dish_id
-    ).first()
+    with write_session() as session:
+        favourite = session.query(Favourite).filter(
+            Favourite.user_id == current_user.id,
+            Favourite.dishes_id == dish_id
+        ).first()
 
-    if favourite:
-        session.delete(favourite)
-        action = 'removed'
+        if favourite:
+            session.delete(favourite)
+            action = 'removed'
+        else:
+            favourite = Favourite(
+                user_id=current_user.id,
+                dishes_id=dish_id
+            )
+            session.add(favourite)
+            action = 'added'
+
+    if action == 'added':
+        favourite_cache.add(current_user.id, dish_id)
     else:
-        favourite = Favourite(
-            user_id=current_user.id,
-            dishes_id=dish_id
-        )
-        session.add(favourite)
-        action = 'added'
-
-    session.commit()
-    session.close()
+        favourite_cache.remove(current_user.id, dish_id)
 
     return create_json_response({
         'message': f'Dish {action} from favourites',
@@ -306,24 +410,203 @@ def toggle_favourite_api(dish_id):
     })
 
 
+@api_bp.route('/user/state', methods=['GET'])
+@login_required
+def get_user_state():
+    """Все оценки и избранное пользователя одним ответом (вместо /rating на каждое блюдо)"""
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            parse_version(since)
+        except ValueError as e:
+            return create_json_response({'error': str(e)}, 400)
+
+    session = db_session.create_session()
+    state = UserState.load(session, current_user.id)
+    session.close()
+
+    # ETag — сам токен версии. Last-Modified не отдаем: max(updated_at) уходит
+    # назад при удалении самой свежей строки, и If-Modified-Since дал бы ложный 304
+    etag = state.version
+    if http_cache.is_not_modified(etag, None):
+        return http_cache.not_modified_response(etag, None)
+
+    return http_cache.apply(create_json_response(state.to_dict(since), compact=True), etag, None)
+
+
 @api_bp.route('/user/favourites', methods=['GET'])
 @login_required
 def get_user_favourites():
-    session = db_session.create_session()
+    try:
+        fields = parse_fields(request.args.get('fields'), LIST_FIELDS)
+        page = int(request.args.get('page', 1))
+        per_page = min(int(request.args.get('per_page', FAVOURITES_PER_PAGE)), FAVOURITES_MAX_PER_PAGE)
+        if page < 1 or per_page < 1:
+            raise ValueError('page and per_page must be positive')
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, 400)
 
-    favourites = session.query(Favourite).filter(
-        Favourite.user_id == current_user.id
-    ).all()
+    session = db_session.create_session()
 
-    dishes = []
-    for fav in favourites:
-        dish = session.query(Dish).get(fav.dishes_id)
-        if dish:
-            dishes.append(dish_to_dict(dish, session=session))
+    # Один запрос: избранное join блюда, страница в порядке добавления
+    plan = DishQueryPlan(fields, user_id=current_user.id, per_row=True, favourites_only=True)
+    stmt = plan.statement().limit(per_page).offset((page - 1) * per_page)
+    dishes = plan.dicts(session.execute(stmt), round_average=True)
+    total = session.execute(plan.count_statement()).scalar()
 
     session.close()
 
     return create_json_response({
         'favourites': dishes,
-        'count': len(dishes)
+        'count': len(dishes),
+        'total': total,
+        'page': page,
+        'per_page': per_page
+    })
+
+
+@api_bp.route('/changes', methods=['GET'])
+@login_required
+def get_changes():
+    """Журнал изменений после seq=since; админ видит все, остальные — блюда и свое"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', CHANGES_PER_PAGE)), CHANGES_MAX_PER_PAGE)
+        if since < 0 or limit < 1:
+            raise ValueError('since must be >= 0 and limit positive')
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, 400)
+
+    session = db_session.create_session()
+    truncated = change_log.truncated_seq(session)
+    if since < truncated:
+        latest = change_log.latest_seq(session)
+        session.close()
+        # Клиент перечитывает данные целиком и продолжает с latest
+        return create_json_response({
+            'error': 'Changes after this seq were removed by retention, reload the data',
+            'oldest': truncated,
+            'latest': latest
+        }, 410)
+
+    # Граница читается первой: записи после нее попадут в следующую страницу
+    latest = max(change_log.latest_seq(session), since)
+    user_id = None if current_user.id == 1 else current_user.id
+    changes = change_log.read(session, since, limit + 1, user_id, until=latest)
+    session.close()
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return create_json_response({
+        'changes': [change.to_dict() for change in changes],
+        # Невидимые пользователю записи до latest пропускаются целиком
+        'next': changes[-1].seq if has_more else latest,
+        'has_more': has_more,
+        'latest': latest
+    })
+
+
+@api_bp.cli.command('changes-compact')
+def changes_compact():
+    """Схлопывает и очищает журнал изменений по сроку хранения"""
+    with write_session() as session:
+        removed = change_log.compact(session)
+    print(f"Удалено записей журнала: {removed}")
+
+
+@api_bp.cli.command('trending-refresh')
+def trending_refresh():
+    """Удаляет устаревшие корзины трендов и пересчитывает счета с затуханием"""
+    with write_session() as session:
+        count = trending.refresh(session)
+    print(f"Блюд в трендах: {count}")
+
+
+@api_bp.cli.command('similar-rebuild')
+def similar_rebuild():
+    """Пересчитывает MinHash-сигнатуры и LSH-корзины всех блюд"""
+    with write_session() as session:
+        count = similar_dishes.rebuild(session)
+    vectorized = 'numpy' if similar_dishes.numpy is not None else 'без numpy'
+    print(f"Сигнатур: {count} ({vectorized})")
+
+
+@api_bp.cli.command('maintenance')
+@click.option('--vacuum', is_flag=True, help='Разовый полный VACUUM с переводом в auto_vacuum = INCREMENTAL')
+def run_maintenance(vacuum):
+    """Выполняет обслуживание БД сейчас, не дожидаясь окна"""
+    runs = maintenance.full_vacuum() if vacuum else []
+    runs += maintenance.run()
+    for run in runs:
+        print(f"{run['task']}: {run['status']} ({run['duration']:.3f} с) {run['detail']}")
+
+
+@api_bp.route('/maintenance', methods=['GET'])
+@login_required
+def get_maintenance_history():
+    """История обслуживания БД, новые запуски первыми (только админ)"""
+    if current_user.id != 1:
+        return create_json_response({'error': 'Permission denied'}, 403)
+    session = db_session.create_write_session()
+    runs = maintenance.history(session)
+    session.close()
+    return create_json_response({'runs': runs})
+
+
+@api_bp.cli.command('backup')
+@click.option('--dir', 'directory', default=None, help='Каталог снимков (по умолчанию BACKUP_DIR)')
+@click.option('--keep', default=backup.KEEP, show_default=True, help='Сколько последних снимков хранить')
+def create_backup(directory, keep):
+    """Снимает сжатый снимок БД на ходу, не останавливая запись"""
+    info = backup.run(directory or current_app.config['BACKUP_DIR'], keep)
+    print(f"{info['path']}: {info['size']} байт, sha256 {info['sha256']}, "
+          f"перезапусков {info['restarts']}, {info['duration']:.2f} с")
+
+
+@api_bp.cli.command('restore')
+@click.argument('snapshot')
+@click.argument('destination')
+def restore_backup(snapshot, destination):
+    """Проверяет контрольную сумму снимка и распаковывает его в DESTINATION"""
+    print(f"Восстановлено в {backup.restore(snapshot, destination)}")
+
+
+@api_bp.route('/backups', methods=['GET'])
+@login_required
+def list_backups():
+    """Снимки БД, новые первыми (только админ)"""
+    if current_user.id != 1:
+        return create_json_response({'error': 'Permission denied'}, 403)
+    return create_json_response({'snapshots': [
+        {'path': path, 'size': os.path.getsize(path)} for path in backup.snapshots(current_app.config['BACKUP_DIR'])
+    ]})
+
+
+@api_bp.route('/backups', methods=['POST'])
+@login_required
+def create_backup_snapshot():
+    """Снимает снимок БД сейчас (только админ)"""
+    if current_user.id != 1:
+        return create_json_response({'error': 'Permission denied'}, 403)
+    try:
+        info = backup.run(current_app.config['BACKUP_DIR'])
+    except (backup.BackupError, OSError, sqlite3.Error) as e:
+        return create_json_response({'error': f'Backup failed: {e}'}, 500)
+    return create_json_response(info, 201)
+
+
+@api_bp.route('/metrics', methods=['GET'])
+@login_required
+def get_metrics():
+    """Счетчики для мониторинга (только админ)"""
+    if current_user.id != 1:
+        return create_json_response({'error': 'Permission denied'}, 403)
+    return create_json_response({
+        'writes': writes.stats,
+        'admission': admission.stats,
+        'compression': compression.stats,
+        'favourite_cache': {'hits': favourite_cache.hits, 'misses': favourite_cache.misses},
+        'cache': shared_cache.stats(),
+        'trending': trending.stats,
+        'similar_dishes': similar_dishes.stats
     })
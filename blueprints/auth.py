@@ -4,7 +4,7 @@ from urllib.parse import urlparse
 
 from data import db_session
 from data.users import User
-from forms.login import LoginForm, RegisterForm
+from data.writes import write_session
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -14,6 +14,7 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for('dishes.dishes_list'))
 
+    from forms.login import LoginForm
     form = LoginForm()
     if form.validate_on_submit():
         session = db_session.create_session()
@@ -45,26 +46,25 @@ def register():
     if current_user.is_authenticated:
         return redirect(url_for('dishes.dishes_list'))
 
+    from forms.login import RegisterForm
     form = RegisterForm()
     if form.validate_on_submit():
         if form.password.data != form.password_confirm.data:
             flash('Пароли не совпадают', 'danger')
             return redirect(url_for('auth.register'))
 
-        session = db_session.create_session()
-        existing_user = session.query(User).filter(User.login == form.login.data).first()
-
-        if existing_user:
-            flash('Пользователь с таким логином уже существует', 'danger')
-            session.close()
-            return redirect(url_for('auth.register'))
-
+        # Хэш пароля считается до транзакции, чтобы не держать блокировку записи
         user = User(login=form.login.data)
         user.set_password(form.password.data)
 
-        session.add(user)
-        session.commit()
-        session.close()
+        with write_session() as session:
+            existing_user = session.query(User).filter(User.login == form.login.data).first()
+
+            if existing_user:
+                flash('Пользователь с таким логином уже существует', 'danger')
+                return redirect(url_for('auth.register'))
+
+            session.add(user)
 
         flash('Регистрация успешна! Теперь вы можете войти.', 'success')
         return redirect(url_for('auth.login'))
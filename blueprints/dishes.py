@@ -1,12 +1,14 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session as flask_session, \
+    make_response, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import func, desc
 
-from data import db_session
-from data.dishes import Dish, DishWithRating
+from data import db_session, trending, similar_dishes, dish_rows
+from data.dishes import Dish
 from data.dish_ratings import DishRating
 from data.favourites import Favourite
-from forms.dish import AddDishForm
+from data.favourite_cache import favourite_cache
+from data.writes import write_session
+from extensions import http_cache, live
 
 dishes_bp = Blueprint('dishes', __name__)
 
@@ -33,71 +35,23 @@ def dishes_list():
     sort_by = request.args.get('sort', 'default')
 
     session = db_session.create_session()
+    favourite_ids = favourite_cache.get(current_user.id)
 
-    if sort_by == 'rating':
-        # Используем view для сортировки по рейтингу
-        dishes_query = session.query(DishWithRating).order_by(
-            desc(DishWithRating.average_rating)
-        ).all()
-    elif sort_by == 'favourites':
+    where = None
+    if sort_by == 'favourites':
         # Показываем только избранные
-        favourites = session.query(Favourite).filter(
-            Favourite.user_id == current_user.id
-        ).all()
-        dish_ids = [fav.dishes_id for fav in favourites]
-        dishes_query = session.query(DishWithRating).filter(
-            DishWithRating.id.in_(dish_ids)
-        ).all()
+        where = Dish.id.in_(favourite_ids)
     elif sort_by == 'my_dishes':
         # Только блюда текущего пользователя
-        # Получаем сначала все блюда, потом фильтруем
-        all_dishes = session.query(Dish).filter(
-            Dish.author_id == current_user.id
-        ).all()
-        my_dish_ids = [dish.id for dish in all_dishes]
-        if my_dish_ids:
-            dishes_query = session.query(DishWithRating).filter(
-                DishWithRating.id.in_(my_dish_ids)
-            ).all()
-        else:
-            dishes_query = []  # У пользователя нет своих блюд
-    else:
-        dishes_query = session.query(DishWithRating).all()
-
-    # Получаем дополнительную информацию для каждого блюда
-    dishes = []
-    for dish_view in dishes_query:
-        dish_full = session.query(Dish).filter(Dish.id == dish_view.id).first()
-        can_edit = False
-        if dish_full.author_id == current_user.id or current_user.id == 1:
-            can_edit = True
-        dish_info = {
-            'id': dish_view.id,
-            'name': dish_view.name,
-            'ingredients': dish_view.ingredients,
-            'url': dish_view.url,
-            'average_rating': dish_view.average_rating,
-            'rating_count': dish_view.rating_count,
-            'is_favourite': False,
-            'user_rating': None,
-            'can_edit': can_edit
-        }
-
-        # Проверяем, в избранном ли
-        favourite = session.query(Favourite).filter(
-            Favourite.user_id == current_user.id,
-            Favourite.dishes_id == dish_view.id
-        ).first()
-        dish_info['is_favourite'] = favourite is not None
-
-        # Получаем оценку пользователя
-        user_rating = session.query(DishRating).filter(
-            DishRating.user_id == current_user.id,
-            DishRating.dish_id == dish_view.id
-        ).first()
-        dish_info['user_rating'] = user_rating.rating if user_rating else None
+        where = Dish.author_id == current_user.id
 
-        dishes.append(dish_info)
+    if current_app.config['CATALOG_IN_MEMORY'] and sort_by != 'trending':
+        # Блюда и агрегаты из каталога в памяти, из БД — только оценки пользователя
+        dishes = dish_rows.from_catalog(session, current_user.id, sort=sort_by, favourite_ids=favourite_ids)
+    else:
+        # Один Core-запрос: агрегаты, оценка пользователя и права без ORM-сущностей
+        # (sort=trending — готовые счета трендов, первые TOP_K)
+        dishes = dish_rows.load(session, current_user.id, sort=sort_by, where=where, favourite_ids=favourite_ids)
 
     session.close()
 
@@ -114,68 +68,63 @@ def dishes_list():
 def dish_detail(dish_id):
     session = db_session.create_session()
 
-    dish = session.query(Dish).get(dish_id)
-    if not dish:
+    favourite_ids = favourite_cache.get(current_user.id)
+    found = dish_rows.load(session, current_user.id, where=Dish.id == dish_id,
+                           favourite_ids=favourite_ids, per_row=True)
+    if not found:
         flash('Блюдо не найдено', 'danger')
         session.close()
         return redirect(url_for('dishes.dishes_list'))
+    dish = found[0]
 
-    # Получаем информацию из view
-    dish_view = session.query(DishWithRating).get(dish_id)
-    # Получаем оценку пользователя
-    user_rating = session.query(DishRating).filter(
-        DishRating.user_id == current_user.id,
-        DishRating.dish_id == dish_id
-    ).first()
-
-    # Проверяем, в избранном ли
-    favourite = session.query(Favourite).filter(
-        Favourite.user_id == current_user.id,
-        Favourite.dishes_id == dish_id
-    ).first()
-
+    # Похожие блюда меняются вместе с другими блюдами — они тоже входят в ETag
+    similar = similar_dishes.find_similar(session, dish_id)
     session.close()
 
-    return render_template('dish_detail.html',
-                           title=dish.name,
-                           dish=dish,
-                           dish_view=dish_view,
-                           user_rating=user_rating.rating if user_rating else None,
-                           is_favourite=favourite is not None,
-                           get_navbar=get_navbar(),
-                           get_footer=get_footer())
+    # Непоказанные flash-сообщения нельзя потерять за ответом 304
+    etag, last_modified = http_cache.validators(dish.updated_at, current_user.id, similar)
+    if '_flashes' in flask_session:
+        etag = last_modified = None
+    if http_cache.is_not_modified(etag, last_modified):
+        return http_cache.not_modified_response(etag, last_modified)
+
+    response = make_response(render_template('dish_detail.html',
+                                             title=dish.name,
+                                             dish=dish,
+                                             user_rating=dish.user_rating,
+                                             is_favourite=dish.is_favourite,
+                                             similar=similar,
+                                             get_navbar=get_navbar(),
+                                             get_footer=get_footer()))
+    return http_cache.apply(response, etag, last_modified)
 
 
 @dishes_bp.route('/dishes/add', methods=['GET', 'POST'])
 @login_required
 def add_dish():
+    from forms.dish import AddDishForm
     form = AddDishForm()
 
     if form.validate_on_submit():
-        session = db_session.create_session()
-
-        # Проверяем, есть ли уже такое блюдо
-        existing_dish = session.query(Dish).filter(
-            Dish.name == form.name.data
-        ).first()
+        with write_session() as session:
+            # Проверяем, есть ли уже такое блюдо
+            existing_dish = session.query(Dish).filter(
+                Dish.name == form.name.data
+            ).first()
 
-        if existing_dish:
-            flash('Блюдо с таким названием уже существует', 'danger')
-            session.close()
-            return redirect(url_for('dishes.add_dish'))
-        if not form.is_youtube_link(form.url.data) and form.url.data != "":
-            flash('Неверная ссылка', 'danger')
-            session.close()
-            return redirect(url_for('dishes.add_dish'))
-        dish = Dish(
-            name=form.name.data,
-            ingredients=form.ingredients.data,
-            url=form.url.data if form.url.data else None,
-            author_id=current_user.id
-        )
-        session.add(dish)
-        session.commit()
-        session.close()
+            if existing_dish:
+                flash('Блюдо с таким названием уже существует', 'danger')
+                return redirect(url_for('dishes.add_dish'))
+            if not form.is_youtube_link(form.url.data) and form.url.data != "":
+                flash('Неверная ссылка', 'danger')
+                return redirect(url_for('dishes.add_dish'))
+            dish = Dish(
+                name=form.name.data,
+                ingredients=form.ingredients.data,
+                url=form.url.data if form.url.data else None,
+                author_id=current_user.id
+            )
+            session.add(dish)
         flash(f'Блюдо "{form.name.data}" успешно добавлено!', 'success')
         return redirect(url_for('dishes.dishes_list'))
 
@@ -189,23 +138,20 @@ def add_dish():
 @dishes_bp.route('/dishes/<int:dish_id>/delete', methods=['POST'])
 @login_required
 def delete_dish(dish_id):
-    session = db_session.create_session()
-    dish = session.query(Dish).get(dish_id)
+    with write_session() as session:
+        dish = session.query(Dish).get(dish_id)
 
-    if not dish:
-        flash('Блюдо не найдено', 'danger')
-        session.close()
-        return redirect(url_for('dishes.dishes_list'))
+        if not dish:
+            flash('Блюдо не найдено', 'danger')
+            return redirect(url_for('dishes.dishes_list'))
 
-    if not can_edit_dish(dish, current_user):
-        flash('У вас нет прав для удаления этого блюда', 'danger')
-        session.close()
-        return redirect(url_for('dishes.dish_detail', dish_id=dish_id))
+        if not can_edit_dish(dish, current_user):
+            flash('У вас нет прав для удаления этого блюда', 'danger')
+            return redirect(url_for('dishes.dish_detail', dish_id=dish_id))
 
-    dish_name = dish.name
-    session.delete(dish)
-    session.commit()
-    session.close()
+        dish_name = dish.name
+        session.delete(dish)
+    favourite_cache.discard_dish(dish_id)
 
     flash(f'Блюдо "{dish_name}" успешно удалено!', 'success')
     return redirect(url_for('dishes.dishes_list'))
@@ -228,34 +174,38 @@ def edit_dish(dish_id):
         session.close()
         return redirect(url_for('dishes.dishes_list', dish_id=dish_id))
 
+    from forms.dish import AddDishForm
     form = AddDishForm()
     if form.validate_on_submit():
+        session.close()
         # Проверяем уникальность названия (если оно изменилось)
         print(form.name.data)
-        if dish.name != form.name.data:
-            existing_dish = session.query(Dish).filter(
-                Dish.name == form.name.data,
-                Dish.id != dish_id
-            ).first()
-            if existing_dish:
-                flash('Блюдо с таким названием уже существует', 'danger')
-                session.close()
-                return render_template('add_dish.html',
-                                       title='Редактировать блюдо',
-                                       form=form,
-                                       get_navbar=get_navbar(),
-                                       get_footer=get_footer())
-        if not form.is_youtube_link(form.url.data) and form.url.data != "":
-            flash('Неверная ссылка', 'danger')
-            session.close()
-            return redirect(url_for('dishes.edit_dish', dish_id=dish_id))
-        # Обновляем данные
-        dish.name = form.name.data
-        dish.ingredients = form.ingredients.data
-        dish.url = form.url.data if form.url.data else None
-
-        session.commit()
-        session.close()
+        with write_session() as session:
+            dish = session.query(Dish).get(dish_id)
+            if not dish:
+                flash('Блюдо не найдено', 'danger')
+                return redirect(url_for('dishes.dishes_list'))
+            if dish.name != form.name.data:
+                existing_dish = session.query(Dish).filter(
+                    Dish.name == form.name.data,
+                    Dish.id != dish_id
+                ).first()
+                if existing_dish:
+                    flash('Блюдо с таким названием уже существует', 'danger')
+                    return render_template('add_dish.html',
+                                           title='Редактировать блюдо',
+                                           form=form,
+                                           dish_id=dish_id,
+                                           get_navbar=get_navbar(),
+                                           get_footer=get_footer())
+            if not form.is_youtube_link(form.url.data) and form.url.data != "":
+                flash('Неверная ссылка', 'danger')
+                return redirect(url_for('dishes.edit_dish', dish_id=dish_id))
+            # Обновляем данные
+            dish.name = form.name.data
+            dish.ingredients = form.ingredients.data
+            dish.url = form.url.data if form.url.data else None
+
         flash(f'Блюдо "{form.name.data}" успешно обновлено!', 'success')
         return redirect(url_for('dishes.dish_detail', dish_id=dish_id))
 
@@ -270,6 +220,7 @@ def edit_dish(dish_id):
     return render_template('add_dish.html',
                            title='Редактировать блюдо1',
                            form=form,
+                           dish_id=dish_id,
                            get_navbar=get_navbar(),
                            get_footer=get_footer())
 
@@ -283,28 +234,27 @@ def rate_dish(dish_id):
         flash('Рейтинг должен быть от 1 до 5', 'danger')
         return redirect(url_for('dishes.dish_detail', dish_id=dish_id))
 
-    session = db_session.create_session()
-
-    # Проверяем, есть ли уже оценка
-    dish_rating = session.query(DishRating).filter(
-        DishRating.user_id == current_user.id,
-        DishRating.dish_id == dish_id
-    ).first()
+    with write_session() as session:
+        # Проверяем, есть ли уже оценка
+        dish_rating = session.query(DishRating).filter(
+            DishRating.user_id == current_user.id,
+            DishRating.dish_id == dish_id
+        ).first()
 
-    if dish_rating:
-        dish_rating.rating = rating
-        flash('Рейтинг обновлен', 'success')
-    else:
-        dish_rating = DishRating(
-            user_id=current_user.id,
-            dish_id=dish_id,
-            rating=rating
-        )
-        session.add(dish_rating)
-        flash('Рейтинг добавлен', 'success')
-
-    session.commit()
-    session.close()
+        previous = dish_rating.rating if dish_rating else None
+        if dish_rating:
+            dish_rating.rating = rating
+            flash('Рейтинг обновлен', 'success')
+        else:
+            dish_rating = DishRating(
+                user_id=current_user.id,
+                dish_id=dish_id,
+                rating=rating
+            )
+            session.add(dish_rating)
+            flash('Рейтинг добавлен', 'success')
+        trending.record(session, dish_id, rating, previous)
+        live.rating_changed(session, dish_id)
 
     return redirect(url_for('dishes.dish_detail', dish_id=dish_id))
 
@@ -312,26 +262,29 @@ def rate_dish(dish_id):
 @dishes_bp.route('/dishes/<int:dish_id>/toggle_favourite', methods=['POST'])
 @login_required
 def toggle_favourite(dish_id):
-    session = db_session.create_session()
-
-    favourite = session.query(Favourite).filter(
-        Favourite.user_id == current_user.id,
-        Favourite.dishes_id == dish_id
-    ).first()
+    with write_session() as session:
+        favourite = session.query(Favourite).filter(
+            Favourite.user_id == current_user.id,
+            Favourite.dishes_id == dish_id
+        ).first()
 
-    if favourite:
-        session.delete(favourite)
-        flash('Удалено из избранного', 'info')
+        if favourite:
+            session.delete(favourite)
+            added = False
+            flash('Удалено из избранного', 'info')
+        else:
+            favourite = Favourite(
+                user_id=current_user.id,
+                dishes_id=dish_id
+            )
+            session.add(favourite)
+            added = True
+            flash('Добавлено в избранное', 'success')
+
+    if added:
+        favourite_cache.add(current_user.id, dish_id)
     else:
-        favourite = Favourite(
-            user_id=current_user.id,
-            dishes_id=dish_id
-        )
-        session.add(favourite)
-        flash('Добавлено в избранное', 'success')
-
-    session.commit()
-    session.close()
+        favourite_cache.remove(current_user.id, dish_id)
 
     return redirect(url_for('dishes.dish_detail', dish_id=dish_id))
 
@@ -2,4 +2,7 @@ from . import users
 from . import db_session
 from . import dish_ratings
 from . import dishes
-from . import favourites
\ No newline at end of file
+from . import favourites
+from . import change_log
+from . import trending
+from . import similar_dishes
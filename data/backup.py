@@ -0,0 +1,183 @@
+"""Горячие резервные копии SQLite без остановки приложения.
+
+Копия снимается через online backup API: за шаг копируется
+PAGES_PER_STEP страниц, между шагами — пауза STEP_SLEEP. В WAL-режиме
+шаг только читает, поэтому писатели не ждут. Если базу изменило другое
+соединение, SQLite начинает копирование заново; после MAX_RESTARTS
+перезапусков остаток копируется одним шагом (одна читающая транзакция,
+писателей она тоже не блокирует).
+
+Снимок проверяется PRAGMA quick_check, сжимается gzip в
+snapshot-ГГГГММДД-ЧЧММСС-мкс.db.gz, рядом кладется .sha256 в формате
+sha256sum. В каталоге остаются последние KEEP снимков.
+
+restore() проверяет контрольную сумму и распаковывает снимок атомарно —
+так снимок становится репликой для чтения (DB_REPLICAS=...db.gz) или
+готовой базой для тестов.
+"""
+import glob
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from . import db_session
+
+DEFAULT_DIR = 'db/backups'
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.01
+MAX_RESTARTS = 3
+KEEP = 7
+BACKUP_INTERVAL = 24 * 60 * 60
+PREFIX = 'snapshot-'
+SUFFIX = '.db.gz'
+CHUNK = 1 << 20
+
+
+class BackupError(Exception):
+    """Снимок поврежден или не прошел проверку"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy(source, target, pages, sleep):
+    """Пошаговое копирование; возвращает число перезапусков из-за чужих записей"""
+    restarts = 0
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, remaining_before
+        # Остаток вырос — SQLite начал копирование заново
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _Restarted
+        remaining_before = remaining
+
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+    except _Restarted:
+        source.backup(target, pages=-1)
+    return restarts
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create(directory=DEFAULT_DIR, keep=KEEP, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, source_file=None):
+    """Снимает сжатый снимок primary; возвращает его описание"""
+    source_file = source_file or db_session.get_primary_engine().url.database
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    name = f"{PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+    path = os.path.join(directory, name + SUFFIX)
+    raw_path = os.path.join(directory, name + '.db.tmp')
+
+    source = sqlite3.connect(source_file)
+    target = sqlite3.connect(raw_path)
+    try:
+        restarts = _copy(source, target, pages, sleep)
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        page_count = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    try:
+        if check != 'ok':
+            raise BackupError(f"Снимок не прошел quick_check: {check}")
+        with open(raw_path, 'rb') as raw, gzip.open(path + '.tmp', 'wb', compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed, CHUNK)
+    finally:
+        os.remove(raw_path)
+    os.replace(path + '.tmp', path)
+    checksum = sha256(path)
+    with open(path + '.sha256', 'w') as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+
+    removed = rotate(directory, keep)
+    return {
+        'path': path,
+        'size': os.path.getsize(path),
+        'sha256': checksum,
+        'pages': page_count,
+        'restarts': restarts,
+        'duration': round(time.perf_counter() - started, 4),
+        'removed': removed,
+    }
+
+
+def snapshots(directory=DEFAULT_DIR):
+    """Снимки каталога, новые первыми"""
+    return sorted(glob.glob(os.path.join(directory, PREFIX + '*' + SUFFIX)), reverse=True)
+
+
+def rotate(directory=DEFAULT_DIR, keep=KEEP):
+    """Удаляет снимки сверх последних keep; возвращает удаленные пути"""
+    removed = snapshots(directory)[keep:]
+    for path in removed:
+        os.remove(path)
+        if os.path.exists(path + '.sha256'):
+            os.remove(path + '.sha256')
+    return removed
+
+
+def verify(path):
+    """Сверяет снимок с его .sha256; BackupError при расхождении"""
+    try:
+        with open(path + '.sha256') as f:
+            expected = f.read().split()[0]
+    except (OSError, IndexError):
+        raise BackupError(f"Нет контрольной суммы для {path}")
+    if sha256(path) != expected:
+        raise BackupError(f"Контрольная сумма {path} не совпадает")
+
+
+def restore(path, destination):
+    """Проверяет и распаковывает снимок в destination (атомарной заменой)"""
+    verify(path)
+    tmp_path = destination + '.tmp'
+    with gzip.open(path, 'rb') as packed, open(tmp_path, 'wb') as raw:
+        shutil.copyfileobj(packed, raw, CHUNK)
+    os.replace(tmp_path, destination)
+    return destination
+
+
+def run(directory=DEFAULT_DIR, keep=KEEP):
+    """create() с записью результата в историю обслуживания (maintenance_runs)"""
+    from . import maintenance
+
+    started_at = time.time()
+    try:
+        info = create(directory, keep)
+    except Exception as e:
+        maintenance.record([{'task': 'backup', 'started_at': started_at,
+                             'duration': round(time.time() - started_at, 4), 'status': 'error', 'detail': str(e)}])
+        raise
+    maintenance.record([{'task': 'backup', 'started_at': started_at, 'duration': info['duration'], 'status': 'ok',
+                         'detail': f"{info['path']} ({info['size']} байт, перезапусков: {info['restarts']})"}])
+    return info
+
+
+def start_scheduler(directory=DEFAULT_DIR, interval=BACKUP_INTERVAL, keep=KEEP):
+    """Фоновые снимки по расписанию; в prefork запускается только в мастере"""
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                run(directory, keep)
+            except Exception as e:
+                print(f"Не удалось снять резервную копию: {e}")
+
+    threading.Thread(target=loop, name='db-backup', daemon=True).start()
@@ -0,0 +1,288 @@
+"""Каталог блюд в памяти процесса: модель чтения для списков.
+
+Каталог небольшой по сравнению с памятью, а читается постоянно, поэтому
+при CATALOG_IN_MEMORY=1 списки /api/dishes и /dishes собираются отсюда,
+без запроса к блюдам и оценкам. БД нужна только для состояния
+пользователя (его оценки; избранное — из favourite_cache) и для первой
+загрузки.
+
+Блюда лежат в колоночных массивах по слотам: id, средняя оценка, число
+оценок и автор — в array (8 байт на значение, без объекта на число),
+название, ингредиенты, ссылка и время изменения — в списках. Слот
+удаленного блюда переиспользуется. Порядки списков — отсортированные
+индексы, которые меняются точечно (bisect) при изменении блюда:
+- по id (sort=default, избранное);
+- по (-средняя оценка, id) (sort=rating);
+- по (автор, id) (мои блюда).
+
+Как и индекс названий, каталог строится при первом запросе и догоняет
+журнал изменений (записи dish и rating): коммит в этом процессе —
+на следующем запросе, записи других процессов — не реже раза в
+SYNC_INTERVAL. Тренды и мульти-получение по id остаются в SQL.
+"""
+import bisect
+import threading
+import time
+from array import array
+
+from sqlalchemy import select, func, event
+from sqlalchemy.orm import Session
+
+from . import db_session
+from .change_log import ChangeLog, truncated_seq, latest_seq
+from .dish_query import DishQueryPlan, COLUMN_FIELDS
+from .dishes import Dish
+from .dish_ratings import DishRating
+
+SYNC_INTERVAL = 1.0
+# Поля загрузки: колонки блюда и агрегаты оценок
+LOAD_FIELDS = ('id',) + COLUMN_FIELDS + ('average_rating', 'rating_count')
+# author_id = NULL в массиве (id пользователей начинаются с 1)
+NO_AUTHOR = 0
+
+
+def user_ratings(session, user_id):
+    """Оценки пользователя: {id блюда: оценка} — единственный запрос для списка"""
+    return dict(session.execute(
+        select(DishRating.dish_id, DishRating.rating).where(DishRating.user_id == user_id)
+    ).all())
+
+
+class Catalog:
+    def __init__(self):
+        self._clear()
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self.loaded = False
+        self.cursor = 0
+        self.synced_at = 0.0
+        self.dirty = False
+
+    def _clear(self):
+        # Колонки по слотам; у свободного слота id = 0
+        self._ids = array('q')
+        self._averages = array('d')
+        self._counts = array('q')
+        self._authors = array('q')
+        self._names = []
+        self._ingredients = []
+        self._urls = []
+        self._updated_at = []
+        self._slots = {}
+        self._free = []
+        # Отсортированные индексы
+        self._by_id = []
+        self._by_rating = []
+        self._by_author = []
+
+    # --- изменение ---
+
+    def put(self, dish_id, name, ingredients, url, author_id, updated_at, average=0, count=0):
+        with self._lock:
+            average = float(average or 0)
+            author = author_id or NO_AUTHOR
+            slot = self._slots.get(dish_id)
+            if slot is None:
+                slot = self._free.pop() if self._free else self._append_slot()
+                self._slots[dish_id] = slot
+                self._ids[slot] = dish_id
+                bisect.insort(self._by_id, dish_id)
+            else:
+                # Ключи сортировки сменились — позиции в индексах тоже
+                _discard(self._by_rating, (-self._averages[slot], dish_id))
+                _discard(self._by_author, (self._authors[slot], dish_id))
+            bisect.insort(self._by_rating, (-average, dish_id))
+            bisect.insort(self._by_author, (author, dish_id))
+            self._averages[slot] = average
+            self._counts[slot] = count or 0
+            self._authors[slot] = author
+            self._names[slot] = name
+            self._ingredients[slot] = ingredients
+            self._urls[slot] = url
+            self._updated_at[slot] = updated_at
+
+    def _append_slot(self):
+        self._ids.append(0)
+        self._averages.append(0.0)
+        self._counts.append(0)
+        self._authors.append(NO_AUTHOR)
+        for column in (self._names, self._ingredients, self._urls, self._updated_at):
+            column.append(None)
+        return len(self._ids) - 1
+
+    def remove(self, dish_id):
+        with self._lock:
+            slot = self._slots.pop(dish_id, None)
+            if slot is None:
+                return
+            _discard(self._by_id, dish_id)
+            _discard(self._by_rating, (-self._averages[slot], dish_id))
+            _discard(self._by_author, (self._authors[slot], dish_id))
+            self._ids[slot] = 0
+            for column in (self._names, self._ingredients, self._urls, self._updated_at):
+                column[slot] = None
+            self._free.append(slot)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def reset(self):
+        """БД сменилась (db_session.reset): каталог строится заново при следующем запросе"""
+        with self._lock:
+            self._clear()
+            self.loaded = False
+            self.cursor = 0
+            self.synced_at = 0.0
+            self.dirty = False
+
+    # --- чтение ---
+
+    def _order(self, sort, author_id, only_ids, updated_since):
+        """Слоты блюд в порядке списка"""
+        slots = self._slots
+        if only_ids is not None:
+            ids = [dish_id for dish_id in sorted(only_ids) if dish_id in slots]
+        elif author_id is not None:
+            lo = bisect.bisect_left(self._by_author, (author_id,))
+            hi = bisect.bisect_left(self._by_author, (author_id + 1,))
+            ids = [dish_id for _, dish_id in self._by_author[lo:hi]]
+        elif sort == 'rating':
+            ids = [dish_id for _, dish_id in self._by_rating]
+        else:
+            ids = self._by_id
+        order = [slots[dish_id] for dish_id in ids]
+        if updated_since is not None:
+            updated_at = self._updated_at
+            order = [slot for slot in order if updated_at[slot] > updated_since]
+        return order
+
+    def rows(self, sort='default', author_id=None, only_ids=None):
+        """[(id, название, ингредиенты, ссылка, автор, изменено, средняя оценка, число оценок)]"""
+        with self._lock:
+            return [self._row(slot) for slot in self._order(sort, author_id, only_ids, None)]
+
+    def _row(self, slot):
+        count = self._counts[slot]
+        author = self._authors[slot]
+        return (self._ids[slot], self._names[slot], self._ingredients[slot], self._urls[slot],
+                None if author == NO_AUTHOR else author, self._updated_at[slot],
+                self._averages[slot] if count else 0, count)
+
+    def dicts(self, fields, sort='default', updated_since=None, favourite_ids=None, ratings=None,
+              round_average=False):
+        """Словари ответа API для полей fields — как DishQueryPlan.dicts() по тому же списку"""
+        with self._lock:
+            getters = []
+            for field in fields:
+                if field == 'id':
+                    getters.append(self._ids.__getitem__)
+                elif field in ('name', 'ingredients', 'url'):
+                    getters.append({'name': self._names, 'ingredients': self._ingredients,
+                                    'url': self._urls}[field].__getitem__)
+                elif field == 'average_rating':
+                    # Без оценок SQL отдает coalesce(NULL, 0) — целый 0
+                    getters.append(lambda slot, averages=self._averages, counts=self._counts:
+                                   (round(averages[slot], 2) if round_average else averages[slot])
+                                   if counts[slot] else 0)
+                elif field == 'rating_count':
+                    getters.append(self._counts.__getitem__)
+                elif field == 'is_favourite':
+                    ids = favourite_ids or ()
+                    getters.append(lambda slot, dish_ids=self._ids: dish_ids[slot] in ids)
+                elif field == 'user_rating':
+                    ratings = ratings or {}
+                    getters.append(lambda slot, dish_ids=self._ids: ratings.get(dish_ids[slot]))
+            return [dict(zip(fields, [get(slot) for get in getters]))
+                    for slot in self._order(sort, None, None, updated_since)]
+
+    # --- синхронизация с БД ---
+
+    def ensure_current(self):
+        """Строит каталог или догоняет журнал изменений, если пора"""
+        if self.loaded and not self.dirty and time.monotonic() - self.synced_at < SYNC_INTERVAL:
+            return
+        # Синхронизирует один поток, остальные отвечают по текущему состоянию
+        if not self._sync_lock.acquire(blocking=not self.loaded):
+            return
+        try:
+            self.dirty = False
+            # Из primary: каталог живет дольше окна read-your-writes
+            session = db_session.create_write_session()
+            try:
+                if not self.loaded or truncated_seq(session) > self.cursor:
+                    self._load(session)
+                else:
+                    self._catch_up(session)
+            finally:
+                session.close()
+            self.synced_at = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def _statement(self, per_row=False):
+        return DishQueryPlan(LOAD_FIELDS, per_row=per_row).statement()
+
+    def _columns(self, result):
+        keys = list(result.keys())
+        return [keys.index(field) for field in LOAD_FIELDS]
+
+    def _load(self, session):
+        cursor = latest_seq(session)
+        result = session.execute(self._statement())
+        columns = self._columns(result)
+        with self._lock:
+            self._clear()
+            for row in result:
+                self.put(*[row[i] for i in columns])
+            self.cursor = cursor
+            self.loaded = True
+
+    def _catch_up(self, session):
+        changed = session.execute(
+            select(ChangeLog.dish_id, func.max(ChangeLog.seq))
+            .where(ChangeLog.seq > self.cursor, ChangeLog.entity.in_(('dish', 'rating')))
+            .group_by(ChangeLog.dish_id)
+        ).all()
+        if not changed:
+            return
+        dish_ids = {dish_id for dish_id, _ in changed if dish_id is not None}
+        result = session.execute(self._statement(per_row=True).where(Dish.id.in_(dish_ids)))
+        columns = self._columns(result)
+        with self._lock:
+            found = set()
+            for row in result:
+                values = [row[i] for i in columns]
+                found.add(values[0])
+                self.put(*values)
+            for dish_id in dish_ids - found:
+                self.remove(dish_id)
+            self.cursor = max(self.cursor, max(seq for _, seq in changed))
+
+
+def _discard(items, item):
+    position = bisect.bisect_left(items, item)
+    if position < len(items) and items[position] == item:
+        del items[position]
+
+
+catalog = Catalog()
+db_session.on_reset(catalog.reset)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Dish, DishRating)):
+            session.info['catalog_dirty'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('catalog_dirty', False):
+        catalog.dirty = True
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('catalog_dirty', None)
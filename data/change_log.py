@@ -0,0 +1,96 @@
+"""Журнал изменений блюд, оценок и избранного.
+
+Строки добавляют триггеры SQLite (миграция 5) в той же транзакции, что и
+само изменение, поэтому в журнал попадают и ORM, и массовые/сырые
+запросы. seq — AUTOINCREMENT: номера только растут и не переиспользуются
+даже после очистки, так что потребитель (кэши, поиск, рейтинги)
+запоминает последний обработанный seq и читает продолжение.
+
+Хранение:
+- записи старше COMPACT_AFTER, у которых есть более поздняя запись о той
+  же сущности, удаляются — потребителю важно только последнее изменение;
+- записи старше RETENTION удаляются целиком, граница запоминается в
+  change_log_state. Потребитель, отставший дальше нее, получает 410 и
+  должен перечитать данные заново.
+"""
+import time
+
+import sqlalchemy
+from sqlalchemy import select, text, or_
+
+from .db_session import SqlAlchemyBase
+
+COMPACT_AFTER = 60 * 60
+RETENTION = 7 * 24 * 60 * 60
+
+
+class ChangeLog(SqlAlchemyBase):
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        sqlalchemy.Index('ix_change_log_entity', 'entity', 'entity_id'),
+        sqlalchemy.Index('ix_change_log_changed_at', 'changed_at'),
+    )
+
+    seq = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    entity = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    entity_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    # insert / update / delete
+    op = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    dish_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    changed_at = sqlalchemy.Column(sqlalchemy.Float, nullable=False)
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'entity': self.entity,
+            'id': self.entity_id,
+            'op': self.op,
+            'dish_id': self.dish_id,
+            'user_id': self.user_id,
+            'changed_at': self.changed_at
+        }
+
+    def __repr__(self):
+        return f"<ChangeLog> {self.seq} {self.op} {self.entity}:{self.entity_id}"
+
+
+def truncated_seq(session):
+    """Последний seq, удаленный по сроку хранения (0 — ничего не удалялось)"""
+    return session.execute(text("SELECT truncated_seq FROM change_log_state")).scalar() or 0
+
+
+def latest_seq(session):
+    return session.execute(select(sqlalchemy.func.max(ChangeLog.seq))).scalar() or 0
+
+
+def read(session, since, limit, user_id=None, until=None):
+    """Записи с since < seq <= until по возрастанию; user_id — только блюда и свои изменения"""
+    stmt = select(ChangeLog).where(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit)
+    if until is not None:
+        stmt = stmt.where(ChangeLog.seq <= until)
+    if user_id is not None:
+        stmt = stmt.where(or_(ChangeLog.entity == 'dish', ChangeLog.user_id == user_id))
+    return session.execute(stmt).scalars().all()
+
+
+def compact(session, now=None, compact_after=COMPACT_AFTER, retention=RETENTION):
+    """Схлопывает старые записи и удаляет просроченные; возвращает число удаленных"""
+    now = time.time() if now is None else now
+    removed = session.execute(text("""
+        DELETE FROM change_log
+        WHERE changed_at < :horizon AND EXISTS (
+            SELECT 1 FROM change_log AS later
+            WHERE later.entity = change_log.entity
+              AND later.entity_id = change_log.entity_id
+              AND later.seq > change_log.seq
+        )"""), {'horizon': now - compact_after}).rowcount
+
+    cutoff = session.execute(text("SELECT MAX(seq) FROM change_log WHERE changed_at < :horizon"),
+                             {'horizon': now - retention}).scalar()
+    if cutoff:
+        removed += session.execute(text("DELETE FROM change_log WHERE seq <= :cutoff"),
+                                   {'cutoff': cutoff}).rowcount
+        session.execute(text("UPDATE change_log_state SET truncated_seq = MAX(truncated_seq, :cutoff)"),
+                        {'cutoff': cutoff})
+    return removed
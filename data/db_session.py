@@ -1,3 +1,9 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
@@ -6,10 +12,130 @@ import sqlalchemy.ext.declarative as dec
 SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
+__async_factory = None
+__db_file = None
+__engine = None
+__replicas = []
+
+# Максимально допустимое отставание реплики (сек), после которого чтение идет в primary
+MAX_REPLICA_LAG = 5.0
+# Как часто перепроверять здоровье реплик (сек)
+HEALTH_CHECK_INTERVAL = 2.0
+# Сколько секунд после собственной записи пользователь читает из primary
+READ_YOUR_WRITES_WINDOW = MAX_REPLICA_LAG
+
+# Ключ cookie-сессии со временем последней записи пользователя (unix time)
+WROTE_AT_KEY = '_db_wrote_at'
+
+_last_write = {}
+_last_write_lock = threading.Lock()
+# Сброс производных от БД кэшей процесса при reset()
+_reset_callbacks = []
+
+
+class Replica:
+    """Реплика только для чтения: движок, граница отставания и состояние проверки"""
+
+    def __init__(self, engine, max_lag=MAX_REPLICA_LAG, source_file=None):
+        self.engine = engine
+        self.max_lag = max_lag
+        # Для SQLite-снимка: путь к основному файлу, с которого он снят
+        self.source_file = source_file
+        self.healthy = False
+        self.closed = False
+        self.lag = None
+        self.checked_at = 0.0
+        # inode файла снимка, на который смотрят соединения пула
+        self.inode = None
+        self._lock = threading.Lock()
+
+    def measure_lag(self):
+        if self.engine.dialect.name == 'postgresql':
+            with self.engine.connect() as conn:
+                return float(conn.execute(sa.text(
+                    "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                )).scalar())
+
+        if self.source_file:
+            self._follow_snapshot()
+        with self.engine.connect() as conn:
+            conn.execute(sa.text("SELECT 1"))
+        if not self.source_file:
+            return 0.0
+        # Снимок отстает, только если primary менялся после его обновления
+        replica_mtime = os.path.getmtime(self.engine.url.database)
+        primary_mtime = max(
+            os.path.getmtime(path)
+            for path in (self.source_file, self.source_file + '-wal')
+            if os.path.exists(path)
+        )
+        if primary_mtime <= replica_mtime:
+            return 0.0
+        return time.time() - replica_mtime
+
+    def _follow_snapshot(self):
+        """Снимок заменили (другой процесс, например мастер prefork): сбрасываем пул.
+
+        Иначе соединения продолжат читать старый, уже удаленный файл, а
+        mtime по пути будет говорить о свежем снимке.
+        """
+        inode = os.stat(self.engine.url.database).st_ino
+        if self.inode is not None and inode != self.inode:
+            self.engine.dispose()
+        self.inode = inode
+
+    def check(self, force=False):
+        """Проверяет доступность и отставание; результат кэшируется на HEALTH_CHECK_INTERVAL"""
+        if not force and time.monotonic() - self.checked_at < HEALTH_CHECK_INTERVAL:
+            return self.healthy
+        with self._lock:
+            try:
+                self.lag = self.measure_lag()
+                self.healthy = self.lag <= self.max_lag
+            except Exception as e:
+                print(f"Реплика {self.engine.url} недоступна: {e}")
+                self.lag = None
+                self.healthy = False
+            self.checked_at = time.monotonic()
+        return self.healthy
+
+    def refresh_snapshot(self):
+        """Обновляет SQLite-снимок из primary через backup API и атомарную замену файла"""
+        path = self.engine.url.database
+        tmp_path = path + '.tmp'
+        source = sqlite3.connect(self.source_file)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, path)
+        # Старые соединения смотрят на удаленный файл
+        self.engine.dispose()
+        self.check(force=True)
+
+
+class RoutingSession(Session):
+    """Сессия, отправляющая чтение в реплику, а запись и flush — в primary"""
+
+    def __init__(self, *args, replica=None, primary=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+        # Движок записи вместо основного (очередь писателя, см. writes.py)
+        self.primary = primary
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        if self.replica is None or self._flushing or \
+                isinstance(clause, (sa.Insert, sa.Update, sa.Delete)):
+            # После первой записи сессия остается на primary
+            self.replica = None
+            return self.primary or get_primary_engine()
+        return self.replica.engine
 
 
 def global_init(db_file):
-    global __factory
+    global __factory, __db_file, __engine
 
     if __factory:
         return
@@ -21,13 +147,246 @@ def global_init(db_file):
     print(f"Подключение к базе данных по адресу {conn_str}")
 
     engine = sa.create_engine(conn_str, echo=False)
-    __factory = orm.sessionmaker(bind=engine)
+    __factory = orm.sessionmaker(bind=engine, class_=RoutingSession)
+    __db_file = db_file.strip()
+    __engine = engine
 
     from . import __all_models
+    from . import migrations
+    from . import writes
+
+    writes.configure_engine(engine)
+
+    # При теплом старте — один запрос к schema_version
+    migrations.upgrade(engine)
+
+
+def on_reset(callback):
+    """Регистрирует сброс кэша, построенного по текущей БД (индексы, множества избранного)"""
+    _reset_callbacks.append(callback)
+    return callback
+
+
+def reset():
+    """Отключает текущую БД: закрывает движки, забывает фабрики сессий и сбрасывает кэши.
+
+    После reset() global_init() можно вызвать с другим файлом — так тесты
+    получают свою копию базы.
+    """
+    global __factory, __async_factory, __db_file, __engine
+
+    from . import writes
+
+    writes.disable_lane()
+    remove_replicas()
+    if __async_factory:
+        # Соединения aiosqlite закрываются при сборке движка; ждать их здесь нечем
+        __async_factory.kw['bind'].sync_engine.dispose(close=False)
+    if __engine is not None:
+        __engine.dispose()
+    __factory = __async_factory = __db_file = __engine = None
+    with _last_write_lock:
+        _last_write.clear()
+    for callback in _reset_callbacks:
+        callback()
+
+
+def global_init_async(db_file=None):
+    """Создает асинхронный движок (aiosqlite) для ASGI-режима.
+
+    Схему не создает: таблицы уже подготовлены синхронным global_init.
+    Если файл не указан, используется тот же, что и у синхронного движка.
+    """
+    global __async_factory
+
+    if __async_factory:
+        return
+
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    db_file = db_file or __db_file
+    if not db_file or not db_file.strip():
+        raise Exception("Необходимо указать файл базы данных.")
+
+    conn_str = f'sqlite+aiosqlite:///{db_file.strip()}'
+    print(f"Асинхронное подключение к базе данных по адресу {conn_str}")
+
+    engine = create_async_engine(conn_str, echo=False)
+    __async_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    from . import __all_models
+
 
-    SqlAlchemyBase.metadata.create_all(engine)
+def get_primary_engine():
+    return __engine
+
+
+def add_replica(db_file_or_url, max_lag=MAX_REPLICA_LAG, snapshot_interval=None):
+    """Подключает реплику только для чтения.
+
+    Путь к файлу трактуется как SQLite-снимок primary; если задан
+    snapshot_interval, снимок периодически обновляется в фоновом потоке.
+    Сжатый снимок резервного копирования (.db.gz, см. backup.py)
+    проверяется и распаковывается рядом. URL (например,
+    postgresql://...) подключается как потоковая реплика.
+    """
+    if '://' in db_file_or_url:
+        engine = sa.create_engine(db_file_or_url, echo=False, pool_pre_ping=True)
+        replica = Replica(engine, max_lag)
+    else:
+        path = db_file_or_url.strip()
+        if path.endswith('.gz'):
+            from . import backup
+            path = backup.restore(path, path[:-len('.gz')])
+        engine = sa.create_engine(f'sqlite:///{path}?check_same_thread=False', echo=False)
+        replica = Replica(engine, max_lag, source_file=__db_file)
+        if snapshot_interval or not os.path.exists(path):
+            replica.refresh_snapshot()
+        if snapshot_interval:
+            _start_snapshot_refresher(replica, snapshot_interval)
+
+    replica.check(force=True)
+    __replicas.append(replica)
+    print(f"Подключена реплика {engine.url} (отставание: {replica.lag})")
+    return replica
+
+
+def remove_replicas():
+    for replica in __replicas:
+        replica.closed = True
+        replica.engine.dispose()
+    __replicas.clear()
+
+
+def get_replicas():
+    return list(__replicas)
+
+
+def _start_snapshot_refresher(replica, interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            if replica.closed:
+                return
+            try:
+                replica.refresh_snapshot()
+            except Exception as e:
+                print(f"Не удалось обновить снимок {replica.engine.url}: {e}")
+
+    threading.Thread(target=run, name='replica-snapshot', daemon=True).start()
+
+
+def _writer_key():
+    """Ключ «автора записи» для read-your-writes: пользователь или IP"""
+    from flask import has_request_context, request, session
+
+    if not has_request_context():
+        return None
+    # Берем id из cookie-сессии, а не current_user: load_user сам создает сессию БД
+    user_id = session.get('_user_id')
+    if user_id:
+        return f'user:{user_id}'
+    return f'ip:{request.remote_addr}'
+
+
+def mark_write():
+    """Запоминает запись текущего пользователя: его чтения временно идут в primary.
+
+    Время записи кладется и в подписанную cookie-сессию: при prefork
+    следующий запрос может попасть в другой воркер, где словаря
+    _last_write с этой записью нет.
+    """
+    from flask import session
+
+    key = _writer_key()
+    if key is None:
+        return
+    session[WROTE_AT_KEY] = time.time()
+    with _last_write_lock:
+        _last_write[key] = time.monotonic()
+        # Не даем словарю расти бесконечно
+        if len(_last_write) > 10000:
+            horizon = time.monotonic() - READ_YOUR_WRITES_WINDOW
+            for stale in [k for k, t in _last_write.items() if t < horizon]:
+                del _last_write[stale]
+
+
+def _wrote_recently():
+    from flask import session
+
+    key = _writer_key()
+    if key is None:
+        return False
+    wrote_at = session.get(WROTE_AT_KEY)
+    if wrote_at is not None and time.time() - wrote_at < READ_YOUR_WRITES_WINDOW:
+        return True
+    with _last_write_lock:
+        last = _last_write.get(key)
+    return last is not None and time.monotonic() - last < READ_YOUR_WRITES_WINDOW
+
+
+def _choose_replica():
+    """Реплика для текущего запроса или None, если читать нужно из primary"""
+    from flask import has_request_context, request, g
+
+    if not __replicas or not has_request_context():
+        return None
+    if request.method not in ('GET', 'HEAD') or g.get('db_wrote') or _wrote_recently():
+        return None
+    healthy = [replica for replica in __replicas if replica.check()]
+    if not healthy:
+        return None
+    return random.choice(healthy)
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    from flask import has_request_context, g
+
+    if has_request_context():
+        g.db_wrote = True
+    mark_write()
+
+
+def _after_fork_in_child():
+    """После fork дочерний процесс не должен пользоваться соединениями родителя.
+
+    dispose(close=False) забывает унаследованный пул, не закрывая чужие
+    соединения; блокировки пересоздаются, т.к. в момент fork их мог
+    держать поток родителя (например, обновление снимка реплики).
+    """
+    global _last_write_lock
+    _last_write_lock = threading.Lock()
+    if __engine is not None:
+        __engine.dispose(close=False)
+    for replica in __replicas:
+        replica.engine.dispose(close=False)
+        replica._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 
 def create_session() -> Session:
     global __factory
-    return __factory()
+    return __factory(replica=_choose_replica())
+
+
+def create_write_session(engine=None):
+    """Сессия только для primary (или указанного движка записи); см. writes.write_session"""
+    global __factory
+    return __factory(replica=None, primary=engine)
+
+
+def create_async_session():
+    global __async_factory
+    return __async_factory()
+
+
+async def dispose_async():
+    """Закрывает соединения асинхронного движка (при остановке ASGI-сервера)"""
+    global __async_factory
+    if __async_factory:
+        await __async_factory.kw['bind'].dispose()
+        __async_factory = None
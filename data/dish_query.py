@@ -0,0 +1,209 @@
+"""Планировщик запросов к блюдам для API с выборочными полями (?fields=...).
+
+По списку запрошенных полей строится один Core-запрос: выбираются только
+нужные колонки, а агрегаты оценок, избранное и оценка пользователя
+подключаются только если они запрошены (или нужны для сортировки).
+"""
+from operator import itemgetter
+
+from sqlalchemy import select, func, exists, and_
+
+from .dishes import Dish
+from .dish_ratings import DishRating
+from .favourites import Favourite
+from .trending import DishTrending, TOP_K as TRENDING_TOP_K
+
+LIST_FIELDS = ('id', 'name', 'average_rating', 'rating_count', 'is_favourite')
+DETAIL_FIELDS = LIST_FIELDS + ('ingredients', 'url', 'user_rating')
+ALL_FIELDS = DETAIL_FIELDS
+
+COLUMN_FIELDS = ('name', 'ingredients', 'url', 'author_id', 'updated_at')
+
+
+def parse_fields(value, default):
+    """Разбирает ?fields=id,name; None — поля по умолчанию; ValueError на неизвестных"""
+    if not value:
+        return list(default)
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if not field:
+            continue
+        if field not in ALL_FIELDS:
+            raise ValueError(f"Unknown field: {field}. Allowed: {', '.join(ALL_FIELDS)}")
+        if field not in fields:
+            fields.append(field)
+    if not fields:
+        raise ValueError('Empty fields')
+    return fields
+
+
+class DishQueryPlan:
+    """План запроса: какие колонки выбрать и что присоединить.
+
+    per_row=True — агрегаты считаются коррелированными подзапросами по
+    индексу (для одного или нескольких блюд), иначе — одним GROUP BY по
+    всем оценкам, присоединенным к списку.
+    """
+
+    def __init__(self, fields, user_id=None, sort='default', per_row=False,
+                 favourite_ids=None, favourites_only=False):
+        self.fields = list(fields)
+        self.user_id = user_id
+        self.sort = sort
+        self.per_row = per_row
+        # Готовое множество избранного (из кэша) — тогда is_favourite не идет в SQL
+        self.favourite_ids = favourite_ids
+        # Только избранное пользователя: join с favourites в порядке добавления
+        self.favourites_only = favourites_only
+
+    def statement(self):
+        dishes = Dish.__table__
+        ratings = DishRating.__table__
+        favourites = Favourite.__table__
+        trending = DishTrending.__table__
+        fields = self.fields
+
+        columns = [dishes.c.id]
+        for field in COLUMN_FIELDS:
+            if field in fields:
+                columns.append(dishes.c[field])
+
+        source = dishes
+        if self.favourites_only:
+            source = source.join(favourites, and_(
+                favourites.c.dishes_id == dishes.c.id,
+                favourites.c.user_id == self.user_id
+            ))
+        elif self.sort == 'trending':
+            # Готовые счета: первые TOP_K по индексу ix_dish_trending_score
+            source = source.join(trending, trending.c.dish_id == dishes.c.id)
+        average = count = None
+        need_average = 'average_rating' in fields or self.sort == 'rating'
+        need_count = 'rating_count' in fields
+        if need_average or need_count:
+            if self.per_row:
+                average = select(func.avg(ratings.c.rating)) \
+                    .where(ratings.c.dish_id == dishes.c.id).scalar_subquery()
+                count = select(func.count(ratings.c.rating)) \
+                    .where(ratings.c.dish_id == dishes.c.id).scalar_subquery()
+            else:
+                aggregates = select(
+                    ratings.c.dish_id,
+                    func.avg(ratings.c.rating).label('average'),
+                    func.count(ratings.c.rating).label('count')
+                ).group_by(ratings.c.dish_id).subquery('rating_aggregates')
+                source = source.outerjoin(aggregates, aggregates.c.dish_id == dishes.c.id)
+                average, count = aggregates.c.average, aggregates.c.count
+            average = func.coalesce(average, 0)
+            if need_average:
+                columns.append(average.label('average_rating'))
+            if need_count:
+                columns.append(func.coalesce(count, 0).label('rating_count'))
+
+        if self.user_id is not None:
+            if 'is_favourite' in fields and self.favourite_ids is None and not self.favourites_only:
+                columns.append(exists().where(and_(
+                    favourites.c.user_id == self.user_id,
+                    favourites.c.dishes_id == dishes.c.id
+                )).label('is_favourite'))
+            if 'user_rating' in fields:
+                columns.append(select(ratings.c.rating).where(and_(
+                    ratings.c.user_id == self.user_id,
+                    ratings.c.dish_id == dishes.c.id
+                )).limit(1).scalar_subquery().label('user_rating'))
+
+        stmt = select(*columns).select_from(source)
+        if self.favourites_only:
+            stmt = stmt.order_by(favourites.c.id)
+        elif self.sort == 'rating':
+            stmt = stmt.order_by(average.desc(), dishes.c.id)
+        elif self.sort == 'trending':
+            stmt = stmt.order_by(trending.c.score.desc(), dishes.c.id).limit(TRENDING_TOP_K)
+        else:
+            stmt = stmt.order_by(dishes.c.id)
+        return stmt
+
+    def count_statement(self):
+        """Число строк без агрегатов и сортировки (для пагинации)"""
+        return select(func.count()).select_from(self.statement().with_only_columns(
+            Dish.__table__.c.id).order_by(None).subquery())
+
+    def serializer(self, keys, round_average=False):
+        """Собирает функцию строка -> словарь ответа для колонок keys (один раз на результат).
+
+        Разбор полей (какая колонка, округление, избранное из кэша)
+        выполняется здесь, а не на каждой строке; строка читается по
+        индексу, без row._mapping.
+        """
+        keys = list(keys)
+        getters = []
+        for field in self.fields:
+            if field in keys:
+                index = keys.index(field)
+                if field == 'average_rating' and round_average:
+                    getters.append(lambda row, i=index: round(row[i], 2) if row[i] else 0)
+                elif field == 'is_favourite':
+                    getters.append(lambda row, i=index: bool(row[i]))
+                else:
+                    getters.append(itemgetter(index))
+            elif field == 'is_favourite':
+                if self.favourites_only:
+                    getters.append(lambda row: True)
+                elif self.favourite_ids is not None:
+                    getters.append(lambda row, i=keys.index('id'), ids=self.favourite_ids: row[i] in ids)
+                else:
+                    getters.append(lambda row: False)
+            elif field == 'user_rating':
+                getters.append(lambda row: None)
+        fields = [field for field in self.fields if field in keys or field in ('is_favourite', 'user_rating')]
+
+        if all(isinstance(get, itemgetter) for get in getters):
+            # Только колонки как есть — один itemgetter на всю строку
+            columns = itemgetter(*[keys.index(field) for field in fields])
+            if len(fields) == 1:
+                return lambda row: {fields[0]: columns(row)}
+            return lambda row: dict(zip(fields, columns(row)))
+        return lambda row: dict(zip(fields, [get(row) for get in getters]))
+
+    def to_dict(self, row, round_average=False):
+        """Строка результата -> словарь ответа в порядке запрошенных полей"""
+        return self.serializer(row._fields, round_average)(row)
+
+    def dicts(self, result, round_average=False):
+        """Все строки результата -> словари; сериализатор собирается один раз"""
+        serialize = self.serializer(result.keys(), round_average)
+        return [serialize(row) for row in result]
+
+
+MAX_BATCH_IDS = 500
+
+
+def parse_ids(value):
+    """Список id из "1,2,3" или JSON-массива; порядок сохраняется, повторы убираются"""
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, list) or not value:
+        raise ValueError('ids must be a non-empty list of integers')
+    if len(value) > MAX_BATCH_IDS:
+        raise ValueError(f'Too many ids (max {MAX_BATCH_IDS})')
+
+    ids, seen = [], set()
+    for item in value:
+        if isinstance(item, bool):
+            raise ValueError('ids must be integers')
+        try:
+            dish_id = int(item)
+        except (TypeError, ValueError):
+            raise ValueError('ids must be integers')
+        if dish_id not in seen:
+            seen.add(dish_id)
+            ids.append(dish_id)
+    return ids
+
+
+def in_requested_order(dishes_by_id, ids):
+    """Упорядочивает найденные блюда как в запросе; возвращает (блюда, ненайденные id)"""
+    ordered = [dishes_by_id[dish_id] for dish_id in ids if dish_id in dishes_by_id]
+    missing = [dish_id for dish_id in ids if dish_id not in dishes_by_id]
+    return ordered, missing
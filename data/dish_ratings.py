@@ -3,17 +3,25 @@ from sqlalchemy import orm
 from sqlalchemy_serializer import SerializerMixin
 
 from .db_session import SqlAlchemyBase
+from .timestamps import TimestampMixin
 
 
-class DishRating(SqlAlchemyBase, SerializerMixin):
+class DishRating(SqlAlchemyBase, TimestampMixin, SerializerMixin):
     __tablename__ = 'dish_ratings'
+    # Покрывающие индексы: агрегаты по блюду (AVG/COUNT без чтения таблицы)
+    # и снимок оценок пользователя (/api/user/state)
+    __table_args__ = (
+        sqlalchemy.Index('ix_dish_ratings_dish_id_rating', 'dish_id', 'rating'),
+        sqlalchemy.Index('ix_dish_ratings_user_state',
+                         'user_id', 'dish_id', 'rating', 'created_at', 'updated_at'),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer,
                            primary_key=True, autoincrement=True)
     user_id = sqlalchemy.Column(sqlalchemy.Integer,
                                 sqlalchemy.ForeignKey("users.id"))
     dish_id = sqlalchemy.Column(sqlalchemy.Integer,
-                                sqlalchemy.ForeignKey("dishes.id"))
+                                sqlalchemy.ForeignKey("dishes.id", ondelete='CASCADE'))
     rating = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
 
     # Связи
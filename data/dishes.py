@@ -3,9 +3,10 @@ from sqlalchemy import orm
 from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy import func
 from .db_session import SqlAlchemyBase
+from .timestamps import TimestampMixin
 
 
-class Dish(SqlAlchemyBase, SerializerMixin):
+class Dish(SqlAlchemyBase, TimestampMixin, SerializerMixin):
     __tablename__ = 'dishes'
 
     id = sqlalchemy.Column(sqlalchemy.Integer,
@@ -17,9 +18,10 @@ class Dish(SqlAlchemyBase, SerializerMixin):
                                   sqlalchemy.ForeignKey("users.id"),
                                   nullable=True)
 
-    # Связи
-    ratings = orm.relationship("DishRating", back_populates='dish')
-    favourites = orm.relationship("Favourite", back_populates='dish')
+    # Связи; оценки и избранное удаляет сама БД (ON DELETE CASCADE),
+    # без passive_deletes ORM обнулил бы у них dish_id
+    ratings = orm.relationship("DishRating", back_populates='dish', cascade='all, delete', passive_deletes=True)
+    favourites = orm.relationship("Favourite", back_populates='dish', cascade='all, delete', passive_deletes=True)
     author = orm.relationship('User', backref='created_dishes')
 
     def get_average_rating(self, session=None):
@@ -0,0 +1,152 @@
+"""Кэш множеств избранных блюд по пользователям.
+
+Множество id загружается одним запросом при первом обращении, дальше
+эндпоинты переключения избранного обновляют его сами, а списки блюд
+отвечают на is_favourite без обращения к БД.
+
+Память ограничена LRU-вытеснением по числу пользователей и по суммарному
+числу id; TTL ограничивает расхождение между процессами-воркерами.
+
+Множества остаются в памяти процесса (проверка is_favourite — на каждую
+строку списка), но изменения рассылаются остальным воркерам через
+shared_cache.publish: при общем бэкенде (CACHE_URL) чужой воркер
+сбрасывает множество пользователя не позже чем через POLL_INTERVAL, а не
+по TTL.
+
+Загрузка идет без блокировки. Если пока она шла, избранное пользователя
+изменилось (add/remove/discard_dish), загруженное множество может быть
+уже устаревшим — оно отдается вызывающему, но в кэш не попадает.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from . import db_session, shared_cache
+from .favourites import Favourite
+
+MAX_USERS = 10000
+MAX_IDS = 1000000
+TTL = 60.0
+
+
+class FavouriteCache:
+    def __init__(self, max_users=MAX_USERS, max_ids=MAX_IDS, ttl=TTL):
+        self.max_users = max_users
+        self.max_ids = max_ids
+        self.ttl = ttl
+        # user_id -> (время загрузки, множество id блюд)
+        self._entries = OrderedDict()
+        self._size = 0
+        # user_id -> [число идущих загрузок, поколение]; поколение растет при каждом изменении
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, user_id):
+        # Всегда из primary: множество, прочитанное с отстающей реплики,
+        # прожило бы в кэше весь TTL — дольше окна read-your-writes
+        session = db_session.create_write_session()
+        try:
+            ids = set(session.execute(
+                select(Favourite.dishes_id).where(Favourite.user_id == user_id)
+            ).scalars())
+        finally:
+            session.close()
+        ids.discard(None)
+        return ids
+
+    def get(self, user_id):
+        """Множество id избранных блюд пользователя (не изменять снаружи)"""
+        shared_cache.poll()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            loading = self._loading.setdefault(user_id, [0, 0])
+            loading[0] += 1
+            generation = loading[1]
+
+        try:
+            ids = self._load(user_id)
+        finally:
+            with self._lock:
+                loading[0] -= 1
+                if not loading[0]:
+                    del self._loading[user_id]
+        with self._lock:
+            if loading[1] == generation:
+                self._store(user_id, ids)
+        return ids
+
+    def _changed(self, user_id):
+        """Вызывается под блокировкой: идущие загрузки пользователя устарели"""
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def _store(self, user_id, ids):
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            self._size -= len(old[1])
+        self._entries[user_id] = (time.monotonic(), ids)
+        self._size += len(ids)
+        while self._entries and (len(self._entries) > self.max_users or self._size > self.max_ids):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def is_favourite(self, user_id, dish_id):
+        return dish_id in self.get(user_id)
+
+    def add(self, user_id, dish_id):
+        """Вызывается после коммита добавления в избранное"""
+        shared_cache.publish('favourites', user_id)
+        with self._lock:
+            self._changed(user_id)
+            entry = self._entries.get(user_id)
+            if entry is not None and dish_id not in entry[1]:
+                entry[1].add(dish_id)
+                self._size += 1
+
+    def remove(self, user_id, dish_id):
+        shared_cache.publish('favourites', user_id)
+        with self._lock:
+            self._changed(user_id)
+            entry = self._entries.get(user_id)
+            if entry is not None and dish_id in entry[1]:
+                entry[1].discard(dish_id)
+                self._size -= 1
+
+    def discard_dish(self, dish_id):
+        """Блюдо удалено: убираем его из всех загруженных множеств"""
+        shared_cache.publish('favourites', None)
+        with self._lock:
+            for loading in self._loading.values():
+                loading[1] += 1
+            for _, ids in self._entries.values():
+                if dish_id in ids:
+                    ids.discard(dish_id)
+                    self._size -= 1
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            for loading_user_id in (self._loading if user_id is None else [user_id]):
+                self._changed(loading_user_id)
+            if user_id is None:
+                self._entries.clear()
+                self._size = 0
+            else:
+                entry = self._entries.pop(user_id, None)
+                if entry is not None:
+                    self._size -= len(entry[1])
+
+
+favourite_cache = FavouriteCache()
+db_session.on_reset(favourite_cache.invalidate)
+# Избранное изменил другой воркер (None — удалено блюдо, сбрасываются все)
+shared_cache.subscribe('favourites', favourite_cache.invalidate)
@@ -3,17 +3,22 @@ from sqlalchemy import orm
 from sqlalchemy_serializer import SerializerMixin
 
 from .db_session import SqlAlchemyBase
+from .timestamps import TimestampMixin
 
 
-class Favourite(SqlAlchemyBase, SerializerMixin):
+class Favourite(SqlAlchemyBase, TimestampMixin, SerializerMixin):
     __tablename__ = 'favourites'
+    # Покрывающий индекс для снимка избранного пользователя (/api/user/state)
+    __table_args__ = (
+        sqlalchemy.Index('ix_favourites_user_state', 'user_id', 'dishes_id', 'created_at', 'updated_at'),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer,
                            primary_key=True, autoincrement=True)
     user_id = sqlalchemy.Column(sqlalchemy.Integer,
                                 sqlalchemy.ForeignKey("users.id"))
     dishes_id = sqlalchemy.Column(sqlalchemy.Integer,
-                                  sqlalchemy.ForeignKey("dishes.id"))
+                                  sqlalchemy.ForeignKey("dishes.id", ondelete='CASCADE'))
 
     # Связи
     user = orm.relationship('User', back_populates='favourites')
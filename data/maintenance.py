@@ -0,0 +1,202 @@
+"""Фоновое обслуживание SQLite в тихие часы.
+
+Задачи выполняются по очереди, каждая в своей короткой транзакции:
+- change_log — компактификация журнала изменений;
+- analyze — ANALYZE, свежая статистика для планировщика запросов;
+- optimize — PRAGMA optimize;
+- incremental_vacuum — возврат до VACUUM_PAGES свободных страниц файлу
+  (только при auto_vacuum = INCREMENTAL; новые базы создаются так,
+  существующую переводит flask api maintenance --vacuum);
+- wal_checkpoint — перенос WAL в основной файл и обрезка WAL.
+
+Планировщик проверяет раз в CHECK_INTERVAL, пора ли: текущее время
+попадает в окно (MAINTENANCE_WINDOW, например 03:00-06:00), с прошлого
+запуска прошло не меньше RUN_EVERY и последние QUIET_SECONDS не было
+записей (по журналу изменений). История запусков хранится в таблице
+maintenance_runs, поэтому видна из любого процесса.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from . import db_session, change_log
+
+TASKS = ('change_log', 'analyze', 'optimize', 'incremental_vacuum', 'wal_checkpoint')
+# Сколько страниц возвращать за запуск (держим блокировку записи недолго)
+VACUUM_PAGES = 2000
+HISTORY_LIMIT = 500
+CHECK_INTERVAL = 5 * 60
+RUN_EVERY = 20 * 60 * 60
+QUIET_SECONDS = 60
+DEFAULT_WINDOW = '03:00-06:00'
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class Skipped(Exception):
+    """Задача неприменима к этой базе"""
+
+
+def parse_window(value):
+    """'ЧЧ:ММ-ЧЧ:ММ' -> (минута начала, минута конца); окно может переходить через полночь"""
+    try:
+        start, end = value.split('-')
+        minutes = []
+        for part in (start, end):
+            hours, mins = part.strip().split(':')
+            if not (0 <= int(hours) < 24 and 0 <= int(mins) < 60):
+                raise ValueError
+            minutes.append(int(hours) * 60 + int(mins))
+    except ValueError:
+        raise ValueError(f"Окно обслуживания должно иметь вид ЧЧ:ММ-ЧЧ:ММ, получено {value!r}")
+    return tuple(minutes)
+
+
+def in_window(window, now=None):
+    moment = datetime.fromtimestamp(time.time() if now is None else now)
+    minute = moment.hour * 60 + moment.minute
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def _change_log(session):
+    return f'удалено записей: {change_log.compact(session)}'
+
+
+def _analyze(session):
+    session.execute(text("ANALYZE"))
+    return 'ok'
+
+
+def _optimize(session):
+    session.execute(text("PRAGMA optimize"))
+    return 'ok'
+
+
+def _incremental_vacuum(session):
+    if session.execute(text("PRAGMA auto_vacuum")).scalar() != AUTO_VACUUM_INCREMENTAL:
+        raise Skipped('auto_vacuum не INCREMENTAL: flask api maintenance --vacuum')
+    free = session.execute(text("PRAGMA freelist_count")).scalar()
+    pages = min(free, VACUUM_PAGES)
+    # По странице на вызов: драйвер выполняет только первый шаг incremental_vacuum(N)
+    for _ in range(pages):
+        session.execute(text("PRAGMA incremental_vacuum(1)"))
+    return f'освобождено страниц: {pages} из {free}'
+
+
+def _wal_checkpoint(engine):
+    # Вне транзакции: внутри нее чекпойнт невозможен
+    connection = engine.raw_connection()
+    try:
+        busy, log, checkpointed = connection.cursor().execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    finally:
+        connection.close()
+    if busy:
+        return f'занято читателями: перенесено {checkpointed} из {log} страниц'
+    return f'перенесено страниц: {checkpointed}'
+
+
+SESSION_TASKS = {
+    'change_log': _change_log,
+    'analyze': _analyze,
+    'optimize': _optimize,
+    'incremental_vacuum': _incremental_vacuum,
+}
+
+
+def run(tasks=TASKS):
+    """Выполняет задачи и записывает историю; возвращает записи о запусках"""
+    from .writes import write_session
+
+    runs = []
+    for task in tasks:
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            if task == 'wal_checkpoint':
+                detail = _wal_checkpoint(db_session.get_primary_engine())
+            else:
+                with write_session() as session:
+                    detail = SESSION_TASKS[task](session)
+            status = 'ok'
+        except Skipped as e:
+            status, detail = 'skipped', str(e)
+        except Exception as e:
+            status, detail = 'error', str(e)
+        runs.append({'task': task, 'started_at': started_at, 'duration': round(time.perf_counter() - started, 4),
+                     'status': status, 'detail': detail})
+    record(runs)
+    return runs
+
+
+def full_vacuum():
+    """Разовый VACUUM с переводом базы в auto_vacuum = INCREMENTAL (блокирует запись на все время)"""
+    started_at = time.time()
+    started = time.perf_counter()
+    connection = db_session.get_primary_engine().raw_connection()
+    try:
+        cursor = connection.cursor()
+        before = cursor.execute("PRAGMA page_count").fetchone()[0]
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+        after = cursor.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        connection.close()
+    runs = [{'task': 'vacuum', 'started_at': started_at, 'duration': round(time.perf_counter() - started, 4),
+             'status': 'ok', 'detail': f'страниц: {before} -> {after}'}]
+    record(runs)
+    return runs
+
+
+def record(runs):
+    from .writes import write_session
+
+    with write_session() as session:
+        session.execute(text("""
+            INSERT INTO maintenance_runs (task, started_at, duration, status, detail)
+            VALUES (:task, :started_at, :duration, :status, :detail)"""), runs)
+        session.execute(text("DELETE FROM maintenance_runs WHERE id <= (SELECT MAX(id) FROM maintenance_runs) - :limit"),
+                        {'limit': HISTORY_LIMIT})
+
+
+def history(session, limit=50):
+    rows = session.execute(text("""
+        SELECT task, started_at, duration, status, detail FROM maintenance_runs
+        ORDER BY id DESC LIMIT :limit"""), {'limit': limit}).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def due(session, window, now=None):
+    """Пора ли обслуживание: окно, интервал с прошлого запуска и отсутствие записей"""
+    now = time.time() if now is None else now
+    if window is not None and not in_window(window, now):
+        return False
+    last_run = session.execute(text("SELECT MAX(started_at) FROM maintenance_runs")).scalar()
+    if last_run is not None and now - last_run < RUN_EVERY:
+        return False
+    last_write = session.execute(text("SELECT MAX(changed_at) FROM change_log")).scalar()
+    return last_write is None or now - last_write >= QUIET_SECONDS
+
+
+def start_scheduler(window, interval=CHECK_INTERVAL):
+    """Фоновый поток обслуживания; как и обновление трендов, в prefork запускается только в мастере"""
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                session = db_session.create_write_session()
+                try:
+                    ready = due(session, window)
+                finally:
+                    session.close()
+                if ready:
+                    run()
+            except Exception as e:
+                print(f"Не удалось выполнить обслуживание БД: {e}")
+
+    threading.Thread(target=loop, name='db-maintenance', daemon=True).start()
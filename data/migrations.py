@@ -0,0 +1,339 @@
+"""Версионирование схемы БД.
+
+Номер версии хранится в таблице schema_version (одна строка). При теплом
+старте выполняется один запрос на чтение версии; миграции применяются
+только если версия в базе меньше последней, по порядку и под
+блокировкой записи (BEGIN IMMEDIATE), чтобы несколько воркеров не
+мигрировали одновременно.
+
+Миграции описываются явным SQL, а не через metadata.create_all:
+иначе новая колонка модели попала бы в базовую схему и следующая
+миграция с ALTER TABLE упала бы на свежей базе.
+"""
+import re
+
+from sqlalchemy import text
+
+from . import writes
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Регистрирует миграцию; версии должны идти строго по возрастанию"""
+    def decorator(func):
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise Exception(f"Миграция {version} объявлена не по порядку")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    try:
+        return conn.execute(text("SELECT version FROM schema_version")).scalar() or 0
+    except Exception:
+        # Таблицы еще нет — база создана до версионирования или пустая
+        conn.rollback()
+        return 0
+
+
+def upgrade(engine):
+    """Доводит схему до последней версии, возвращает итоговую версию"""
+    with engine.connect() as conn:
+        version = current_version(conn)
+        if version >= latest_version():
+            return version
+
+        conn.rollback()
+        writes.begin_immediate(conn)
+        # Пока ждали блокировку, другой процесс мог уже мигрировать
+        version = current_version(conn)
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        for number, description, func in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Миграция {number}: {description}")
+            func(conn)
+            version = number
+
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"),
+                     {'version': version})
+        conn.commit()
+    return version
+
+
+DISHES_WITH_RATINGS_VIEW = """
+    CREATE VIEW dishes_with_ratings AS
+    SELECT
+        d.id,
+        d.name,
+        d.ingredients,
+        d.url,
+        COALESCE(AVG(dr.rating), 0) as average_rating,
+        COUNT(dr.rating) as rating_count
+    FROM dishes d
+    LEFT JOIN dish_ratings dr ON d.id = dr.dish_id
+    GROUP BY d.id
+"""
+
+
+@migration(1, 'Базовая схема: users, dishes, dish_ratings, favourites и dishes_with_ratings')
+def _initial_schema(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            login VARCHAR,
+            hashed_password VARCHAR,
+            PRIMARY KEY (id)
+        )"""))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_login ON users (login)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dishes (
+            id INTEGER NOT NULL,
+            name VARCHAR,
+            ingredients TEXT,
+            url VARCHAR,
+            author_id INTEGER,
+            PRIMARY KEY (id),
+            UNIQUE (name),
+            FOREIGN KEY(author_id) REFERENCES users (id)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dish_ratings (
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            dish_id INTEGER,
+            rating INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(dish_id) REFERENCES dishes (id)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS favourites (
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            dishes_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(dishes_id) REFERENCES dishes (id)
+        )"""))
+
+    # Старые версии create_all создавали dishes_with_ratings как таблицу
+    kind = conn.execute(text(
+        "SELECT type FROM sqlite_master WHERE name = 'dishes_with_ratings'"
+    )).scalar()
+    if kind == 'table':
+        conn.execute(text("DROP TABLE dishes_with_ratings"))
+    if kind != 'view':
+        conn.execute(text(DISHES_WITH_RATINGS_VIEW))
+
+
+@migration(2, 'created_at/updated_at для dishes, dish_ratings, favourites и индекс по updated_at')
+def _timestamps(conn):
+    for table in ('dishes', 'dish_ratings', 'favourites'):
+        columns = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+        for column in ('created_at', 'updated_at'):
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} DATETIME"))
+        conn.execute(text(
+            f"UPDATE {table} SET created_at = COALESCE(created_at, CURRENT_TIMESTAMP), "
+            f"updated_at = COALESCE(updated_at, CURRENT_TIMESTAMP)"
+        ))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_updated_at ON {table} (updated_at)"))
+
+
+@migration(3, 'Покрывающий индекс dish_ratings (dish_id, rating) для агрегатов')
+def _rating_aggregates_index(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_dish_ratings_dish_id_rating ON dish_ratings (dish_id, rating)"
+    ))
+
+
+@migration(4, 'Покрывающие индексы (user_id, dish_id, ...) для снимка состояния пользователя')
+def _user_state_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_dish_ratings_user_state "
+        "ON dish_ratings (user_id, dish_id, rating, created_at, updated_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_favourites_user_state "
+        "ON favourites (user_id, dishes_id, created_at, updated_at)"
+    ))
+
+
+# Для журнала изменений: сущность -> (таблица, колонка блюда, колонка пользователя,
+# колонки, изменение которых попадает в журнал)
+CHANGE_LOG_SOURCES = {
+    'dish': ('dishes', 'id', 'author_id', 'name, ingredients, url, author_id'),
+    'rating': ('dish_ratings', 'dish_id', 'user_id', 'user_id, dish_id, rating'),
+    'favourite': ('favourites', 'dishes_id', 'user_id', 'user_id, dishes_id'),
+}
+
+
+@migration(5, 'Журнал изменений change_log и триггеры на dishes, dish_ratings, favourites')
+def _change_log(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity VARCHAR NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op VARCHAR NOT NULL,
+            dish_id INTEGER,
+            user_id INTEGER,
+            changed_at FLOAT NOT NULL
+        )"""))
+    # Поиск более поздней записи о той же сущности при компактификации
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_change_log_entity ON change_log (entity, entity_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_change_log_changed_at ON change_log (changed_at)"))
+    conn.execute(text("CREATE TABLE IF NOT EXISTS change_log_state (truncated_seq INTEGER NOT NULL)"))
+    conn.execute(text("INSERT INTO change_log_state (truncated_seq) "
+                      "SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM change_log_state)"))
+
+    # Unix-время с долями секунды
+    now = "((julianday('now') - 2440587.5) * 86400.0)"
+    for entity, (table, dish_column, user_column, columns) in CHANGE_LOG_SOURCES.items():
+        for op, event, row in (('insert', 'AFTER INSERT', 'NEW'),
+                               ('update', f'AFTER UPDATE OF {columns}', 'NEW'),
+                               ('delete', 'AFTER DELETE', 'OLD')):
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_log {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (entity, entity_id, op, dish_id, user_id, changed_at)
+                    VALUES ('{entity}', {row}.id, '{op}', {row}.{dish_column}, {row}.{user_column}, {now});
+                END"""))
+
+
+@migration(6, 'Тренды: часовые корзины оценок dish_trending_buckets и счета dish_trending')
+def _trending(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dish_trending_buckets (
+            dish_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            score FLOAT NOT NULL,
+            PRIMARY KEY (dish_id, bucket),
+            FOREIGN KEY(dish_id) REFERENCES dishes (id) ON DELETE CASCADE
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dish_trending (
+            dish_id INTEGER NOT NULL,
+            score FLOAT NOT NULL,
+            PRIMARY KEY (dish_id),
+            FOREIGN KEY(dish_id) REFERENCES dishes (id) ON DELETE CASCADE
+        )"""))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_dish_trending_score ON dish_trending (score)"))
+
+    # Оценки последней недели раскладываются по корзинам часа их последнего изменения;
+    # затухание посчитает первое обновление трендов
+    conn.execute(text("""
+        INSERT OR IGNORE INTO dish_trending_buckets (dish_id, bucket, score)
+        SELECT dish_id, CAST(strftime('%s', updated_at) AS INTEGER) / 3600, SUM(rating) / 5.0
+        FROM dish_ratings
+        WHERE dish_id IN (SELECT id FROM dishes) AND updated_at >= datetime('now', '-7 days')
+        GROUP BY dish_id, CAST(strftime('%s', updated_at) AS INTEGER) / 3600"""))
+    conn.execute(text("""
+        INSERT OR IGNORE INTO dish_trending (dish_id, score)
+        SELECT dish_id, SUM(score) FROM dish_trending_buckets GROUP BY dish_id"""))
+
+
+@migration(7, 'Похожие по ингредиентам: MinHash-сигнатуры dish_minhash и LSH-корзины dish_lsh_bands')
+def _similar_dishes(conn):
+    from . import similar_dishes
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dish_minhash (
+            dish_id INTEGER NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY (dish_id),
+            FOREIGN KEY(dish_id) REFERENCES dishes (id) ON DELETE CASCADE
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dish_lsh_bands (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            dish_id INTEGER NOT NULL,
+            PRIMARY KEY (band, bucket, dish_id),
+            FOREIGN KEY(dish_id) REFERENCES dishes (id) ON DELETE CASCADE
+        )"""))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_dish_lsh_bands_dish_id ON dish_lsh_bands (dish_id)"))
+    # Сигнатуры считаются в Python, SQL здесь не справится
+    similar_dishes.rebuild(conn)
+
+
+# Таблица -> колонка со ссылкой на блюдо
+DISH_CHILD_TABLES = {
+    'dish_ratings': 'dish_id',
+    'favourites': 'dishes_id',
+}
+# Производные таблицы, у которых каскад был с самого начала (но без PRAGMA foreign_keys не работал)
+DISH_DERIVED_TABLES = ('dish_trending_buckets', 'dish_trending', 'dish_minhash', 'dish_lsh_bands')
+
+
+def _rebuild_with_cascade(conn, table, column):
+    """Пересоздает таблицу с ON DELETE CASCADE на dishes.
+
+    SQLite не умеет менять ограничение в ALTER TABLE: таблица создается
+    заново по ее же CREATE TABLE из sqlite_master, данные копируются,
+    затем возвращаются индексы и триггеры журнала изменений.
+    """
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :table"),
+                       {'table': table}).scalar()
+    reference = re.compile(rf'(FOREIGN KEY\s*\(\s*"?{column}"?\s*\)\s*REFERENCES\s+"?dishes"?\s*\(\s*"?id"?\s*\))'
+                           r'(?!\s*ON DELETE)', re.IGNORECASE)
+    if not reference.search(sql):
+        return
+    new_sql = reference.sub(r'\1 ON DELETE CASCADE', sql, count=1)
+    new_sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?\w+"?', f'CREATE TABLE {table}_new', new_sql)
+    dependents = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = :table AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ), {'table': table}).scalars().all()
+    columns = ', '.join(row[1] for row in conn.execute(text(f"PRAGMA table_info({table})")))
+
+    conn.exec_driver_sql(new_sql)
+    conn.execute(text(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}"))
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {table}_new RENAME TO {table}"))
+    for statement in dependents:
+        conn.exec_driver_sql(statement)
+
+
+@migration(8, 'ON DELETE CASCADE для dish_ratings и favourites, очистка осиротевших строк')
+def _cascade_deletes(conn):
+    # Строки удаленных блюд (ORM обнулял dish_id, массовый DELETE оставлял как есть)
+    # и несуществующих пользователей; удаления попадают в журнал изменений
+    for table, column in DISH_CHILD_TABLES.items():
+        conn.execute(text(f"""
+            DELETE FROM {table}
+            WHERE {column} IS NULL OR {column} NOT IN (SELECT id FROM dishes)
+               OR user_id IS NULL OR user_id NOT IN (SELECT id FROM users)"""))
+    for table in DISH_DERIVED_TABLES:
+        conn.execute(text(f"DELETE FROM {table} WHERE dish_id NOT IN (SELECT id FROM dishes)"))
+
+    # RENAME проверяет представления, а dishes_with_ratings ссылается на dish_ratings
+    views = conn.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'view'")).all()
+    for name, _ in views:
+        conn.execute(text(f"DROP VIEW {name}"))
+    for table, column in DISH_CHILD_TABLES.items():
+        _rebuild_with_cascade(conn, table, column)
+    for _, sql in views:
+        conn.exec_driver_sql(sql)
+
+
+@migration(9, 'История обслуживания БД maintenance_runs')
+def _maintenance_runs(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            id INTEGER NOT NULL,
+            task VARCHAR NOT NULL,
+            started_at FLOAT NOT NULL,
+            duration FLOAT NOT NULL,
+            status VARCHAR NOT NULL,
+            detail TEXT,
+            PRIMARY KEY (id)
+        )"""))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_maintenance_runs_started_at ON maintenance_runs (started_at)"))
@@ -0,0 +1,239 @@
+"""Индекс названий блюд в памяти для автодополнения.
+
+Названия нормализуются (casefold, ё -> е, одиночные пробелы) и лежат в
+отсортированном массиве пар (ключ, id): блюда с префиксом — это отрезок
+массива, найденный двумя bisect. Из отрезка берутся TOP_K блюд с
+наибольшим весом средняя_оценка * log(1 + число_оценок). Для коротких
+префиксов отрезок длинный, поэтому их результаты кэшируются; запись
+блюда сбрасывает только префиксы его ключа.
+
+Индекс строится при первом запросе и догоняет изменения по журналу
+изменений (записи dish и rating), поэтому видит и записи других
+процессов. Коммит в этом процессе, затронувший блюда или оценки,
+заставляет догнать журнал на следующем запросе; чужие записи
+подхватываются не реже раза в SYNC_INTERVAL.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, func, event
+from sqlalchemy.orm import Session
+
+from . import db_session
+from .change_log import ChangeLog, truncated_seq, latest_seq
+from .dishes import Dish
+from .dish_ratings import DishRating
+
+TOP_K = 10
+MAX_TOP_K = 50
+# Отрезки длиннее просматриваются один раз и кэшируются
+SCAN_LIMIT = 256
+MAX_CACHED_PREFIXES = 4096
+SYNC_INTERVAL = 1.0
+
+_spaces = re.compile(r'\s+')
+
+
+def normalize(name):
+    return _spaces.sub(' ', (name or '').casefold().replace('ё', 'е')).strip()
+
+
+def weight(average, count):
+    return (average or 0) * math.log1p(count or 0)
+
+
+class NameIndex:
+    def __init__(self):
+        # Отсортированные пары (ключ, id)
+        self._keys = []
+        # id -> (название, ключ, средняя оценка, число оценок, вес)
+        self._dishes = {}
+        # ключ -> id (для проверки уникальности названия)
+        self._by_key = {}
+        # префикс -> готовый топ для длинных отрезков
+        self._top = OrderedDict()
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self.loaded = False
+        self.cursor = 0
+        self.synced_at = 0.0
+        self.dirty = False
+
+    # --- изменение ---
+
+    def put(self, dish_id, name, average=0, count=0):
+        with self._lock:
+            self._remove(dish_id)
+            key = normalize(name)
+            bisect.insort(self._keys, (key, dish_id))
+            self._dishes[dish_id] = (name, key, average or 0, count or 0, weight(average, count))
+            self._by_key[key] = dish_id
+            self._forget_prefixes(key)
+
+    def remove(self, dish_id):
+        with self._lock:
+            self._remove(dish_id)
+
+    def _remove(self, dish_id):
+        entry = self._dishes.pop(dish_id, None)
+        if entry is None:
+            return
+        key = entry[1]
+        position = bisect.bisect_left(self._keys, (key, dish_id))
+        if position < len(self._keys) and self._keys[position] == (key, dish_id):
+            del self._keys[position]
+        if self._by_key.get(key) == dish_id:
+            del self._by_key[key]
+        self._forget_prefixes(key)
+
+    def _forget_prefixes(self, key):
+        for prefix in [prefix for prefix in self._top if key.startswith(prefix)]:
+            del self._top[prefix]
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+            self._dishes = {}
+            self._by_key = {}
+            self._top.clear()
+
+    # --- поиск ---
+
+    def _range(self, key):
+        lo = bisect.bisect_left(self._keys, (key,))
+        hi = bisect.bisect_left(self._keys, (key + '\U0010ffff',))
+        return lo, hi
+
+    def _ranked(self, lo, hi, limit):
+        dishes = self._dishes
+        # При равном весе — по алфавиту (порядок отрезка)
+        return heapq.nlargest(limit, range(lo, hi), key=lambda i: (dishes[self._keys[i][1]][4], -i))
+
+    def search(self, prefix, limit=TOP_K):
+        """До limit блюд с префиксом: [(id, название, средняя оценка, число оценок)]"""
+        key = normalize(prefix)
+        if not key:
+            return []
+        with self._lock:
+            lo, hi = self._range(key)
+            if hi - lo <= SCAN_LIMIT:
+                positions = self._ranked(lo, hi, limit)
+            else:
+                cached = self._top.get(key)
+                if cached is None or len(cached) < min(limit, hi - lo):
+                    cached = [self._keys[i][1] for i in self._ranked(lo, hi, MAX_TOP_K)]
+                    self._top[key] = cached
+                    if len(self._top) > MAX_CACHED_PREFIXES:
+                        self._top.popitem(last=False)
+                else:
+                    self._top.move_to_end(key)
+                return [self._row(dish_id) for dish_id in cached[:limit]]
+            return [self._row(self._keys[i][1]) for i in positions]
+
+    def _row(self, dish_id):
+        name, _, average, count, _ = self._dishes[dish_id]
+        return dish_id, name, average, count
+
+    def find(self, name):
+        """id блюда с тем же нормализованным названием или None"""
+        return self._by_key.get(normalize(name))
+
+    def __len__(self):
+        return len(self._dishes)
+
+    def reset(self):
+        """БД сменилась (db_session.reset): индекс строится заново при следующем запросе"""
+        with self._lock:
+            self.clear()
+            self.loaded = False
+            self.cursor = 0
+            self.synced_at = 0.0
+            self.dirty = False
+
+    # --- синхронизация с БД ---
+
+    def ensure_current(self):
+        """Строит индекс или догоняет журнал изменений, если пора"""
+        if self.loaded and not self.dirty and time.monotonic() - self.synced_at < SYNC_INTERVAL:
+            return
+        # Синхронизирует один поток, остальные отвечают по текущему состоянию
+        if not self._sync_lock.acquire(blocking=not self.loaded):
+            return
+        try:
+            self.dirty = False
+            # Из primary: индекс живет дольше окна read-your-writes
+            session = db_session.create_write_session()
+            try:
+                if not self.loaded or truncated_seq(session) > self.cursor:
+                    self._load(session)
+                else:
+                    self._catch_up(session)
+            finally:
+                session.close()
+            self.synced_at = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def _statement(self):
+        return select(Dish.id, Dish.name, func.avg(DishRating.rating), func.count(DishRating.rating)) \
+            .outerjoin(DishRating, DishRating.dish_id == Dish.id).group_by(Dish.id)
+
+    def _load(self, session):
+        cursor = latest_seq(session)
+        rows = session.execute(self._statement()).all()
+        dishes = {}
+        for dish_id, name, average, count in rows:
+            dishes[dish_id] = (name, normalize(name), average or 0, count or 0, weight(average, count))
+        keys = sorted((entry[1], dish_id) for dish_id, entry in dishes.items())
+        with self._lock:
+            self._keys = keys
+            self._dishes = dishes
+            self._by_key = {key: dish_id for key, dish_id in keys}
+            self._top.clear()
+            self.cursor = cursor
+            self.loaded = True
+
+    def _catch_up(self, session):
+        changed = session.execute(
+            select(ChangeLog.dish_id, func.max(ChangeLog.seq))
+            .where(ChangeLog.seq > self.cursor, ChangeLog.entity.in_(('dish', 'rating')))
+            .group_by(ChangeLog.dish_id)
+        ).all()
+        if not changed:
+            return
+        dish_ids = {dish_id for dish_id, _ in changed if dish_id is not None}
+        rows = session.execute(self._statement().where(Dish.id.in_(dish_ids))).all()
+        with self._lock:
+            for dish_id, name, average, count in rows:
+                self.put(dish_id, name, average, count)
+            for dish_id in dish_ids - {row[0] for row in rows}:
+                self.remove(dish_id)
+            self.cursor = max(self.cursor, max(seq for _, seq in changed))
+
+
+name_index = NameIndex()
+db_session.on_reset(name_index.reset)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Dish, DishRating)):
+            session.info['name_index_dirty'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('name_index_dirty', False):
+        name_index.dirty = True
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('name_index_dirty', None)
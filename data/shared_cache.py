@@ -0,0 +1,379 @@
+"""Кэши процесса и общий для воркеров кэш.
+
+Cache — именованный кэш (пространство ключей) с TTL, LRU-вытеснением и
+счетчиками попаданий. Где лежат значения, решает бэкенд, выбранный
+configure() (переменная CACHE_URL):
+- не задан — MemoryBackend: у каждого Cache свой LRU в памяти процесса;
+- путь к файлу — SQLiteBackend: одна таблица в отдельном SQLite-файле
+  (лучше в tmpfs, например /dev/shm/dishes-cache.db), общая для всех
+  воркеров prefork, без внешнего сервиса. Размер ограничен max_bytes,
+  вытесняются записи с самым старым временем обращения;
+- redis://... — RedisBackend, если установлен пакет redis (вытеснение —
+  политикой maxmemory-policy allkeys-lru самого сервера).
+
+Значения сериализуются pickle, поэтому файл кэша и Redis должны быть
+доступны только приложению.
+
+Широковещательная инвалидация: publish(канал, сообщение) доставляет
+сообщение подписчикам subscribe() во всех процессах, кроме отправителя
+(свою копию отправитель уже поправил). SQLite-бэкенд пишет события в
+таблицу cache_events, процессы читают продолжение не чаще раза в
+POLL_INTERVAL при обращении к кэшу (poll()); Redis — через pub/sub.
+Так кэши, которые остаются в памяти процесса (множества избранного),
+не расходятся между воркерами дольше POLL_INTERVAL.
+"""
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from . import db_session
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+POLL_INTERVAL = 0.2
+# Обновлять время обращения не чаще (каждое чтение — запись в файл)
+TOUCH_INTERVAL = 1.0
+# Проверка размера SQLite-кэша — раз в столько записей
+EVICT_EVERY = 100
+EVENT_RETENTION = 60.0
+REDIS_CHANNEL = 'dishes-cache-events'
+
+# Отличает события своего процесса (pid меняется после fork)
+_origin = None
+_origin_pid = None
+_backend = None
+_caches = []
+_subscribers = {}
+
+
+def origin():
+    global _origin, _origin_pid
+    if _origin_pid != os.getpid():
+        _origin, _origin_pid = uuid.uuid4().hex, os.getpid()
+    return _origin
+
+
+def _size(value):
+    """Размер записи для лимита: длина для bytes/str, иначе 1 (лимит — в записях)"""
+    return len(value) if isinstance(value, (bytes, str)) else 1
+
+
+class MemoryBackend:
+    """LRU с TTL в памяти процесса; max_size — в байтах или записях (см. _size)"""
+    shared = False
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # ключ -> (истекает, значение)
+        self._items = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] is not None and item[0] <= time.monotonic():
+                self._pop(key)
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        size = _size(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._total += size
+            while self._total > self.max_size:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._total -= _size(evicted)
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._total -= _size(item[1])
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self, prefix=''):
+        with self._lock:
+            if not prefix:
+                self._items.clear()
+                self._total = 0
+                return
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                self._pop(key)
+
+    def publish(self, channel, message):
+        # Один процесс — доставлять некому
+        pass
+
+    def poll(self):
+        pass
+
+
+class SQLiteBackend:
+    """Общий кэш в SQLite-файле: WAL, соединение на поток, без fsync (кэш можно потерять)"""
+    shared = True
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, evict_every=EVICT_EVERY):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._local = threading.local()
+        self._sets = 0
+        self._poll_lock = threading.Lock()
+        self._polled_at = 0.0
+        connection = self._connection()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at);
+            CREATE TABLE IF NOT EXISTS cache_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                message TEXT,
+                created_at REAL NOT NULL
+            );
+        """)
+        # Старые события не нужны: новый процесс начинает с текущего конца
+        self.cursor = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_events").fetchone()[0]
+
+    def _connection(self):
+        # Соединение родителя после fork использовать нельзя
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            local.connection, local.pid = connection, os.getpid()
+        return local.connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?",
+                                 (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            connection.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+            return None
+        if now - accessed_at >= TOUCH_INTERVAL:
+            connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data), now + ttl if ttl else None, now))
+        self._sets += 1
+        if self._sets % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """Удаляет просроченные записи и самые давние по обращению сверх max_bytes"""
+        connection = self._connection()
+        connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for key, size in connection.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        return removed
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self, prefix=''):
+        # Префикс — имя кэша с двоеточием, без символов шаблона LIKE
+        self._connection().execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def publish(self, channel, message):
+        now = time.time()
+        connection = self._connection()
+        connection.execute("INSERT INTO cache_events (origin, channel, message, created_at) VALUES (?, ?, ?, ?)",
+                           (origin(), channel, json.dumps(message), now))
+        connection.execute("DELETE FROM cache_events WHERE created_at < ?", (now - EVENT_RETENTION,))
+
+    def poll(self):
+        """Доставляет чужие события подписчикам (не чаще раза в POLL_INTERVAL)"""
+        if time.monotonic() - self._polled_at < POLL_INTERVAL or not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._polled_at = time.monotonic()
+            events = self._connection().execute(
+                "SELECT seq, origin, channel, message FROM cache_events WHERE seq > ? ORDER BY seq",
+                (self.cursor,)).fetchall()
+            for seq, sender, channel, message in events:
+                self.cursor = seq
+                if sender != origin():
+                    _deliver(channel, json.loads(message))
+        finally:
+            self._poll_lock.release()
+
+
+class RedisBackend:
+    """Redis или совместимый сервер; события — через pub/sub в фоновом потоке"""
+    shared = True
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('Для CACHE_URL=redis://... нужен пакет redis')
+        self.client = redis.Redis.from_url(url)
+        self._listener = None
+        self._listener_pid = None
+
+    def get(self, key):
+        data = self.client.get(key)
+        return None if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def clear(self, prefix=''):
+        for key in self.client.scan_iter(match=prefix.replace('*', r'\*') + '*'):
+            self.client.delete(key)
+
+    def publish(self, channel, message):
+        self.client.publish(REDIS_CHANNEL, json.dumps([origin(), channel, message]))
+
+    def poll(self):
+        # Подписка — своя в каждом процессе: поток родителя после fork не переживает
+        if self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{REDIS_CHANNEL: self._on_message})
+        self._listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def _on_message(self, message):
+        sender, channel, payload = json.loads(message['data'])
+        if sender != origin():
+            _deliver(channel, payload)
+
+
+class Cache:
+    """Именованный кэш: ключи с префиксом имени в общем бэкенде или свой LRU в памяти"""
+
+    def __init__(self, name, ttl=None, max_size=10000):
+        self.name = name
+        self.ttl = ttl
+        self.prefix = name + ':'
+        self.memory = MemoryBackend(max_size)
+        self.hits = 0
+        self.misses = 0
+        _caches.append(self)
+
+    @property
+    def backend(self):
+        return _backend or self.memory
+
+    def get(self, key):
+        value = self.backend.get(self.prefix + str(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self.prefix + str(key), value, ttl or self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(self.prefix + str(key))
+
+    def clear(self):
+        self.backend.clear(self.prefix)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def configure(url=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Выбирает бэкенд: None — память процесса, redis://... — Redis, иначе путь к SQLite-файлу"""
+    global _backend
+    if not url:
+        _backend = None
+    elif url.startswith(('redis://', 'rediss://', 'unix://')):
+        _backend = RedisBackend(url)
+    else:
+        _backend = SQLiteBackend(url, max_bytes)
+    return _backend
+
+
+def backend_name():
+    return type(_backend).__name__ if _backend is not None else 'MemoryBackend'
+
+
+def subscribe(channel, callback):
+    """callback(message) для событий канала из других процессов"""
+    _subscribers.setdefault(channel, []).append(callback)
+    return callback
+
+
+def publish(channel, message):
+    """Событие для остальных процессов (сообщение — JSON-совместимое)"""
+    if _backend is not None:
+        _backend.publish(channel, message)
+
+
+def poll():
+    if _backend is not None:
+        _backend.poll()
+
+
+def _deliver(channel, message):
+    for callback in _subscribers.get(channel, ()):
+        try:
+            callback(message)
+        except Exception as e:
+            print(f"Ошибка обработки события кэша {channel}: {e}")
+
+
+def stats():
+    return {'backend': backend_name(), 'caches': {cache.name: cache.stats() for cache in _caches}}
+
+
+def reset():
+    """БД сменилась (db_session.reset): значения, посчитанные по ней, больше не верны"""
+    for cache in _caches:
+        cache.clear()
+        cache.memory.clear()
+
+
+db_session.on_reset(reset)
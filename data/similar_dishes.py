@@ -0,0 +1,191 @@
+"""Похожие блюда по ингредиентам: MinHash и LSH.
+
+Ингредиенты блюда — множество слов (casefold, ё -> е, не короче
+MIN_TOKEN символов). Сходство двух блюд — коэффициент Жаккара этих
+множеств, его оценивает доля совпадающих позиций MinHash-сигнатур из
+NUM_PERM значений min((a * x + b) mod P).
+
+Сигнатура режется на BANDS полос по ROWS значений; хэш полосы — номер
+корзины в таблице dish_lsh_bands. Кандидаты в похожие — блюда, у
+которых совпала хотя бы одна корзина: поиск идет по индексу и не
+сравнивает блюдо со всеми остальными. Кандидаты ранжируются по оценке
+сходства из сигнатур (dish_minhash).
+
+Сигнатура и корзины пересчитываются в той же транзакции, что и запись
+блюда (after_flush). Полная перестройка — rebuild() или команда
+flask api similar-rebuild; при установленном numpy сигнатуры считаются
+векторно, пачками.
+"""
+import array
+import hashlib
+import random
+import re
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MIN_TOKEN = 3
+# Простое число Мерсенна 2^31 - 1: a * x помещается в 64 бита
+PRIME = (1 << 31) - 1
+MAX_HASH = PRIME
+SIMILAR_LIMIT = 5
+MAX_SIMILAR_LIMIT = 50
+# Сколько блюд за раз считает векторная перестройка
+REBUILD_BATCH = 1000
+
+_rng = random.Random(20240611)
+PERMUTATIONS = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(NUM_PERM)]
+_words = re.compile(r'\w+')
+
+stats = {'signatures': 0, 'queries': 0, 'candidates': 0}
+
+
+def tokens(ingredients):
+    words = _words.findall((ingredients or '').casefold().replace('ё', 'е'))
+    return {word for word in words if len(word) >= MIN_TOKEN and not word.isdigit()}
+
+
+def token_hash(token):
+    digest = hashlib.blake2b(token.encode('utf-8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'little') % PRIME
+
+
+def signature(ingredients):
+    """MinHash-сигнатура (список NUM_PERM чисел) или None для пустых ингредиентов"""
+    hashes = [token_hash(token) for token in tokens(ingredients)]
+    if not hashes:
+        return None
+    return [min((a * x + b) % PRIME for x in hashes) for a, b in PERMUTATIONS]
+
+
+def signatures_vectorized(ingredients_list):
+    """То же для пачки блюд одной операцией numpy; без numpy — по одному"""
+    if numpy is None:
+        return [signature(ingredients) for ingredients in ingredients_list]
+    token_lists = [[token_hash(token) for token in tokens(ingredients)] for ingredients in ingredients_list]
+    lengths = numpy.array([len(hashes) for hashes in token_lists])
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    # Матрица хэшей (блюда x токены); пустые места заполнены MAX_HASH и не влияют на минимум
+    matrix = numpy.full((len(token_lists), width), MAX_HASH, dtype=numpy.int64)
+    for row, hashes in enumerate(token_lists):
+        matrix[row, :len(hashes)] = hashes
+    a = numpy.array([a for a, _ in PERMUTATIONS], dtype=numpy.int64)[:, None, None]
+    b = numpy.array([b for _, b in PERMUTATIONS], dtype=numpy.int64)[:, None, None]
+    values = (a * matrix[None, :, :] + b) % PRIME
+    padding = numpy.arange(width)[None, :] >= lengths[:, None]
+    values[:, padding] = MAX_HASH
+    minimums = values.min(axis=2).T
+    return [minimums[row].tolist() if lengths[row] else None for row in range(len(token_lists))]
+
+
+def band_buckets(sig):
+    """[(номер полосы, корзина)] для сигнатуры"""
+    buckets = []
+    for band in range(BANDS):
+        values = array.array('I', sig[band * ROWS:(band + 1) * ROWS]).tobytes()
+        digest = hashlib.blake2b(values, digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+
+def estimate(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _pack(sig):
+    return array.array('I', sig).tobytes()
+
+
+def _unpack(blob):
+    return array.array('I', blob).tolist()
+
+
+def store(executor, dish_id, sig):
+    """Записывает сигнатуру и корзины блюда (executor — сессия или соединение)"""
+    forget(executor, dish_id)
+    if sig is None:
+        return
+    executor.execute(text("INSERT INTO dish_minhash (dish_id, signature) VALUES (:dish_id, :signature)"),
+                     {'dish_id': dish_id, 'signature': _pack(sig)})
+    executor.execute(text("INSERT INTO dish_lsh_bands (band, bucket, dish_id) VALUES (:band, :bucket, :dish_id)"),
+                     [{'band': band, 'bucket': bucket, 'dish_id': dish_id} for band, bucket in band_buckets(sig)])
+    stats['signatures'] += 1
+
+
+def forget(executor, dish_id):
+    executor.execute(text("DELETE FROM dish_lsh_bands WHERE dish_id = :dish_id"), {'dish_id': dish_id})
+    executor.execute(text("DELETE FROM dish_minhash WHERE dish_id = :dish_id"), {'dish_id': dish_id})
+
+
+def rebuild(executor, batch=REBUILD_BATCH):
+    """Пересчитывает сигнатуры и корзины всех блюд; возвращает число блюд с сигнатурой"""
+    executor.execute(text("DELETE FROM dish_lsh_bands"))
+    executor.execute(text("DELETE FROM dish_minhash"))
+    rows = executor.execute(text("SELECT id, ingredients FROM dishes ORDER BY id")).all()
+    stored = 0
+    for start in range(0, len(rows), batch):
+        chunk = rows[start:start + batch]
+        sigs = signatures_vectorized([ingredients for _, ingredients in chunk])
+        signature_rows, band_rows = [], []
+        for (dish_id, _), sig in zip(chunk, sigs):
+            if sig is None:
+                continue
+            signature_rows.append({'dish_id': dish_id, 'signature': _pack(sig)})
+            band_rows.extend({'band': band, 'bucket': bucket, 'dish_id': dish_id}
+                             for band, bucket in band_buckets(sig))
+        if signature_rows:
+            executor.execute(text("INSERT INTO dish_minhash (dish_id, signature) VALUES (:dish_id, :signature)"),
+                             signature_rows)
+            executor.execute(text("INSERT INTO dish_lsh_bands (band, bucket, dish_id) "
+                                  "VALUES (:band, :bucket, :dish_id)"), band_rows)
+        stored += len(signature_rows)
+    stats['signatures'] += stored
+    return stored
+
+
+def find_similar(session, dish_id, limit=SIMILAR_LIMIT):
+    """До limit похожих блюд: [(id, название, оценка сходства)] по убыванию сходства"""
+    own = session.execute(text("SELECT signature FROM dish_minhash WHERE dish_id = :dish_id"),
+                          {'dish_id': dish_id}).scalar()
+    stats['queries'] += 1
+    if own is None:
+        return []
+    own = _unpack(own)
+    candidates = session.execute(text("""
+        SELECT DISTINCT d.id, d.name, m.signature
+        FROM dish_lsh_bands AS own
+        JOIN dish_lsh_bands AS other ON other.band = own.band AND other.bucket = own.bucket
+        JOIN dish_minhash AS m ON m.dish_id = other.dish_id
+        JOIN dishes AS d ON d.id = other.dish_id
+        WHERE own.dish_id = :dish_id AND other.dish_id != :dish_id"""), {'dish_id': dish_id}).all()
+    stats['candidates'] += len(candidates)
+    scored = [(other_id, name, round(estimate(own, _unpack(sig)), 3)) for other_id, name, sig in candidates]
+    scored.sort(key=lambda item: (-item[2], item[0]))
+    return scored[:limit]
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_signatures(session, flush_context):
+    """Новое блюдо или изменившиеся ингредиенты — пересчет в той же транзакции"""
+    from sqlalchemy import inspect
+    from .dishes import Dish
+
+    connection = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Dish):
+            continue
+        state = inspect(obj)
+        if obj in session.deleted or state.was_deleted:
+            connection = connection or session.connection()
+            forget(connection, obj.id)
+        elif obj in session.new or state.attrs.ingredients.history.has_changes():
+            connection = connection or session.connection()
+            store(connection, obj.id, signature(obj.ingredients))
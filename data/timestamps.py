@@ -0,0 +1,82 @@
+import datetime
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+def utcnow():
+    """Текущее время в UTC без tzinfo — в таком виде даты хранятся в SQLite"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class TimestampMixin:
+    """created_at/updated_at, которые ORM заполняет сама.
+
+    onupdate срабатывает и для массовых query(...).update(...), так как
+    Core добавляет его в SET для колонок, не указанных явно.
+    """
+    created_at = sqlalchemy.Column(sqlalchemy.DateTime, default=utcnow, nullable=True)
+    updated_at = sqlalchemy.Column(sqlalchemy.DateTime, default=utcnow, onupdate=utcnow,
+                                   nullable=True, index=True)
+
+
+def _touch(connection, dish_ids):
+    from .dishes import Dish
+
+    if dish_ids:
+        connection.execute(
+            sqlalchemy.update(Dish.__table__)
+            .where(Dish.__table__.c.id.in_(dish_ids))
+            .values(updated_at=utcnow())
+        )
+
+
+def _dish_column(mapper):
+    """Колонка с id блюда у оценок и избранного, None для остальных моделей"""
+    from .dish_ratings import DishRating
+    from .favourites import Favourite
+
+    if mapper is None:
+        return None
+    if mapper.class_ is DishRating:
+        return DishRating.dish_id
+    if mapper.class_ is Favourite:
+        return Favourite.dishes_id
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _touch_dishes(session, flush_context):
+    """Оценки и избранное меняют представление блюда — обновляем его updated_at"""
+    dish_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        column = _dish_column(sqlalchemy.inspect(obj).mapper)
+        if column is not None and getattr(obj, column.key):
+            dish_ids.add(getattr(obj, column.key))
+    _touch(session.connection(), dish_ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _touch_dishes_bulk(orm_execute_state):
+    """То же для массовых query(...).update()/delete() мимо сессии.
+
+    Затронутые блюда выбираются тем же условием до выполнения запроса:
+    после DELETE их уже не найти.
+    """
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    column = _dish_column(orm_execute_state.bind_mapper)
+    if column is None:
+        return None
+
+    statement = orm_execute_state.statement
+    affected = sqlalchemy.select(column).distinct()
+    if statement.whereclause is not None:
+        affected = affected.where(statement.whereclause)
+    session = orm_execute_state.session
+    dish_ids = {dish_id for dish_id, in session.execute(affected) if dish_id}
+
+    result = orm_execute_state.invoke_statement()
+    _touch(session.connection(), dish_ids)
+    return result
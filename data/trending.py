@@ -0,0 +1,116 @@
+"""Трендовые блюда: оценки последней недели с затуханием.
+
+Вклад оценки копится в часовых корзинах dish_trending_buckets
+(dish_id, номер часа). Это кольцо: корзины старше WINDOW_BUCKETS часов
+удаляет фоновое обновление. Итоговый счет блюда лежит в dish_trending,
+и sort=trending читает из нее первые TOP_K строк по индексу, не трогая
+сами оценки.
+
+Счет — сумма корзин с весом 0.5 ** (возраст в часах / HALF_LIFE_HOURS).
+Запись оценки прибавляет свой вклад и к корзине текущего часа, и сразу
+к dish_trending (с весом 1, как у текущего часа). Затухание старых
+корзин пересчитывает refresh() — раз в REFRESH_INTERVAL из фонового
+потока или командой flask api trending-refresh.
+"""
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy import text
+
+from .db_session import SqlAlchemyBase
+
+BUCKET_SECONDS = 60 * 60
+# Окно тренда: неделя часовых корзин
+WINDOW_BUCKETS = 7 * 24
+HALF_LIFE_HOURS = 24
+TOP_K = 50
+REFRESH_INTERVAL = 10 * 60
+
+stats = {'refreshes': 0, 'expired_buckets': 0, 'last_refresh': None}
+
+
+class TrendingBucket(SqlAlchemyBase):
+    __tablename__ = 'dish_trending_buckets'
+
+    dish_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('dishes.id', ondelete='CASCADE'),
+                                primary_key=True)
+    # Номер часа от начала эпохи
+    bucket = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    score = sqlalchemy.Column(sqlalchemy.Float, nullable=False, default=0)
+
+
+class DishTrending(SqlAlchemyBase):
+    __tablename__ = 'dish_trending'
+    __table_args__ = (
+        sqlalchemy.Index('ix_dish_trending_score', 'score'),
+    )
+
+    dish_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('dishes.id', ondelete='CASCADE'),
+                                primary_key=True)
+    score = sqlalchemy.Column(sqlalchemy.Float, nullable=False, default=0)
+
+
+def current_bucket(now=None):
+    return int((time.time() if now is None else now) // BUCKET_SECONDS)
+
+
+def weight(rating):
+    """Вклад оценки: пятерка — 1, единица — 0.2"""
+    return (rating or 0) / 5.0
+
+
+def record(session, dish_id, rating, previous=None, now=None):
+    """Вызывается в транзакции записи оценки; previous — прежняя оценка пользователя"""
+    delta = weight(rating) - weight(previous)
+    if not delta:
+        return
+    params = {'dish_id': dish_id, 'bucket': current_bucket(now), 'delta': delta}
+    session.execute(text("""
+        INSERT INTO dish_trending_buckets (dish_id, bucket, score) VALUES (:dish_id, :bucket, :delta)
+        ON CONFLICT (dish_id, bucket) DO UPDATE SET score = score + excluded.score"""), params)
+    session.execute(text("""
+        INSERT INTO dish_trending (dish_id, score) VALUES (:dish_id, :delta)
+        ON CONFLICT (dish_id) DO UPDATE SET score = score + excluded.score"""), params)
+
+
+def refresh(session, now=None):
+    """Удаляет корзины вне окна и пересчитывает счета с затуханием; возвращает число блюд"""
+    bucket = current_bucket(now)
+    expired = session.execute(text("DELETE FROM dish_trending_buckets WHERE bucket <= :oldest"),
+                              {'oldest': bucket - WINDOW_BUCKETS}).rowcount
+    # Корзины удаленных блюд тоже больше не нужны
+    expired += session.execute(text(
+        "DELETE FROM dish_trending_buckets WHERE dish_id NOT IN (SELECT id FROM dishes)"
+    )).rowcount
+
+    scores = {}
+    for dish_id, age, score in session.execute(text(
+            "SELECT dish_id, :bucket - bucket, score FROM dish_trending_buckets"), {'bucket': bucket}):
+        scores[dish_id] = scores.get(dish_id, 0.0) + score * 0.5 ** (max(age, 0) / HALF_LIFE_HOURS)
+
+    session.execute(text("DELETE FROM dish_trending"))
+    rows = [{'dish_id': dish_id, 'score': score} for dish_id, score in scores.items() if score > 0]
+    if rows:
+        session.execute(text("INSERT INTO dish_trending (dish_id, score) VALUES (:dish_id, :score)"), rows)
+
+    stats['refreshes'] += 1
+    stats['expired_buckets'] += expired
+    stats['last_refresh'] = time.time() if now is None else now
+    return len(rows)
+
+
+def start_refresher(interval=REFRESH_INTERVAL):
+    """Фоновый поток обновления; в prefork запускается только в мастере"""
+    from .writes import write_session
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with write_session() as session:
+                    refresh(session)
+            except Exception as e:
+                print(f"Не удалось обновить тренды: {e}")
+
+    threading.Thread(target=run, name='trending-refresh', daemon=True).start()
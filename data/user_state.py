@@ -0,0 +1,101 @@
+"""Снимок состояния пользователя: все его оценки и избранное.
+
+Клиенту не нужно спрашивать оценку по каждой карточке блюда: один запрос
+отдает все оценки в колоночном виде (параллельные массивы dish_ids и
+values) и список избранных id. Каждая таблица читается одним проходом по
+покрывающему индексу (user_id, ...), без обращения к строкам таблицы.
+
+Токен версии — максимальный updated_at и число строк в обеих таблицах.
+По нему клиент получает дельту: строки, измененные после токена. Удаления
+видны по числу строк (новые строки отличаются по created_at); если
+что-то удалено, таблица отдается целиком.
+"""
+import datetime
+
+from sqlalchemy import select
+
+from .dish_ratings import DishRating
+from .favourites import Favourite
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class UserState:
+    def __init__(self, ratings, favourites):
+        # [(dish_id, rating, created_at, updated_at)] и [(dish_id, created_at, updated_at)]
+        # по возрастанию dish_id
+        self.ratings = ratings
+        self.favourites = favourites
+
+    @classmethod
+    def load(cls, session, user_id):
+        ratings = session.execute(
+            select(DishRating.dish_id, DishRating.rating, DishRating.created_at, DishRating.updated_at)
+            .where(DishRating.user_id == user_id)
+            .order_by(DishRating.dish_id)
+        ).all()
+        favourites = session.execute(
+            select(Favourite.dishes_id, Favourite.created_at, Favourite.updated_at)
+            .where(Favourite.user_id == user_id)
+            .order_by(Favourite.dishes_id)
+        ).all()
+        return cls(ratings, favourites)
+
+    @property
+    def updated_at(self):
+        moments = [row[-1] for row in self.ratings] + [row[-1] for row in self.favourites]
+        return max((moment for moment in moments if moment is not None), default=EPOCH)
+
+    @property
+    def version(self):
+        updated_at = self.updated_at
+        micros = (updated_at - EPOCH) // datetime.timedelta(microseconds=1)
+        return f'{micros:x}-{len(self.ratings):x}-{len(self.favourites):x}'
+
+    def to_dict(self, since=None):
+        """Полный снимок или дельта относительно токена since"""
+        ratings, favourites, full = self.ratings, self.favourites, []
+        if since is not None:
+            since_at, since_ratings, since_favourites = parse_version(since)
+            ratings = _changed_since(self.ratings, since_at, since_ratings)
+            favourites = _changed_since(self.favourites, since_at, since_favourites)
+            if ratings is None:
+                ratings = self.ratings
+                full.append('ratings')
+            if favourites is None:
+                favourites = self.favourites
+                full.append('favourites')
+
+        data = {
+            'version': self.version,
+            'delta': since is not None,
+            'ratings': {
+                'dish_ids': [row[0] for row in ratings],
+                'values': [row[1] for row in ratings]
+            },
+            'favourites': [row[0] for row in favourites]
+        }
+        if since is not None:
+            data['full'] = full
+        return data
+
+
+def _changed_since(rows, since_at, since_count):
+    """Строки новее since_at; None — если были удаления и нужна вся таблица"""
+    changed = [row for row in rows if row[-1] is not None and row[-1] > since_at]
+    added = sum(1 for row in changed if row[-2] is not None and row[-2] > since_at)
+    # Без удалений: было since_count строк, стало since_count + added
+    if since_count + added != len(rows):
+        return None
+    return changed
+
+
+def parse_version(value):
+    """Разбирает токен версии; ValueError на некорректном"""
+    try:
+        micros, ratings, favourites = (int(part, 16) for part in value.split('-'))
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid version token')
+    if micros < 0 or ratings < 0 or favourites < 0:
+        raise ValueError('Invalid version token')
+    return EPOCH + datetime.timedelta(microseconds=micros), ratings, favourites
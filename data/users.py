@@ -2,8 +2,13 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlalchemy
 from sqlalchemy_serializer import SerializerMixin
-from sqlalchemy import orm
-from .db_session import SqlAlchemyBase
+from sqlalchemy import orm, event
+from . import shared_cache
+from .db_session import SqlAlchemyBase, create_session
+
+USER_CACHE_TTL = 5 * 60
+# id -> {id, login} для load_user: без сессии БД на каждый запрос (хэш пароля не кэшируется)
+user_cache = shared_cache.Cache('users', ttl=USER_CACHE_TTL, max_size=10000)
 
 
 class User(SqlAlchemyBase, UserMixin, SerializerMixin):
@@ -27,3 +32,40 @@ class User(SqlAlchemyBase, UserMixin, SerializerMixin):
 
     def __repr__(self):
         return f"<User> {self.id} {self.login}"
+
+
+def get_user(user_id):
+    """Пользователь для Flask-Login из кэша или БД; None, если его нет.
+
+    Из кэша возвращается объект вне сессии — только id и login.
+    """
+    columns = user_cache.get(user_id)
+    if columns is None:
+        session = create_session()
+        try:
+            user = session.get(User, user_id)
+            if user is None:
+                return None
+            columns = {'id': user.id, 'login': user.login}
+        finally:
+            session.close()
+        user_cache.set(user_id, columns)
+    return User(**columns)
+
+
+@event.listens_for(orm.Session, 'after_flush')
+def _note_changes(session, flush_context):
+    changed = [obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+
+
+@event.listens_for(orm.Session, 'after_commit')
+def _after_commit(session):
+    for user_id in session.info.pop('changed_users', ()):
+        user_cache.delete(user_id)
+
+
+@event.listens_for(orm.Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('changed_users', None)
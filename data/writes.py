@@ -0,0 +1,191 @@
+"""Транзакции записи в SQLite.
+
+SQLite допускает одного писателя. Транзакция, начатая обычным BEGIN,
+берет блокировку записи только на первом INSERT/UPDATE и при
+конкуренции падает с "database is locked" посреди работы. Поэтому
+write_session() начинает транзакцию с BEGIN IMMEDIATE: блокировка
+берется сразу, и SQLITE_BUSY возможен только в этот момент. Там он
+повторяется с экспоненциальной паузой со случайным разбросом до
+дедлайна, после чего выбрасывается WriteTimeout (ответ 503).
+
+Драйвер sqlite3 сам открывает транзакции только перед DML, поэтому
+configure_engine() переводит его в autocommit и BEGIN выдает SQLAlchemy
+(событие begin). Там же включаются WAL (читатели не мешают писателю),
+короткий busy_timeout — основное ожидание идет в повторах — и внешние
+ключи: SQLite проверяет их и выполняет ON DELETE CASCADE только при
+PRAGMA foreign_keys = ON на каждом соединении.
+
+Очередь писателя (enable_lane) — необязательный режим: записи всех
+потоков процесса по очереди идут через одно соединение, и внутри
+процесса SQLITE_BUSY не возникает вовсе.
+"""
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
+
+from . import db_session
+
+# Сколько SQLite сам ждет блокировку перед SQLITE_BUSY (мс)
+BUSY_TIMEOUT_MS = 50
+# Сколько всего ждать начала транзакции записи (сек)
+WRITE_DEADLINE = 5.0
+BACKOFF_BASE = 0.005
+BACKOFF_MAX = 0.25
+
+stats = {'transactions': 0, 'retries': 0, 'timeouts': 0, 'lock_wait_seconds': 0.0, 'lane_wait_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+_configured = weakref.WeakSet()
+_lane = None
+
+
+class WriteTimeout(Exception):
+    """Не удалось начать транзакцию записи до дедлайна"""
+
+    def __init__(self, waited):
+        super().__init__(f'Database is busy, waited {waited:.2f}s')
+        self.waited = waited
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        stats[key] += value
+
+
+def configure_engine(engine):
+    """WAL, busy_timeout, внешние ключи и явный BEGIN (с режимом из execution option sqlite_begin)"""
+
+    @sa.event.listens_for(engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        cursor.execute('PRAGMA foreign_keys = ON')
+        # Действует только для новой (пустой) базы и только до перехода в WAL;
+        # существующую переводит flask api maintenance --vacuum
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.close()
+
+    @sa.event.listens_for(engine, 'begin')
+    def _begin(conn):
+        mode = conn.get_execution_options().get('sqlite_begin')
+        conn.exec_driver_sql(f'BEGIN {mode}' if mode else 'BEGIN')
+
+    _configured.add(engine)
+
+
+def is_busy(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def _retry_busy(begin, rollback, deadline):
+    """Выполняет begin(), повторяя его при SQLITE_BUSY до момента deadline"""
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            begin()
+            break
+        except OperationalError as e:
+            if not is_busy(e):
+                raise
+            rollback()
+            now = time.monotonic()
+            if now >= deadline:
+                _count('timeouts')
+                raise WriteTimeout(now - started)
+            _count('retries')
+            pause = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(min(pause, deadline - now))
+            attempt += 1
+    _count('lock_wait_seconds', time.monotonic() - started)
+
+
+def begin_immediate(conn, timeout=None):
+    """BEGIN IMMEDIATE на Core-соединении (например, для миграций)"""
+    timeout = timeout or WRITE_DEADLINE
+    if conn.engine in _configured:
+        conn.execution_options(sqlite_begin='IMMEDIATE')
+        _retry_busy(conn.begin, conn.rollback, time.monotonic() + timeout)
+    else:
+        _retry_busy(lambda: conn.exec_driver_sql('BEGIN IMMEDIATE'), conn.rollback,
+                    time.monotonic() + timeout)
+
+
+class WriteLane:
+    """Одно соединение для записи на процесс и блокировка, выстраивающая потоки в очередь"""
+
+    def __init__(self, engine):
+        self.engine = sa.create_engine(engine.url, poolclass=StaticPool)
+        configure_engine(self.engine)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.engine.dispose()
+
+
+def enable_lane():
+    global _lane
+    if _lane is None:
+        _lane = WriteLane(db_session.get_primary_engine())
+    return _lane
+
+
+def disable_lane():
+    global _lane
+    lane, _lane = _lane, None
+    if lane is not None:
+        with lane.lock:
+            lane.close()
+
+
+def _after_fork_in_child():
+    # Соединение и блокировка очереди писателя принадлежат родителю
+    if _lane is not None:
+        _lane.engine.dispose(close=False)
+        _lane.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@contextmanager
+def write_session(timeout=None):
+    """Сессия в транзакции BEGIN IMMEDIATE: коммит при выходе, откат при исключении"""
+    timeout = timeout or WRITE_DEADLINE
+    deadline = time.monotonic() + timeout
+    lane = _lane
+    if lane is not None:
+        started = time.monotonic()
+        if not lane.lock.acquire(timeout=timeout):
+            _count('timeouts')
+            raise WriteTimeout(time.monotonic() - started)
+        _count('lane_wait_seconds', time.monotonic() - started)
+
+    try:
+        session = db_session.create_write_session(lane.engine if lane is not None else None)
+        try:
+            _retry_busy(lambda: session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'}),
+                        session.rollback, deadline)
+            yield session
+            session.commit()
+            _count('transactions')
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    finally:
+        if lane is not None:
+            lane.lock.release()
@@ -0,0 +1,228 @@
+"""Контроль допуска запросов и сброс нагрузки.
+
+Запросы делятся на классы со своими лимитами одновременных обработчиков:
+- auth  — вход/регистрация (хэширование паролей дорогое);
+- write — изменяющие запросы (упираются в блокировку записи SQLite);
+- read  — чтение; дешевые (условные GET, одно блюдо, статика) имеют
+  приоритет над тяжелыми страницами-списками.
+
+Если лимит занят, запрос ждет в ограниченной очереди. Ожидаемое время
+ожидания оценивается по среднему времени обработки класса: если оно
+больше дедлайна, запрос сразу получает 503 с Retry-After, а не занимает
+очередь впустую.
+
+Отдельно на изменяющие эндпоинты API действует token bucket на
+пользователя (или IP для анонимов): один клиент не может занять
+писателя целиком и получает 429.
+"""
+import heapq
+import itertools
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request, session, Response
+
+from data.writes import WriteTimeout
+from extensions import timing
+
+DEFAULT_CONFIG = {
+    'ADMISSION_ENABLED': True,
+    # Одновременных обработчиков на класс
+    'ADMISSION_LIMITS': {'read': 16, 'write': 4, 'auth': 4},
+    # Максимум ждущих запросов на класс
+    'ADMISSION_QUEUE': 64,
+    # Сколько запрос готов ждать допуска (сек)
+    'ADMISSION_DEADLINE': 2.0,
+    # Token bucket для изменяющих запросов API: запросов в секунду и запас
+    'WRITE_RATE': 5.0,
+    'WRITE_BURST': 20,
+}
+
+# Дешевые чтения: отвечают из индекса/кэша или 304
+CHEAP_ENDPOINTS = {'static', 'api.get_dish', 'api.get_user_rating', 'api.get_user_state',
+                   'api.get_dishes_batch', 'api.autocomplete_dishes'}
+# POST-запросы, которые только читают
+READ_ONLY_POST = {'api.get_dishes_batch'}
+
+PRIORITY_CHEAP = 0
+PRIORITY_HEAVY = 1
+
+MAX_BUCKETS = 10000
+
+stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'rate_limited': 0}
+
+
+class Limiter:
+    """Ограничитель одновременных запросов с приоритетной очередью"""
+
+    def __init__(self, name, limit, max_queue):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        # Куча ждущих: [приоритет, порядковый номер, событие, допущен]
+        self._waiters = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # Скользящее среднее времени обработки (сек)
+        self.service_time = 0.05
+
+    def expected_wait(self, position):
+        return (position // self.limit + 1) * self.service_time
+
+    def acquire(self, priority, deadline):
+        """Возвращает (True, 0) или (False, через сколько секунд повторить)"""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return True, 0
+
+            position = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+            wait = self.expected_wait(position)
+            if len(self._waiters) >= self.max_queue or wait > deadline:
+                return False, wait
+
+            waiter = [priority, next(self._counter), threading.Event(), False]
+            heapq.heappush(self._waiters, waiter)
+            stats['queued'] += 1
+
+        waiter[2].wait(deadline)
+        with self._lock:
+            if waiter[3]:
+                return True, 0
+            # Дедлайн истек — уходим из очереди
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            return False, self.expected_wait(len(self._waiters))
+
+    def release(self, elapsed):
+        with self._lock:
+            self.service_time = self.service_time * 0.9 + elapsed * 0.1
+            if self._waiters:
+                # Место передается первому по приоритету, active не меняется
+                waiter = heapq.heappop(self._waiters)
+                waiter[3] = True
+                waiter[2].set()
+            else:
+                self.active -= 1
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Забирает токен; возвращает 0 или через сколько секунд он появится"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token bucket на клиента; число хранимых bucket-ов ограничено (LRU)"""
+
+    def __init__(self, rate, burst, max_buckets=MAX_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return bucket.take()
+
+
+def classify():
+    """Класс и приоритет текущего запроса"""
+    if request.blueprint == 'auth':
+        return 'auth', PRIORITY_HEAVY
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and request.endpoint not in READ_ONLY_POST:
+        return 'write', PRIORITY_HEAVY
+    if (request.endpoint in CHEAP_ENDPOINTS
+            or request.if_none_match or request.if_modified_since):
+        return 'read', PRIORITY_CHEAP
+    return 'read', PRIORITY_HEAVY
+
+
+def _client_key():
+    # Как и маршрутизация реплик, берем id из сессии, не загружая пользователя
+    user_id = session.get('_user_id')
+    return f'user:{user_id}' if user_id else f'ip:{request.remote_addr}'
+
+
+def _overloaded(status, message, retry_after):
+    if request.blueprint == 'api':
+        response = Response(json.dumps({'error': message}, ensure_ascii=False), status,
+                            mimetype='application/json')
+    else:
+        response = Response(message, status, mimetype='text/plain')
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _admit():
+    config = current_app.config
+    if not config['ADMISSION_ENABLED']:
+        return None
+
+    route_class, priority = classify()
+    if route_class == 'write' and request.blueprint == 'api':
+        retry_after = current_app.extensions['write_rate_limiter'].take(_client_key())
+        if retry_after:
+            stats['rate_limited'] += 1
+            return _overloaded(429, 'Too many write requests', retry_after)
+
+    limiter = current_app.extensions['admission_limiters'][route_class]
+    started = time.perf_counter()
+    admitted, retry_after = limiter.acquire(priority, config['ADMISSION_DEADLINE'])
+    waited = time.perf_counter() - started
+    if waited > 0.0005:
+        timing.record('queue', waited)
+    if not admitted:
+        stats['rejected'] += 1
+        return _overloaded(503, 'Server is overloaded, retry later', retry_after)
+
+    stats['admitted'] += 1
+    g.admission = (limiter, time.perf_counter())
+    return None
+
+
+def _release(exc=None):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        limiter, started = admission
+        limiter.release(time.perf_counter() - started)
+
+
+def _write_timeout(error):
+    # Блокировку записи SQLite не дождались — это перегрузка, а не ошибка сервера
+    stats['rejected'] += 1
+    return _overloaded(503, 'Database is busy, retry later', 1)
+
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    app.extensions['admission_limiters'] = {
+        name: Limiter(name, limit, app.config['ADMISSION_QUEUE'])
+        for name, limit in app.config['ADMISSION_LIMITS'].items()
+    }
+    app.extensions['write_rate_limiter'] = RateLimiter(app.config['WRITE_RATE'], app.config['WRITE_BURST'])
+    app.before_request(_admit)
+    app.teardown_request(_release)
+    app.register_error_handler(WriteTimeout, _write_timeout)
@@ -0,0 +1,144 @@
+"""Отпечатки (fingerprint) статических файлов.
+
+build() хэширует содержимое файлов из static/, кладет копии с хэшем в имени
+в static/dist/ вместе с заранее сжатыми .gz/.br и пишет manifest.json.
+После этого url_for('static', filename='css/style.css') возвращает
+хэшированное имя, а такие файлы отдаются с Cache-Control: immutable на год.
+
+Сборка запускается командой `flask --app app assets-build` или при первом
+старте, если манифеста нет или исходники изменились.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def build(static_folder):
+    """Собирает хэшированные копии и манифест, возвращает манифест"""
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            stem, ext = os.path.splitext(logical)
+            hashed = f'{DIST_DIR}/{stem}.{_file_hash(source)}{ext}'
+            target = os.path.join(static_folder, hashed)
+
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+                if ext in PRECOMPRESS_EXTENSIONS:
+                    _precompress(target)
+            manifest[logical] = hashed
+
+    os.makedirs(dist_folder, exist_ok=True)
+    tmp_path = os.path.join(dist_folder, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(dist_folder, MANIFEST_NAME))
+    return manifest
+
+
+def _precompress(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def load_manifest(static_folder):
+    """Читает манифест; None, если его нет или исходники новее него"""
+    manifest_path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        built_at = os.path.getmtime(manifest_path)
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    for logical in manifest:
+        source = os.path.join(static_folder, logical)
+        if not os.path.exists(source) or os.path.getmtime(source) > built_at:
+            return None
+    return manifest
+
+
+def _fingerprint_url(endpoint, values):
+    if endpoint != 'static':
+        return
+    manifest = current_app.extensions['assets_manifest']
+    filename = values.get('filename')
+    if filename in manifest:
+        values['filename'] = manifest[filename]
+
+
+def _make_static_view(app, original_view):
+    hashed_names = set(app.extensions['assets_manifest'].values())
+
+    def static(filename):
+        if filename not in hashed_names:
+            return original_view(filename=filename)
+
+        folder = app.static_folder
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings.quality(encoding) and \
+                    os.path.exists(os.path.join(folder, filename + suffix)):
+                response = send_from_directory(folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(folder, filename)
+
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    return static
+
+
+def init_app(app):
+    manifest = load_manifest(app.static_folder)
+    if manifest is None:
+        manifest = build(app.static_folder)
+    app.extensions['assets_manifest'] = manifest
+
+    app.url_defaults(_fingerprint_url)
+    app.view_functions['static'] = _make_static_view(app, app.view_functions['static'])
+
+    @app.cli.command('assets-build')
+    def assets_build():
+        """Пересобирает хэшированные копии static/ и манифест"""
+        result = build(app.static_folder)
+        app.extensions['assets_manifest'] = result
+        print(f"Собрано файлов: {len(result)}")
@@ -0,0 +1,192 @@
+"""Сжатие ответов (gzip, brotli, zstd) с выбором по Accept-Encoding.
+
+- сжимаются только текстовые типы (JSON, HTML, CSS, JS) от COMPRESS_MIN_SIZE байт;
+- потоковые ответы (генераторы) сжимаются по кускам, каждый кусок
+  сбрасывается клиенту сразу;
+- результат сжатия обычных GET-ответов кэшируется по хэшу тела, поэтому
+  одинаковый ответ (например, полный список блюд) не сжимается заново;
+  при общем бэкенде кэша (CACHE_URL) сжатое тело видят все воркеры;
+- процессорное время сжатия попадает в Server-Timing (фаза compress).
+
+brotli и zstd используются, только если установлены пакеты Brotli и zstandard.
+"""
+import hashlib
+import time
+import zlib
+
+from flask import current_app, request
+
+from data import shared_cache
+from extensions import timing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_CONFIG = {
+    # Порядок — предпочтение сервера при одинаковом q у клиента
+    'COMPRESS_ALGORITHMS': ['br', 'zstd', 'gzip'],
+    'COMPRESS_LEVEL': {'gzip': 6, 'br': 4, 'zstd': 3},
+    'COMPRESS_MIN_SIZE': 500,
+    'COMPRESS_MIMETYPES': ['application/json', 'text/html', 'text/css',
+                           'text/plain', 'application/javascript', 'text/event-stream'],
+    'COMPRESS_CACHE_MAX_BYTES': 16 * 1024 * 1024,
+}
+
+stats = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0, 'cache_hits': 0}
+
+
+class Encoder:
+    """Единый интерфейс потокового компрессора"""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._obj = brotli.Compressor(quality=level)
+        elif encoding == 'zstd':
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f'Неизвестный алгоритм сжатия: {encoding}')
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self):
+        """Сбрасывает накопленное, не завершая поток"""
+        if self.encoding == 'gzip':
+            return self._obj.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._obj.flush()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def available_algorithms():
+    algorithms = {'gzip'}
+    if brotli is not None:
+        algorithms.add('br')
+    if zstandard is not None:
+        algorithms.add('zstd')
+    return algorithms
+
+
+def choose_encoding(accept_encodings, preference):
+    """Лучший алгоритм по q-значениям клиента; при равенстве — по порядку сервера"""
+    available = available_algorithms()
+    best, best_quality = None, 0
+    for encoding in preference:
+        if encoding not in available:
+            continue
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _level(encoding):
+    levels = current_app.config['COMPRESS_LEVEL']
+    return levels.get(encoding, DEFAULT_CONFIG['COMPRESS_LEVEL'][encoding])
+
+
+def _compress_stream(iterable, encoder):
+    cpu_seconds = 0.0
+    for chunk in iterable:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if not chunk:
+            continue
+        cpu_started = time.thread_time()
+        data = encoder.compress(chunk) + encoder.flush()
+        cpu_seconds += time.thread_time() - cpu_started
+        stats['bytes_in'] += len(chunk)
+        stats['bytes_out'] += len(data)
+        yield data
+    tail = encoder.finish()
+    stats['bytes_out'] += len(tail)
+    # После отправки заголовков Server-Timing уже не изменить — только в статистику
+    stats['cpu_seconds'] += cpu_seconds
+    if tail:
+        yield tail
+
+
+def compress_response(response):
+    config = current_app.config
+    if response.mimetype not in config['COMPRESS_MIMETYPES']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.direct_passthrough
+            or request.method == 'HEAD'):
+        return response
+
+    encoding = choose_encoding(request.accept_encodings, config['COMPRESS_ALGORITHMS'])
+    if encoding is None:
+        return response
+
+    # Сжатое представление эквивалентно исходному лишь «слабо»
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    level = _level(encoding)
+
+    if response.is_streamed:
+        stats['responses'] += 1
+        response.response = _compress_stream(response.response, Encoder(encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        return response
+
+    body = response.get_data()
+    if len(body) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    cache = current_app.extensions['compression_cache']
+    cache_key = None
+    if request.method == 'GET' and response.status_code == 200 and 'Set-Cookie' not in response.headers:
+        cache_key = f"{hashlib.blake2b(body, digest_size=16).hexdigest()}:{encoding}:{level}"
+
+    compressed = cache.get(cache_key) if cache_key else None
+    if compressed is not None:
+        stats['cache_hits'] += 1
+    else:
+        cpu_started = time.thread_time()
+        encoder = Encoder(encoding, level)
+        compressed = encoder.compress(body) + encoder.finish()
+        cpu_seconds = time.thread_time() - cpu_started
+        stats['cpu_seconds'] += cpu_seconds
+        timing.record('compress', cpu_seconds)
+        if cache_key:
+            cache.set(cache_key, compressed)
+
+    stats['responses'] += 1
+    stats['bytes_in'] += len(body)
+    stats['bytes_out'] += len(compressed)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    # Лимит в байтах действует для кэша в памяти; общий бэкенд ограничен своим лимитом
+    app.extensions['compression_cache'] = shared_cache.Cache('compressed', max_size=app.config['COMPRESS_CACHE_MAX_BYTES'])
+    app.after_request(compress_response)
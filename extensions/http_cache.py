@@ -0,0 +1,94 @@
+"""Условные GET-запросы по updated_at: Last-Modified, ETag и ответ 304.
+
+Last-Modified имеет точность до секунды, поэтому рядом с ним отдается ETag
+с полной точностью updated_at: если клиент прислал If-None-Match, по
+RFC 9110 If-Modified-Since игнорируется и две правки за одну секунду
+не приведут к устаревшему 304.
+"""
+import datetime
+import hashlib
+
+from flask import request, Response
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def validators(updated_at, user_id, *parts):
+    """ETag и Last-Modified для представления, зависящего от updated_at и пользователя"""
+    if updated_at is None:
+        return None, None
+    user_id = '' if user_id is None else str(user_id)
+    raw = '|'.join(str(part) for part in (updated_at.isoformat(), user_id) + parts)
+    etag = hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+    last_modified = updated_at.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+    return etag, last_modified
+
+
+def matches(etag, last_modified, if_none_match, if_modified_since):
+    """if_none_match — ETags werkzeug, if_modified_since — datetime или None"""
+    if etag is None:
+        return False
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    return last_modified is not None and if_modified_since is not None and last_modified <= if_modified_since
+
+
+def is_not_modified(etag, last_modified):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return matches(etag, last_modified, request.if_none_match, request.if_modified_since)
+
+
+def is_not_modified_asgi(etag, last_modified, headers):
+    """То же для сырых заголовков ASGI"""
+    values = dict(headers)
+    if_none_match = values.get(b'if-none-match')
+    if_modified_since = values.get(b'if-modified-since')
+    return matches(etag, last_modified,
+                   parse_etags(if_none_match.decode('latin-1') if if_none_match else None),
+                   parse_date(if_modified_since.decode('latin-1')) if if_modified_since else None)
+
+
+def asgi_headers(etag, last_modified):
+    if etag is None:
+        return []
+    return [
+        (b'etag', quote_etag(etag).encode('latin-1')),
+        (b'last-modified', http_date(last_modified).encode('latin-1')),
+        (b'cache-control', CACHE_CONTROL.encode('latin-1')),
+        (b'vary', b'Cookie'),
+    ]
+
+
+def apply(response, etag, last_modified):
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Ответ персональный: кэшировать только в браузере и всегда перепроверять
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified_response(etag, last_modified):
+    return apply(Response(status=304), etag, last_modified)
+
+
+def parse_since(value):
+    """Разбирает updated_since: ISO 8601 или unix-время; возвращает naive UTC"""
+    try:
+        timestamp = float(value)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(value)
+    else:
+        try:
+            moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            # inf, nan и значения за пределами datetime
+            raise ValueError(f'updated_since out of range: {value}')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
@@ -0,0 +1,180 @@
+"""Живые обновления рейтингов: хаб рассылки для SSE (/api/dishes/stream).
+
+Событие — текущее состояние блюда: средняя оценка и число оценок. id
+события — seq из журнала изменений, поэтому он одинаков во всех
+процессах и годится для Last-Event-ID.
+
+- Пути записи оценок вызывают rating_changed() внутри транзакции; после
+  коммита событие попадает в хаб (из любого потока, через
+  call_soon_threadsafe).
+- Записи других процессов хаб подбирает сам: пока есть подписчики, раз в
+  POLL_INTERVAL читает журнал изменений — один запрос на процесс, а не на
+  клиента.
+- Медленный клиент не копит очередь: для каждого блюда хранится только
+  последнее состояние. Если у клиента накопилось больше MAX_PENDING блюд,
+  соединение закрывается, и клиент переподключается с Last-Event-ID.
+- Подписчик — это корутина и словарь, поэтому тысячи простаивающих
+  соединений почти ничего не стоят.
+"""
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from sqlalchemy import select, func
+
+from data import db_session
+from data.change_log import ChangeLog, truncated_seq, latest_seq
+from data.dish_ratings import DishRating
+
+# Как часто слать комментарий-пинг, чтобы прокси не закрывали соединение (сек)
+HEARTBEAT = 15.0
+# Как часто читать журнал изменений ради записей других процессов (сек)
+POLL_INTERVAL = 1.0
+# Сколько разных блюд может ждать отправки медленному клиенту
+MAX_PENDING = 1000
+# Для скольких блюд хаб помнит seq последнего события (отсев дублей)
+MAX_TRACKED = 10000
+
+
+def make_event(seq, dish_id, average, count):
+    return {'id': seq, 'dish_id': dish_id,
+            'average_rating': round(average, 2) if average else 0, 'rating_count': count}
+
+
+def format_event(event):
+    data = json.dumps({key: event[key] for key in ('dish_id', 'average_rating', 'rating_count')})
+    return f'id: {event["id"]}\nevent: rating\ndata: {data}\n\n'.encode('utf-8')
+
+
+class Subscriber:
+    def __init__(self):
+        # dish_id -> последнее событие: старые состояния блюда заменяются новыми
+        self.pending = OrderedDict()
+        self.wake = asyncio.Event()
+        self.overflowed = False
+
+    def offer(self, event):
+        self.pending.pop(event['dish_id'], None)
+        self.pending[event['dish_id']] = event
+        if len(self.pending) > MAX_PENDING:
+            self.overflowed = True
+        self.wake.set()
+
+    def drain(self):
+        events = list(self.pending.values())
+        self.pending.clear()
+        self.wake.clear()
+        return events
+
+
+class Hub:
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        # dish_id -> seq последнего разосланного события (дубли от опроса журнала)
+        self._sent = OrderedDict()
+        self._lock = threading.Lock()
+        self._poller = None
+        self.cursor = 0
+
+    def subscribe(self):
+        self.loop = asyncio.get_running_loop()
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event):
+        """Потокобезопасно: можно вызывать из потоков WSGI"""
+        loop = self.loop
+        if loop is None or loop.is_closed() or not self.subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(event)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        with self._lock:
+            if self._sent.get(event['dish_id'], 0) >= event['id']:
+                return
+            self._sent.pop(event['dish_id'], None)
+            self._sent[event['dish_id']] = event['id']
+            if len(self._sent) > MAX_TRACKED:
+                # Забытое блюдо в худшем случае получит одно повторное событие
+                self._sent.popitem(last=False)
+        for subscriber in list(self.subscribers):
+            subscriber.offer(event)
+
+    def reset(self):
+        """БД сменилась (db_session.reset): seq нового журнала начинаются заново"""
+        with self._lock:
+            self._sent.clear()
+        self.cursor = 0
+
+    def ensure_poller(self, session_factory):
+        loop = asyncio.get_running_loop()
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._poller = loop.create_task(self._poll(session_factory))
+
+    def stop_poller(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    async def _poll(self, session_factory):
+        async with session_factory() as session:
+            self.cursor = max(self.cursor, await session.run_sync(latest_seq))
+        while self.subscribers:
+            await asyncio.sleep(POLL_INTERVAL)
+            async with session_factory() as session:
+                events = await changed_since(session, self.cursor)
+            for event in events or ():
+                self.cursor = max(self.cursor, event['id'])
+                self._dispatch(event)
+
+
+hub = Hub()
+db_session.on_reset(hub.reset)
+
+
+def rating_changed(session, dish_id):
+    """Вызывается в транзакции записи оценки; событие уходит подписчикам после коммита"""
+    average, count = session.execute(
+        select(func.avg(DishRating.rating), func.count(DishRating.rating))
+        .where(DishRating.dish_id == dish_id)
+    ).one()
+    seq = session.execute(select(func.max(ChangeLog.seq))).scalar() or 0
+    event = make_event(seq, dish_id, average, count)
+    sa.event.listen(session, 'after_commit', lambda s: hub.publish(event), once=True)
+
+
+async def changed_since(session, seq):
+    """Текущее состояние блюд, оценки которых менялись после seq; None — журнал уже очищен"""
+    if seq < await session.run_sync(truncated_seq):
+        return None
+    changed = (await session.execute(
+        select(ChangeLog.dish_id, func.max(ChangeLog.seq))
+        .where(ChangeLog.seq > seq, ChangeLog.entity == 'rating')
+        .group_by(ChangeLog.dish_id)
+    )).all()
+    if not changed:
+        return []
+    last_seq = dict(changed)
+    aggregates = await session.execute(
+        select(DishRating.dish_id, func.avg(DishRating.rating), func.count(DishRating.rating))
+        .where(DishRating.dish_id.in_(last_seq))
+        .group_by(DishRating.dish_id)
+    )
+    found = {dish_id: (average, count) for dish_id, average, count in aggregates}
+    events = [make_event(last_seq[dish_id], dish_id, *found.get(dish_id, (0, 0)))
+              for dish_id in last_seq]
+    return sorted(events, key=lambda event: event['id'])
@@ -0,0 +1,77 @@
+"""Кэши шаблонов Jinja: байткод и фрагменты разметки.
+
+- Байткод скомпилированных шаблонов сохраняется на диск
+  (FileSystemBytecodeCache, каталог TEMPLATE_BYTECODE_DIR, по умолчанию —
+  во временном каталоге системы): новый процесс загружает готовый код
+  вместо разбора и компиляции исходников.
+- Тег {% cache ключ, ... %}...{% endcache %} кэширует отрендеренный
+  фрагмент. Ключ — имя шаблона, SCRIPT_NAME и значения выражений после
+  cache: в него должно входить все, от чего зависит разметка внутри
+  (версия объекта и состояние зрителя). Повторный рендер с тем же ключом
+  не выполняет тело — ни url_for, ни фильтров. Фрагменты лежат в
+  shared_cache.Cache('fragments'), поэтому при CACHE_URL общие для
+  воркеров; TEMPLATE_FRAGMENT_CACHE=False отключает кэш (тело рендерится
+  каждый раз).
+"""
+import hashlib
+
+from flask import has_request_context, request
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from data import shared_cache
+
+DEFAULT_CONFIG = {
+    'TEMPLATE_BYTECODE_DIR': None,
+    'TEMPLATE_FRAGMENT_CACHE': True,
+    'TEMPLATE_FRAGMENT_TTL': 60 * 60,
+    'TEMPLATE_FRAGMENT_MAX_BYTES': 16 * 1024 * 1024,
+}
+
+
+def fragment_key(template_name, parts):
+    script_root = request.script_root if has_request_context() else ''
+    return hashlib.blake2b(repr((template_name, script_root, parts)).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache выражение, ... %} тело {% endcache %}"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        # None — кэш выключен
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        args = [nodes.Const(parser.name), nodes.List(parts)]
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, template_name, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = fragment_key(template_name, parts)
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.set(key, html)
+        return Markup(html)
+
+
+def init_app(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    env = app.jinja_env
+    # До загрузки первого шаблона: иначе он уже скомпилирован без кэша
+    env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_DIR'])
+    env.add_extension(FragmentCacheExtension)
+    if app.config['TEMPLATE_FRAGMENT_CACHE']:
+        env.fragment_cache = shared_cache.Cache('fragments', ttl=app.config['TEMPLATE_FRAGMENT_TTL'],
+                                                max_size=app.config['TEMPLATE_FRAGMENT_MAX_BYTES'])
@@ -0,0 +1,38 @@
+"""Замер времени обработки запросов.
+
+Каждый запрос получает заголовок Server-Timing: общее время ответа и
+отдельные фазы, которые другие модули добавляют через record().
+"""
+import time
+
+from flask import g, has_request_context
+
+
+def record(name, seconds):
+    """Добавляет длительность фазы (сек) к текущему запросу"""
+    if not has_request_context():
+        return
+    timings = g.setdefault('timings', {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _add_server_timing(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+
+    parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in g.get('timings', {}).items()]
+    parts.append(f'total;dur={(time.perf_counter() - started) * 1000:.2f}')
+    response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def init_app(app):
+    app.before_request(_start_timer)
+    # after_request выполняются в обратном порядке регистрации:
+    # timing подключается первым, чтобы увидеть фазы остальных модулей
+    app.after_request(_add_server_timing)
@@ -4,7 +4,9 @@ from wtforms.validators import DataRequired, URL, Optional
 
 
 class AddDishForm(FlaskForm):
-    name = StringField('Название блюда', validators=[DataRequired()])
+    # Подсказки и проверка уникальности до отправки: /api/dishes/autocomplete (add_dish.html)
+    name = StringField('Название блюда', validators=[DataRequired()],
+                       render_kw={'autocomplete': 'off', 'list': 'dish-name-suggestions'})
     ingredients = TextAreaField('Ингредиенты', validators=[DataRequired()])
     url = StringField('URL видео (YouTube)',
                       validators=[Optional(), URL(message='Пожалуйста, введите корректную ссылку на YouTube видео')])
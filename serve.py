@@ -0,0 +1,203 @@
+"""Продакшн-запуск: предзагрузка в мастере и prefork-воркеры.
+
+Мастер импортирует приложение, компилирует шаблоны и прогревает кэши,
+затем вызывает gc.freeze() и форкает воркеров: загруженные объекты
+остаются в общих страницах памяти (copy-on-write) и не копируются
+сборщиком мусора. Все воркеры принимают соединения с одного сокета.
+
+Сигналы мастеру:
+- SIGHUP — плавная перезагрузка: мастер перезапускает себя (exec) с тем
+  же сокетом, заново загружает код, поднимает новых воркеров и только
+  потом останавливает старых;
+- SIGTERM/SIGINT — остановка: воркеры дообрабатывают текущие запросы.
+
+Запуск:
+    python serve.py [--workers N] [--host 127.0.0.1] [--port 8080]
+
+База берется из DB_FILE (по умолчанию db/my.db).
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+# Сколько ждать завершения текущих запросов при остановке воркера (сек)
+GRACEFUL_TIMEOUT = 30.0
+# Пауза перед повторным запуском упавшего воркера (сек)
+RESPAWN_DELAY = 1.0
+
+LISTEN_FD_ENV = 'SERVE_LISTEN_FD'
+OLD_WORKERS_ENV = 'SERVE_OLD_WORKERS'
+
+
+def preload():
+    """Загружает приложение и все, что воркеры будут использовать без изменений"""
+    from app import app
+    from data import db_session
+    # Формы импортируются лениво, в мастере грузим их заранее
+    import forms.dish, forms.login  # noqa: F401
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    with app.test_client() as client:
+        for url in ('/', '/api/dishes'):
+            client.get(url)
+
+    # Соединения не должны переходить в воркеры
+    engine = db_session.get_primary_engine()
+    if engine is not None:
+        engine.dispose()
+    return app
+
+
+def listen(host, port):
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is not None:
+        sock = socket.socket(fileno=int(fd))
+    else:
+        sock = socket.create_server((host, port), backlog=1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, host, port):
+    from werkzeug.serving import make_server
+
+    for signum in (signal.SIGHUP, signal.SIGINT):
+        signal.signal(signum, signal.SIG_IGN)
+
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    # При остановке ждем потоки с текущими запросами
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    os._exit(0)
+
+
+class Master:
+    def __init__(self, app, sock, host, port, workers):
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.pids = set()
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.app, self.sock, self.host, self.port)
+            finally:
+                os._exit(1)
+        self.pids.add(pid)
+        return pid
+
+    def on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reloading = True
+        else:
+            self.stopping = True
+
+    def reap(self):
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.pids.clear()
+                return
+            if pid == 0:
+                return
+            if pid in self.pids:
+                self.pids.discard(pid)
+                if not self.stopping and not self.reloading:
+                    print(f"Воркер {pid} завершился (статус {status}), перезапуск")
+                    time.sleep(RESPAWN_DELAY)
+                    self.spawn()
+
+    def stop_workers(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        for pid in pids:
+            while time.monotonic() < deadline:
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        break
+                except ChildProcessError:
+                    break
+                time.sleep(0.05)
+            else:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                except (ProcessLookupError, ChildProcessError):
+                    pass
+
+    def reload(self):
+        """exec нового мастера с тем же pid: старые воркеры остаются его детьми"""
+        print("Перезагрузка")
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in self.pids)
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self.on_signal)
+
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"Мастер {os.getpid()}, воркеров: {self.workers}, адрес http://{self.host}:{self.port}")
+
+        old_workers = os.environ.pop(OLD_WORKERS_ENV, '')
+        if old_workers:
+            # Новые воркеры уже принимают соединения — отпускаем старых
+            self.stop_workers([int(pid) for pid in old_workers.split(',')])
+
+        while not self.stopping:
+            if self.reloading:
+                self.reload()
+            self.reap()
+            time.sleep(0.2)
+
+        self.stop_workers(list(self.pids))
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prefork-сервер приложения')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    sock = listen(args.host, args.port)
+    app = preload()
+
+    # Все, что создано до fork, сборщик мусора больше не трогает
+    gc.collect()
+    gc.freeze()
+
+    Master(app, sock, args.host, args.port, args.workers).run()
+
+
+if __name__ == '__main__':
+    main()
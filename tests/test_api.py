@@ -4,6 +4,8 @@ import os
 os.environ["FLASK_ENV"] = "testing"
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import asyncio
+
 import pytest
 from app import app
 from data import db_session
@@ -11,15 +13,46 @@ from data.dishes import Dish
 from data.favourites import Favourite
 from data.dish_ratings import DishRating
 import blueprints.api as api  # blueprint с блюдами
+from extensions.admission import RateLimiter
 
 
 # ---------- ИНИЦИАЛИЗАЦИЯ БД ----------
 
-@pytest.fixture(scope="session", autouse=True)
-def setup_db():
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    db_path = os.path.join(BASE_DIR, "tests", "test.db")
-    db_session.global_init(db_path)
+# Копии баз для тестов — в tmpfs, если он есть: запись без fsync на диск
+TMPFS_DIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
+@pytest.fixture(scope="session")
+def template_db(tmp_path_factory):
+    """Шаблонная база: миграции и начальные данные — один раз на процесс pytest"""
+    from app import seed_database
+
+    path = str(tmp_path_factory.mktemp("template") / "template.db")
+    db_session.global_init(path)
+    seed_database()
+    db_session.reset()
+    return path
+
+
+@pytest.fixture(autouse=True)
+def test_db(template_db, tmp_path):
+    """Своя копия шаблона на каждый тест (backup API): тесты не видят данных друг друга"""
+    import shutil
+    import sqlite3
+    import tempfile
+
+    directory = tempfile.mkdtemp(prefix="dishes-test-", dir=TMPFS_DIR) if TMPFS_DIR else str(tmp_path)
+    path = os.path.join(directory, "test.db")
+    source, target = sqlite3.connect(template_db), sqlite3.connect(path)
+    source.backup(target)
+    target.close()
+    source.close()
+
+    db_session.global_init(path)
+    yield path
+    db_session.reset()
+    if TMPFS_DIR:
+        shutil.rmtree(directory, ignore_errors=True)
 
 
 # ---------- FLASK CLIENT ----------
@@ -30,6 +63,8 @@ def client():
 
     if "api" not in app.blueprints:
         app.register_blueprint(api.api_bp, url_prefix="/api")
+    # Свой token bucket на каждый тест: иначе лимит записи копится на весь прогон
+    app.extensions["write_rate_limiter"] = RateLimiter(app.config["WRITE_RATE"], app.config["WRITE_BURST"])
 
     with app.test_client() as client:
         yield client
@@ -311,3 +346,1171 @@ def test_get_user_favourites(client):
 
     logout(client)
     dell_test_dish()
+
+
+# =====================================================
+# 7. ASGI-РЕЖИМ
+# =====================================================
+def asgi_request(path, cookie=None, headers=()):
+    """Выполняет GET-запрос к ASGI-приложению, возвращает (статус, заголовки, тело)"""
+    from asgi import application
+
+    raw_path, _, query = path.partition('?')
+    headers = [(name.lower().encode(), value.encode()) for name, value in headers]
+    if cookie:
+        headers.append((b'cookie', f'session={cookie}'.encode()))
+    scope = {'type': 'http', 'method': 'GET', 'path': raw_path,
+             'query_string': query.encode(), 'headers': headers}
+    response = {'body': b''}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.decode(): value.decode() for name, value in message['headers']}
+        else:
+            response['body'] += message.get('body', b'')
+
+    async def run():
+        await application(scope, receive, send)
+        await db_session.dispose_async()
+
+    asyncio.run(run())
+    return response['status'], response['headers'], response['body']
+
+
+def asgi_get(path, cookie=None):
+    """Выполняет GET-запрос к ASGI-приложению, возвращает (статус, json)"""
+    import json
+
+    status, _, body = asgi_request(path, cookie)
+    return status, json.loads(body)
+
+
+# Проверяем: ASGI-обработчики отдают тот же ответ, что и Flask
+def test_asgi_matches_wsgi(client):
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 4})
+    client.post(f"/api/dishes/{dish_id}/favourite")
+    cookie = client.get_cookie("session").value
+
+    for path in ["/api/dishes", "/api/dishes?sort=rating", f"/api/dishes/{dish_id}", "/api/user/favourites"]:
+        status, data = asgi_get(path, cookie)
+        assert status == 200
+        assert data == client.get(path).get_json()
+
+    logout(client)
+    dell_test_dish()
+
+
+# Проверяем: ASGI без авторизации
+def test_asgi_anonymous():
+    status, _ = asgi_get("/api/user/favourites")
+    assert status == 401
+    status, _ = asgi_get("/api/dishes/999999")
+    assert status == 404
+
+
+# =====================================================
+# 8. РЕПЛИКИ ДЛЯ ЧТЕНИЯ
+# =====================================================
+# Проверяем: GET читает из реплики, запись и чтение после нее — из primary
+def test_replica_routing(tmp_path):
+    replica = db_session.add_replica(str(tmp_path / "replica.db"))
+    primary = db_session.get_primary_engine()
+    try:
+        with app.test_request_context("/api/dishes", method="GET"):
+            assert db_session.create_session().get_bind() is replica.engine
+
+        with app.test_request_context("/api/dishes", method="POST"):
+            assert db_session.create_session().get_bind() is primary
+
+        with app.test_request_context("/api/dishes", method="GET"):
+            db_session.mark_write()
+            assert db_session.create_session().get_bind() is primary
+
+        # Запись обработал другой воркер: в его словаре отметки нет, но она есть в cookie
+        import time
+        from flask import session as flask_session
+        db_session._last_write.clear()
+        with app.test_request_context("/api/dishes", method="GET"):
+            assert db_session.create_session().get_bind() is replica.engine
+            flask_session[db_session.WROTE_AT_KEY] = time.time()
+            assert db_session.create_session().get_bind() is primary
+
+        # Отставание больше допустимого — чтение уходит в primary
+        replica.max_lag = -1
+        replica.check(force=True)
+        with app.test_request_context("/api/dishes/1", method="GET"):
+            assert db_session.create_session().get_bind() is primary
+    finally:
+        db_session.remove_replicas()
+
+
+# =====================================================
+# 9. МИГРАЦИИ СХЕМЫ
+# =====================================================
+# Проверяем: миграции идемпотентны, теплый старт — один запрос к schema_version
+def test_migrations_warm_start(tmp_path):
+    import sqlalchemy as sa
+    from data import migrations
+
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    assert migrations.upgrade(engine) == migrations.latest_version()
+
+    statements = []
+    sa.event.listen(engine, "before_cursor_execute",
+                    lambda conn, cursor, statement, *args: statements.append(statement))
+    assert migrations.upgrade(engine) == migrations.latest_version()
+    assert statements == ["SELECT version FROM schema_version"]
+
+    with engine.connect() as conn:
+        kind = conn.execute(sa.text(
+            "SELECT type FROM sqlite_master WHERE name = 'dishes_with_ratings'")).scalar()
+    assert kind == "view"
+    engine.dispose()
+
+
+# =====================================================
+# 10. СЖАТИЕ ОТВЕТОВ
+# =====================================================
+# Проверяем: gzip по Accept-Encoding, время сжатия в Server-Timing
+def test_compression_gzip(client):
+    import gzip
+
+    app.config["COMPRESS_MIN_SIZE"] = 0
+    try:
+        plain = client.get("/api/dishes")
+        assert "Content-Encoding" not in plain.headers
+
+        response = client.get("/api/dishes", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert "compress;dur=" in response.headers["Server-Timing"]
+        assert gzip.decompress(response.data) == plain.data
+
+        # Повторный ответ берется из кэша сжатых тел
+        response = client.get("/api/dishes", headers={"Accept-Encoding": "gzip"})
+        assert "compress;dur=" not in response.headers["Server-Timing"]
+        assert gzip.decompress(response.data) == plain.data
+    finally:
+        app.config["COMPRESS_MIN_SIZE"] = 500
+
+
+# Проверяем: потоковый ответ сжимается по кускам
+def test_compression_streaming():
+    import zlib
+    from flask import Response
+    from extensions.compression import compress_response
+
+    chunks = [f"chunk {i}\n" * 50 for i in range(5)]
+    with app.test_request_context("/", headers={"Accept-Encoding": "gzip;q=1, br;q=0"}):
+        response = compress_response(Response((c for c in chunks), mimetype="text/plain"))
+        assert response.headers["Content-Encoding"] == "gzip"
+        parts = list(response.response)
+
+    assert len(parts) >= len(chunks)
+    decompressor = zlib.decompressobj(31)
+    # Каждый кусок можно распаковать сразу, не дожидаясь конца потока
+    assert decompressor.decompress(parts[0]) == chunks[0].encode()
+    rest = b"".join(decompressor.decompress(part) for part in parts[1:])
+    assert rest == "".join(chunks[1:]).encode()
+
+
+# =====================================================
+# 11. СТАТИКА С ОТПЕЧАТКАМИ
+# =====================================================
+# Проверяем: url_for ведет на хэшированный файл, он кэшируется навсегда и отдается сжатым
+def test_fingerprinted_static(client):
+    import gzip
+    from flask import url_for
+
+    with app.test_request_context():
+        url = url_for("static", filename="css/style.css")
+    assert url.startswith("/static/dist/css/style.") and url.endswith(".css")
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert response.mimetype == "text/css"
+    with open(os.path.join(app.static_folder, "css", "style.css"), "rb") as f:
+        assert gzip.decompress(response.data) == f.read()
+    response.close()
+
+
+# =====================================================
+# 12. LAST-MODIFIED И УСЛОВНЫЕ ЗАПРОСЫ
+# =====================================================
+# Проверяем: 304 по If-Modified-Since и If-None-Match, оценка меняет представление
+def test_dish_conditional_get(client):
+    login_as_captain(client)
+    dish_id = create_test_dish()
+
+    response = client.get(f"/api/dishes/{dish_id}")
+    last_modified = response.headers["Last-Modified"]
+    etag = response.headers["ETag"]
+
+    response = client.get(f"/api/dishes/{dish_id}", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    response = client.get(f"/api/dishes/{dish_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 3})
+    response = client.get(f"/api/dishes/{dish_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["dish"]["user_rating"] == 3
+
+    response = client.get(f"/dishes/{dish_id}")
+    assert response.status_code == 200
+    response = client.get(f"/dishes/{dish_id}", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+    # ASGI-режим отдает те же валидаторы и тоже отвечает 304
+    etag = client.get(f"/api/dishes/{dish_id}").headers["ETag"]
+    cookie = client.get_cookie("session").value
+    status, headers, _ = asgi_request(f"/api/dishes/{dish_id}", cookie)
+    assert status == 200 and headers["etag"] == etag and "last-modified" in headers
+    status, _, body = asgi_request(f"/api/dishes/{dish_id}", cookie, [("If-None-Match", etag)])
+    assert status == 304 and body == b""
+    status, _, _ = asgi_request(f"/api/dishes/{dish_id}", cookie,
+                                [("If-Modified-Since", "Fri, 01 Jan 2099 00:00:00 GMT")])
+    assert status == 304
+
+    # Массовое изменение оценок мимо ORM-объектов тоже обновляет представление блюда
+    session = db_session.create_session()
+    session.query(DishRating).filter(DishRating.dish_id == dish_id).update({"rating": 5})
+    session.commit()
+    session.close()
+    response = client.get(f"/api/dishes/{dish_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.get_json()["dish"]["user_rating"] == 5
+    etag = response.headers["ETag"]
+
+    session = db_session.create_session()
+    session.query(DishRating).filter(DishRating.dish_id == dish_id).delete()
+    session.commit()
+    session.close()
+    response = client.get(f"/api/dishes/{dish_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.get_json()["dish"]["user_rating"] is None
+
+    logout(client)
+    dell_test_dish()
+
+
+# Проверяем: фильтр updated_since в списке блюд
+def test_dishes_updated_since(client):
+    import time
+    since = time.time()
+    dish_id = create_test_dish()
+
+    response = client.get(f"/api/dishes?updated_since={since - 1}")
+    ids = [dish["id"] for dish in response.get_json()["dishes"]]
+    assert dish_id in ids
+
+    response = client.get(f"/api/dishes?updated_since={time.time() + 60}")
+    assert response.get_json()["count"] == 0
+
+    for value in ("вчера", "1e20", "-1e20", "inf", "nan"):
+        assert client.get(f"/api/dishes?updated_since={value}").status_code == 400
+        assert asgi_get(f"/api/dishes?updated_since={value}")[0] == 400
+    dell_test_dish()
+
+
+# =====================================================
+# 13. ВЫБОРОЧНЫЕ ПОЛЯ
+# =====================================================
+def capture_sql():
+    """Собирает SQL, выполненный primary-движком"""
+    import sqlalchemy as sa
+    statements = []
+    engine = db_session.get_primary_engine()
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa.event.listen(engine, "before_cursor_execute", listener)
+    return statements, lambda: sa.event.remove(engine, "before_cursor_execute", listener)
+
+
+# Проверяем: ?fields убирает ненужные join и агрегаты из SQL
+def test_sparse_fields(client):
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.get("/api/dishes")  # загружаем пользователя заранее
+
+    statements, stop = capture_sql()
+    try:
+        response = client.get("/api/dishes?fields=id,name")
+    finally:
+        stop()
+    data = response.get_json()
+    assert all(set(dish) == {"id", "name"} for dish in data["dishes"])
+    sql = " ".join(statements)
+    assert "dish_ratings" not in sql and "favourites" not in sql
+
+    response = client.get(f"/api/dishes/{dish_id}?fields=name,user_rating")
+    dish = response.get_json()["dish"]
+    assert list(dish) == ["name", "user_rating"] and dish["name"] == "Test Dish"
+
+    response = client.get("/api/user/favourites?fields=id")
+    assert response.status_code == 200
+
+    response = client.get("/api/dishes?fields=id,password")
+    assert response.status_code == 400
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 14. МУЛЬТИ-ПОЛУЧЕНИЕ БЛЮД
+# =====================================================
+# Проверяем: ?ids= и POST /dishes/batch — порядок запроса, отсутствующие id, один SQL-запрос
+def test_multi_get_dishes(client):
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.get("/api/dishes")  # загружаем пользователя заранее
+
+    statements, stop = capture_sql()
+    try:
+        response = client.get(f"/api/dishes?ids={dish_id},999999,1")
+    finally:
+        stop()
+    data = response.get_json()
+    assert [dish["id"] for dish in data["dishes"]] == [dish_id, 1]
+    assert data["missing"] == [999999]
+    assert data["dishes"][0] == client.get(f"/api/dishes/{dish_id}").get_json()["dish"]
+    assert len([sql for sql in statements if "FROM dishes" in sql]) == 1
+
+    response = client.post("/api/dishes/batch", json={"ids": [1, dish_id], "fields": ["name"]})
+    data = response.get_json()
+    assert data["dishes"] == [{"name": data["dishes"][0]["name"]}, {"name": "Test Dish"}]
+
+    response = client.post("/api/dishes/batch", json={"ids": ["x"]})
+    assert response.status_code == 400
+    response = client.post("/api/dishes/batch", json=[1, dish_id])
+    assert response.status_code == 400
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 15. ИЗБРАННОЕ: ПАГИНАЦИЯ И КЭШ
+# =====================================================
+# Проверяем: страницы избранного, кэш обновляется при переключении без запроса к favourites
+def test_favourites_pagination_and_cache(client, monkeypatch):
+    from data.favourite_cache import favourite_cache, FavouriteCache
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.get("/api/dishes")  # множество избранного уже в кэше
+
+    toggled = client.post(f"/api/dishes/{dish_id}/favourite").get_json()["is_favourite"]
+    statements, stop = capture_sql()
+    try:
+        data = client.get("/api/dishes").get_json()
+    finally:
+        stop()
+    assert toggled and dish_id in favourite_cache.get(1)
+    assert [dish for dish in data["dishes"] if dish["id"] == dish_id][0]["is_favourite"]
+    assert not [sql for sql in statements if sql.startswith("SELECT") and "FROM favourites" in sql]
+
+    data = client.get("/api/user/favourites?per_page=1").get_json()
+    assert data["per_page"] == 1 and data["count"] == 1 and data["total"] >= 1
+    response = client.get("/api/user/favourites?per_page=0")
+    assert response.status_code == 400
+
+    client.post(f"/api/dishes/{dish_id}/favourite")
+    assert dish_id not in favourite_cache.get(1)
+
+    cache = FavouriteCache(max_users=2)
+    for user_id in (1, 2, 3):
+        cache.get(user_id)
+    assert list(cache._entries) == [2, 3]
+
+    # Переключение, закоммиченное во время загрузки, не должно потеряться в кэше
+    class RacingCache(FavouriteCache):
+        def _load(self, user_id):
+            ids = super()._load(user_id)
+            self.add(user_id, dish_id)
+            return ids
+
+    cache = RacingCache()
+    assert dish_id not in cache.get(1)
+    assert 1 not in cache._entries and not cache._loading
+
+    # Промах кэша читает из primary, даже если для запроса выбрана реплика
+    monkeypatch.setattr(db_session, "create_session", lambda: pytest.fail("replica-routed session"))
+    assert FavouriteCache().get(1) == favourite_cache.get(1)
+    monkeypatch.undo()
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 16. СНИМОК СОСТОЯНИЯ ПОЛЬЗОВАТЕЛЯ
+# =====================================================
+# Проверяем: колоночный снимок оценок и избранного, 304 по ETag, дельта по токену версии
+def test_user_state(client):
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 4})
+
+    response = client.get("/api/user/state")
+    data = response.get_json()
+    ratings = data["ratings"]
+    assert len(ratings["dish_ids"]) == len(ratings["values"])
+    assert ratings["values"][ratings["dish_ids"].index(dish_id)] == 4
+    assert response.headers["ETag"] == f'"{data["version"]}"' and "Last-Modified" not in response.headers
+    assert client.get("/api/user/state", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    version = data["version"]
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 5})
+    delta = client.get(f"/api/user/state?since={version}").get_json()
+    assert delta["delta"] and delta["full"] == []
+    assert delta["ratings"] == {"dish_ids": [dish_id], "values": [5]}
+
+    client.post(f"/api/dishes/{dish_id}/favourite")
+    delta = client.get(f"/api/user/state?since={delta['version']}").get_json()
+    assert delta["ratings"]["dish_ids"] == []
+    assert delta["favourites"] == [dish_id] or "favourites" in delta["full"]
+
+    # Снятие самой свежей строки уводит max(updated_at) назад — по дате 304 быть не должно
+    response = client.get("/api/user/state")
+    client.post(f"/api/dishes/{dish_id}/favourite")
+    response = client.get("/api/user/state", headers={
+        "If-Modified-Since": "Fri, 01 Jan 2099 00:00:00 GMT", "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 200
+    assert client.get("/api/user/state", headers={"If-Modified-Since": "Fri, 01 Jan 2099 00:00:00 GMT"}).status_code == 200
+
+    assert client.get("/api/user/state?since=nonsense").status_code == 400
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 17. КОНТРОЛЬ ДОПУСКА
+# =====================================================
+# Проверяем: token bucket на запись (429 + Retry-After), приоритет дешевых чтений, сброс по дедлайну
+def test_admission_control(client):
+    import threading
+    from extensions.admission import Limiter, RateLimiter, PRIORITY_CHEAP, PRIORITY_HEAVY
+
+    login_as_captain(client)
+    limiter = app.extensions["write_rate_limiter"]
+    app.extensions["write_rate_limiter"] = RateLimiter(rate=0.01, burst=1)
+    try:
+        dish_id = create_test_dish()
+        assert client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 3}).status_code == 200
+        response = client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 4})
+        assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1
+        assert client.get(f"/api/dishes/{dish_id}").status_code == 200
+    finally:
+        app.extensions["write_rate_limiter"] = limiter
+
+    limiter = Limiter("read", limit=1, max_queue=4)
+    assert limiter.acquire(PRIORITY_HEAVY, 1.0) == (True, 0)
+    order = []
+
+    def wait(priority):
+        if limiter.acquire(priority, 2.0)[0]:
+            order.append(priority)
+            limiter.release(0.01)
+
+    threads = [threading.Thread(target=wait, args=(PRIORITY_HEAVY,))]
+    threads[0].start()
+    while not limiter._waiters:
+        pass
+    threads.append(threading.Thread(target=wait, args=(PRIORITY_CHEAP,)))
+    threads[1].start()
+    while len(limiter._waiters) < 2:
+        pass
+    limiter.release(0.01)
+    for thread in threads:
+        thread.join()
+    assert order == [PRIORITY_CHEAP, PRIORITY_HEAVY]
+
+    # Ожидаемое ожидание больше дедлайна — отказ сразу, без очереди
+    limiter.acquire(PRIORITY_HEAVY, 1.0)
+    limiter.service_time = 5.0
+    admitted, retry_after = limiter.acquire(PRIORITY_CHEAP, 1.0)
+    assert not admitted and retry_after >= 5.0 and not limiter._waiters
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 18. PREFORK-ЗАПУСК
+# =====================================================
+# Проверяем: после fork дочерний процесс получает свой пул соединений и работает с БД
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="нужен fork")
+def test_engine_after_fork():
+    import sqlalchemy as sa
+
+    engine = db_session.get_primary_engine()
+    with engine.connect() as conn:
+        conn.execute(sa.text("SELECT 1"))
+    parent_pool = id(engine.pool)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            session = db_session.create_session()
+            ok = id(engine.pool) != parent_pool and session.query(Dish).count() >= 0
+            session.close()
+        except Exception:
+            ok = False
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+# Проверяем: снимок реплики заменил другой процесс (мастер) — воркер перестает читать старый файл
+def test_replica_snapshot_replaced_elsewhere(tmp_path):
+    import sqlite3
+    import sqlalchemy as sa
+
+    path = str(tmp_path / "replica.db")
+    replica = db_session.add_replica(path)
+    try:
+        count = sa.text("SELECT COUNT(*) FROM dishes")
+        with replica.engine.connect() as conn:
+            before = conn.execute(count).scalar()  # соединение остается в пуле
+
+        create_test_dish()
+        # Так обновляет снимок мастер: backup во временный файл и os.replace
+        source, target = sqlite3.connect(replica.source_file), sqlite3.connect(path + ".new")
+        source.backup(target)
+        target.close()
+        source.close()
+        os.replace(path + ".new", path)
+
+        assert replica.check(force=True)
+        with replica.engine.connect() as conn:
+            assert conn.execute(count).scalar() == before + 1
+    finally:
+        db_session.remove_replicas()
+        dell_test_dish()
+
+
+# =====================================================
+# 19. ЗАПИСЬ ПРИ КОНКУРЕНЦИИ
+# =====================================================
+# Проверяем: запись дожидается чужой блокировки, по дедлайну — 503, очередь писателя
+def test_write_retry_and_lane(client, monkeypatch):
+    import sqlite3
+    import threading
+    import time
+    from data import writes
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    db_path = db_session.get_primary_engine().url.database
+
+    # Чужой процесс держит блокировку записи 0.3 с
+    locker = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    locker.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, locker.commit).start()
+    retries = writes.stats["retries"]
+    response = client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 2})
+    assert response.status_code == 200 and writes.stats["retries"] > retries
+
+    locker.execute("BEGIN IMMEDIATE")
+    monkeypatch.setattr(writes, "WRITE_DEADLINE", 0.1)
+    response = client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 3})
+    locker.commit()
+    locker.close()
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    monkeypatch.undo()
+
+    writes.enable_lane()
+    try:
+        def rate():
+            with writes.write_session() as session:
+                session.add(DishRating(user_id=1, dish_id=dish_id, rating=5))
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=rate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        writes.disable_lane()
+
+    session = db_session.create_session()
+    assert session.query(DishRating).filter(DishRating.dish_id == dish_id,
+                                            DishRating.rating == 5).count() == 8
+    session.query(DishRating).filter(DishRating.dish_id == dish_id).delete()
+    session.commit()
+    session.close()
+
+    response = client.get("/api/metrics")
+    assert response.get_json()["writes"]["retries"] >= 1
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 20. ЖУРНАЛ ИЗМЕНЕНИЙ
+# =====================================================
+# Проверяем: триггеры пишут изменения по порядку, постраничное чтение, компактификация и 410
+def test_change_log(client):
+    import time
+    from data import change_log
+
+    login_as_captain(client)
+    since = client.get("/api/changes?limit=1").get_json()["latest"]
+    dish_id = create_test_dish()
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 4})
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 5})
+    client.post(f"/api/dishes/{dish_id}/favourite")
+    dell_test_dish()  # массовый DELETE мимо ORM тоже попадает в журнал
+
+    page = client.get(f"/api/changes?since={since}&limit=2").get_json()
+    assert len(page["changes"]) == 2 and page["has_more"]
+    rest = client.get(f"/api/changes?since={page['next']}&limit=100").get_json()
+    changes = page["changes"] + rest["changes"]
+    seqs = [change["seq"] for change in changes]
+    assert seqs == sorted(seqs) and rest["next"] == rest["latest"]
+    ops = [(change["entity"], change["op"]) for change in changes if change["dish_id"] == dish_id]
+    assert ops[0] == ("dish", "insert") and ops[-1] == ("dish", "delete")
+    assert ops.count(("rating", "update")) == 1
+    assert any(entity == "favourite" for entity, op in ops)
+
+    session = db_session.create_session()
+    change_log.compact(session, now=time.time() + change_log.COMPACT_AFTER + 1)
+    session.commit()
+    compacted = client.get(f"/api/changes?since={since}&limit=1000").get_json()["changes"]
+    ratings = [c for c in compacted if c["entity"] == "rating" and c["dish_id"] == dish_id]
+    assert len(ratings) == 1
+
+    change_log.compact(session, now=time.time() + change_log.RETENTION + 1)
+    session.commit()
+    session.close()
+    response = client.get(f"/api/changes?since={since}")
+    assert response.status_code == 410 and response.get_json()["oldest"] >= seqs[-1]
+
+    assert client.get("/api/changes?since=-1").status_code == 400
+    logout(client)
+
+
+# =====================================================
+# 21. ЖИВЫЕ ОБНОВЛЕНИЯ РЕЙТИНГОВ (SSE)
+# =====================================================
+async def sse_stream(headers, until):
+    """Читает /api/dishes/stream, пока until(тело) не вернет True; затем отключается"""
+    from asgi import application
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/dishes/stream',
+             'query_string': b'', 'headers': headers}
+    disconnect = asyncio.Event()
+    received = {'body': b''}
+    started = asyncio.Event()
+
+    async def receive():
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            received['status'] = message['status']
+            received['headers'] = dict(message['headers'])
+            started.set()
+        else:
+            received['body'] += message.get('body', b'')
+            if until(received['body']):
+                disconnect.set()
+
+    task = asyncio.create_task(application(scope, receive, send))
+    await started.wait()
+    return task, received, disconnect
+
+
+def rate_from_thread(dish_id, rating):
+    """Оценка через отдельный тест-клиент: контексты фикстуры привязаны к ее потоку"""
+    client = app.test_client()
+    login_as_captain(client)
+    return client.post(f"/api/dishes/{dish_id}/rate", json={"rating": rating}).status_code
+
+
+# Проверяем: оценка из WSGI-потока доходит до подписчика, повторное подключение с Last-Event-ID
+def test_live_rating_stream(client):
+    import json
+    from extensions import live
+
+    dish_id = create_test_dish()
+    marker = f'"dish_id": {dish_id},'.encode()
+
+    async def run():
+        try:
+            task, received, _ = await sse_stream([], lambda body: marker in body)
+            assert received['headers'][b'content-type'].startswith(b'text/event-stream')
+            assert await asyncio.to_thread(rate_from_thread, dish_id, 4) == 200
+            await asyncio.wait_for(task, 5)
+
+            event = received['body'].split(b'\n\n')[0].decode().split('\n')
+            event_id = int(event[0].removeprefix('id: '))
+            assert event[1] == 'event: rating'
+            assert json.loads(event[2].removeprefix('data: ')) == \
+                {'dish_id': dish_id, 'average_rating': 4.0, 'rating_count': 1}
+
+            # Пока клиента не было, оценку изменили — при переподключении он получит состояние блюда
+            assert await asyncio.to_thread(rate_from_thread, dish_id, 2) == 200
+            task, received, _ = await sse_stream([(b'last-event-id', str(event_id).encode())],
+                                                 lambda body: marker in body)
+            await asyncio.wait_for(task, 5)
+            assert b'"average_rating": 2.0' in received['body']
+        finally:
+            live.hub.stop_poller()
+            await db_session.dispose_async()
+
+    asyncio.run(run())
+    assert not live.hub.subscribers
+    dell_test_dish()
+
+
+# Проверяем: медленному клиенту копится только последнее состояние блюда, при переполнении — отключение
+def test_live_subscriber_backpressure(monkeypatch):
+    from extensions import live
+
+    async def run():
+        subscriber = live.Subscriber()
+        subscriber.offer(live.make_event(1, 7, 3.0, 1))
+        subscriber.offer(live.make_event(2, 8, 5.0, 1))
+        subscriber.offer(live.make_event(3, 7, 4.0, 2))
+        assert [event['id'] for event in subscriber.drain()] == [2, 3]
+        assert not subscriber.wake.is_set()
+
+        monkeypatch.setattr(live, 'MAX_PENDING', 2)
+        for dish_id in range(3):
+            subscriber.offer(live.make_event(dish_id + 10, dish_id, 5.0, 1))
+        assert subscriber.overflowed
+
+    asyncio.run(run())
+
+
+# =====================================================
+# 22. ТРЕНДЫ
+# =====================================================
+# Проверяем: оценка сразу попадает в тренды, затухание и истечение корзин, sort=trending
+def test_trending(client):
+    import time
+    from data import trending
+    from data.writes import write_session
+
+    login_as_captain(client)
+    dell_test_dish()
+    with write_session() as session:
+        trending.refresh(session)  # корзины прежних тестовых блюд: новое получит тот же id
+    dish_id = create_test_dish()
+    with write_session() as session:
+        session.query(DishRating).filter(DishRating.dish_id == dish_id).delete()
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 5})
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 3})  # учитывается разница
+
+    session = db_session.create_session()
+    score = session.get(trending.DishTrending, dish_id).score
+    session.close()
+    assert score == pytest.approx(0.6)
+
+    data = client.get("/api/dishes?sort=trending&fields=id,name").get_json()
+    assert dish_id in [dish["id"] for dish in data["dishes"]]
+    assert len(data["dishes"]) <= trending.TOP_K
+    assert "Test Dish" in client.get("/dishes?sort=trending").get_data(as_text=True)
+
+    # Через период полураспада счет вдвое меньше, за пределами окна блюдо выпадает
+    now = time.time()
+    with write_session() as session:
+        trending.refresh(session, now=now + trending.HALF_LIFE_HOURS * trending.BUCKET_SECONDS)
+        assert session.get(trending.DishTrending, dish_id).score == pytest.approx(0.3)
+        trending.refresh(session, now=now + (trending.WINDOW_BUCKETS + 1) * trending.BUCKET_SECONDS)
+        assert session.get(trending.DishTrending, dish_id) is None
+    data = client.get("/api/dishes?sort=trending").get_json()
+    assert dish_id not in [dish["id"] for dish in data["dishes"]]
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 23. АВТОДОПОЛНЕНИЕ НАЗВАНИЙ
+# =====================================================
+# Проверяем: подсказки без учета регистра, новое блюдо видно сразу после записи, совпадение названия
+def test_autocomplete(client):
+    from data.name_index import NameIndex, name_index
+
+    login_as_captain(client)
+    name_index.ensure_current()
+    dish_id = create_test_dish()
+
+    data = client.get("/api/dishes/autocomplete?prefix=tEsT%20%20d").get_json()
+    assert dish_id in [dish["id"] for dish in data["suggestions"]]
+    assert client.get("/api/dishes/autocomplete?prefix=test dish").get_json()["match"] == dish_id
+    assert client.get("/api/dishes/autocomplete?prefix=").get_json()["suggestions"] == []
+    assert client.get("/api/dishes/autocomplete?prefix=a&limit=0").status_code == 400
+
+    dell_test_dish()  # массовый DELETE — индекс догоняет его по журналу изменений
+    name_index.synced_at = 0
+    assert client.get("/api/dishes/autocomplete?prefix=test dish").get_json()["match"] is None
+
+    # Ранжирование по оценкам и кэш длинных отрезков
+    index = NameIndex()
+    for i in range(1000):
+        index.put(i, f"Суп {i}", average=i % 5, count=i % 7)
+    index.put(5000, "Суп с ёжиком", average=5, count=100)
+    assert index.search("суп с е", 3)[0][0] == 5000
+    top = index.search("суп", 5)
+    assert top[0][0] == 5000 and "суп" in index._top
+    index.remove(5000)
+    assert "суп" not in index._top and index.search("суп", 1)[0][0] != 5000
+
+
+# =====================================================
+# 24. ПОХОЖИЕ ПО ИНГРЕДИЕНТАМ
+# =====================================================
+# Проверяем: сигнатуры пишутся вместе с блюдом, кандидаты из LSH-корзин, пересчет при изменении
+def test_similar_ingredients(client):
+    from data import similar_dishes
+    from data.writes import write_session
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    ingredients = "Спагетти, бекон, яйца, сыр пармезан, черный перец, соль, чеснок"
+    client.put(f"/api/dishes/{dish_id}", json={"name": "Test Dish", "ingredients": ingredients})
+    response = client.post("/api/dishes", json={"name": "Test Dish 2", "ingredients": ingredients + ", сливки", "url": ""})
+    other_id = response.get_json()["dish"]["id"]
+
+    similar = client.get(f"/api/dishes/{dish_id}/similar-ingredients").get_json()["similar"]
+    assert similar[0]["id"] == other_id and similar[0]["similarity"] > 0.6
+    assert "Похожие по ингредиентам" in client.get(f"/dishes/{dish_id}").get_data(as_text=True)
+
+    client.put(f"/api/dishes/{other_id}", json={"name": "Test Dish 2", "ingredients": "Свекла, капуста"})
+    similar = client.get(f"/api/dishes/{dish_id}/similar-ingredients").get_json()["similar"]
+    assert other_id not in [dish["id"] for dish in similar]
+    assert client.get("/api/dishes/999999/similar-ingredients").status_code == 404
+
+    # Перестройка пачками дает те же сигнатуры, что и запись блюда
+    assert similar_dishes.signatures_vectorized([ingredients, ""]) == \
+        [similar_dishes.signature(ingredients), None]
+    with write_session() as session:
+        assert similar_dishes.rebuild(session, batch=2) >= 2
+    similar = client.get(f"/api/dishes/{other_id}/similar-ingredients?limit=1").get_json()["similar"]
+    assert len(similar) <= 1
+
+    client.delete(f"/api/dishes/{other_id}")
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 25. КАСКАДНОЕ УДАЛЕНИЕ И ОБСЛУЖИВАНИЕ БД
+# =====================================================
+# Проверяем: удаление блюда забирает его оценки и избранное, задачи обслуживания и их история
+def test_cascade_delete_and_maintenance(client):
+    from datetime import datetime
+    import sqlalchemy as sa
+    from data import maintenance
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 4})
+    client.post(f"/api/dishes/{dish_id}/favourite")
+
+    assert client.delete(f"/api/dishes/{dish_id}").status_code == 200
+    session = db_session.create_session()
+    assert session.query(DishRating).filter(
+        (DishRating.dish_id == dish_id) | (DishRating.dish_id.is_(None))).count() == 0
+    assert session.query(Favourite).filter(
+        (Favourite.dishes_id == dish_id) | (Favourite.dishes_id.is_(None))).count() == 0
+    assert session.execute(sa.text("PRAGMA foreign_key_check")).all() == []
+    session.close()
+
+    runs = maintenance.run()
+    assert [run["task"] for run in runs] == list(maintenance.TASKS)
+    assert all(run["status"] in ("ok", "skipped") for run in runs), runs
+    history = client.get("/api/maintenance").get_json()["runs"]
+    assert history[0]["task"] == "wal_checkpoint"
+
+    window = maintenance.parse_window("23:30-02:00")
+    assert maintenance.in_window(window, datetime(2024, 6, 1, 0, 15).timestamp())
+    assert not maintenance.in_window(window, datetime(2024, 6, 1, 12, 0).timestamp())
+    with pytest.raises(ValueError):
+        maintenance.parse_window("25:00-01:00")
+    session = db_session.create_session()
+    assert not maintenance.due(session, None)  # только что выполнено
+    session.close()
+    logout(client)
+
+
+# =====================================================
+# 26. ГОРЯЧИЕ РЕЗЕРВНЫЕ КОПИИ
+# =====================================================
+# Проверяем: пошаговый снимок при параллельной записи, контрольная сумма, ротация, восстановление
+def test_backup_snapshots(client, tmp_path):
+    import sqlite3
+    import threading
+    from data import backup
+
+    login_as_captain(client)
+    app.config["BACKUP_DIR"] = str(tmp_path / "backups")
+    dish_id = create_test_dish()
+
+    # Писатель работает все время снятия снимка
+    stop = threading.Event()
+
+    def write():
+        from data.writes import write_session
+        while not stop.is_set():
+            with write_session() as session:
+                session.add(DishRating(user_id=1, dish_id=dish_id, rating=3))
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        info = backup.create(str(tmp_path / "backups"), pages=1, sleep=0)
+    finally:
+        stop.set()
+        writer.join()
+    assert info["pages"] > 0 and os.path.exists(info["path"] + ".sha256")
+
+    restored = backup.restore(info["path"], str(tmp_path / "restored.db"))
+    conn = sqlite3.connect(restored)
+    assert conn.execute("SELECT COUNT(*) FROM dishes WHERE id = ?", (dish_id,)).fetchone()[0] == 1
+    conn.close()
+
+    response = client.post("/api/backups")
+    assert response.status_code == 201
+    assert [s["path"] for s in client.get("/api/backups").get_json()["snapshots"]][0] == response.get_json()["path"]
+    assert backup.rotate(str(tmp_path / "backups"), keep=1) == [info["path"]]
+
+    with open(response.get_json()["path"], "ab") as f:
+        f.write(b"corrupt")
+    with pytest.raises(backup.BackupError):
+        backup.verify(response.get_json()["path"])
+
+    logout(client)
+    assert client.post("/api/backups").status_code == 401
+    dell_test_dish()
+
+
+# =====================================================
+# 27. ЛЕГКИЕ СТРОКИ БЛЮД
+# =====================================================
+# Проверяем: HTML-список строится из DishRow одним запросом к dishes, сериализатор совпадает с to_dict
+def test_dish_rows_listing(client):
+    from data import dish_rows
+    from data.dish_query import DishQueryPlan, LIST_FIELDS
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.post(f"/dishes/{dish_id}/rate", data={"rating": "4"})
+    client.get("/dishes")  # загружаем пользователя заранее
+
+    statements, stop = capture_sql()
+    try:
+        response = client.get("/dishes")
+    finally:
+        stop()
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "Ваша оценка: 4" in html and f"/dishes/{dish_id}/edit" in html
+    # Без N+1: ни одного запроса оценок или блюд на строку
+    assert len([sql for sql in statements if "FROM dishes" in sql]) == 1
+    assert not any("FROM dish_ratings" in sql and "dish_ratings.dish_id = ?" in sql for sql in statements)
+
+    response = client.get(f"/dishes/{dish_id}")
+    assert response.status_code == 200 and "Текущая оценка: 4" in response.get_data(as_text=True)
+
+    session = db_session.create_session()
+    rows = dish_rows.load(session, 1, where=Dish.id == dish_id)
+    assert len(rows) == 1 and rows[0].user_rating == 4 and rows[0].can_edit
+    assert not hasattr(rows[0], "__dict__")
+    assert dish_rows.load(session, 2, where=Dish.id == dish_id)[0].can_edit is False
+
+    plan = DishQueryPlan(LIST_FIELDS, user_id=1, favourite_ids=set())
+    rows = session.execute(plan.statement()).all()
+    serialize = plan.serializer(rows[0]._fields, round_average=True)
+    assert [serialize(row) for row in rows] == [plan.to_dict(row, round_average=True) for row in rows]
+    session.close()
+
+    logout(client)
+    dell_test_dish()
+
+
+# =====================================================
+# 28. КАТАЛОГ В ПАМЯТИ
+# =====================================================
+# Проверяем: списки из каталога совпадают с SQL, без запросов к блюдам, каталог догоняет чужие записи
+def test_catalog_in_memory(client, monkeypatch):
+    import sqlite3
+    from data import catalog as catalog_module
+    from data.catalog import catalog
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 4})
+    client.post(f"/api/dishes/{dish_id}/favourite")
+    cookie = client.get_cookie("session").value
+    queries = ["/api/dishes", "/api/dishes?sort=rating", "/api/dishes?fields=" + ",".join(api.DETAIL_FIELDS),
+               "/api/dishes?updated_since=2000-01-01T00:00:00"]
+    expected = {path: client.get(path).get_json() for path in queries}
+    expected_html = {sort: client.get(f"/dishes?sort={sort}").get_data(as_text=True)
+                     for sort in ("default", "rating", "favourites", "my_dishes")}
+
+    monkeypatch.setitem(app.config, "CATALOG_IN_MEMORY", True)
+    for path in queries:
+        assert client.get(path).get_json() == expected[path]
+        assert asgi_get(path, cookie) == (200, expected[path])
+    for sort, html in expected_html.items():
+        assert client.get(f"/dishes?sort={sort}").get_data(as_text=True) == html
+
+    statements, stop = capture_sql()
+    try:
+        client.get("/api/dishes?sort=rating")
+    finally:
+        stop()
+    assert not any("FROM dishes" in sql for sql in statements)
+
+    # Запись через API этого процесса видна сразу
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 1})
+    dish = [d for d in client.get("/api/dishes").get_json()["dishes"] if d["id"] == dish_id][0]
+    assert dish["average_rating"] == 1 and dish["rating_count"] == 1
+
+    # Запись другого процесса — после SYNC_INTERVAL, по журналу изменений
+    monkeypatch.setattr(catalog_module, "SYNC_INTERVAL", 0)
+    conn = sqlite3.connect(db_session.get_primary_engine().url.database)
+    conn.execute("UPDATE dishes SET name = 'Test Dish 2', author_id = 1 WHERE id = ?", (dish_id,))
+    conn.commit()
+    conn.close()
+    assert [d["name"] for d in client.get("/api/dishes").get_json()["dishes"] if d["id"] == dish_id] == ["Test Dish 2"]
+    assert dish_id in [row[0] for row in catalog.rows(author_id=1)]
+
+    client.delete(f"/api/dishes/{dish_id}")
+    assert dish_id not in [d["id"] for d in client.get("/api/dishes").get_json()["dishes"]]
+    assert len(catalog) == len(client.get("/api/dishes").get_json()["dishes"])
+    logout(client)
+
+
+# =====================================================
+# 29. ОБЩИЙ КЭШ ВОРКЕРОВ
+# =====================================================
+# Проверяем: SQLite-бэкенд (TTL, LRU), кэш пользователей, рассылка инвалидации избранного
+def test_shared_cache(client, tmp_path, monkeypatch):
+    import sqlite3
+    import time
+    from data import shared_cache
+    from data.favourite_cache import favourite_cache
+
+    # TTL и вытеснение самых давних по обращению
+    monkeypatch.setattr(shared_cache, "TOUCH_INTERVAL", 0)
+    small = shared_cache.SQLiteBackend(str(tmp_path / "small.db"), max_bytes=300, evict_every=1)
+    small.set("a", b"x" * 100)
+    small.set("short", b"y", ttl=0.01)
+    time.sleep(0.02)
+    assert small.get("short") is None
+    small.set("b", b"x" * 100)
+    assert small.get("a") == b"x" * 100  # a — свежее b
+    small.set("c", b"x" * 100)
+    assert small.get("b") is None and small.get("a") is not None and small.get("c") is not None
+
+    path = str(tmp_path / "cache.db")
+    shared_cache.configure(path)
+    try:
+        # Второй экземпляр на том же файле — как другой воркер
+        other = shared_cache.SQLiteBackend(path)
+        login_as_captain(client)
+        client.get("/api/dishes")
+        assert other.get("users:1") == {"id": 1, "login": "admin"}
+
+        statements, stop = capture_sql()
+        try:
+            assert client.get("/api/user/state").status_code == 200
+        finally:
+            stop()
+        assert not any("FROM users" in sql for sql in statements)
+
+        response = client.get("/api/dishes", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert sqlite3.connect(path).execute(
+            "SELECT COUNT(*) FROM cache WHERE key LIKE 'compressed:%'").fetchone()[0] == 1
+
+        # Событие другого процесса сбрасывает множество избранного
+        monkeypatch.setattr(shared_cache, "POLL_INTERVAL", 0)
+        favourite_cache.get(1)
+        misses = favourite_cache.misses
+        favourite_cache.get(1)
+        assert favourite_cache.misses == misses
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO cache_events (origin, channel, message, created_at) "
+                     "VALUES ('other-worker', 'favourites', '1', ?)", (time.time(),))
+        conn.commit()
+        conn.close()
+        favourite_cache.get(1)
+        assert favourite_cache.misses == misses + 1
+
+        # Свои события процесс не получает обратно
+        client.post("/api/dishes/1/favourite")
+        misses = favourite_cache.misses
+        favourite_cache.get(1)
+        assert favourite_cache.misses == misses
+
+        metrics = client.get("/api/metrics").get_json()["cache"]
+        assert metrics["backend"] == "SQLiteBackend" and metrics["caches"]["users"]["hits"] > 0
+    finally:
+        shared_cache.configure(None)
+    logout(client)
+
+
+# =====================================================
+# 30. КЭШ ШАБЛОНОВ
+# =====================================================
+# Проверяем: карточки блюд берутся из кэша фрагментов, меняются с оценкой; байткод шаблонов с диска
+def test_template_caches(client, tmp_path):
+    import jinja2
+    from extensions.template_cache import FragmentCacheExtension
+
+    login_as_captain(client)
+    dish_id = create_test_dish()
+    fragments = app.jinja_env.fragment_cache
+    cards = len(client.get("/api/dishes").get_json()["dishes"])
+
+    first = client.get("/dishes").get_data(as_text=True)
+    hits = fragments.hits
+    assert client.get("/dishes").get_data(as_text=True) == first
+    assert fragments.hits == hits + cards
+
+    # Оценка меняет ключ только у своей карточки
+    client.post(f"/api/dishes/{dish_id}/rate", json={"rating": 5})
+    hits, misses = fragments.hits, fragments.misses
+    html = client.get("/dishes").get_data(as_text=True)
+    assert "Ваша оценка: 5" in html
+    assert (fragments.hits, fragments.misses) == (hits + cards - 1, misses + 1)
+
+    app.jinja_env.fragment_cache = None
+    try:
+        assert client.get("/dishes").get_data(as_text=True) == html
+    finally:
+        app.jinja_env.fragment_cache = fragments
+
+    # Второе окружение (как новый процесс) не компилирует шаблон заново
+    def environment():
+        return jinja2.Environment(loader=app.jinja_loader, extensions=[FragmentCacheExtension],
+                                  bytecode_cache=jinja2.FileSystemBytecodeCache(str(tmp_path)))
+
+    environment().get_template("dishes.html")
+    assert os.listdir(tmp_path)
+    cold = environment()
+    cold.compile = None  # любая компиляция упадет
+    cold.get_template("dishes.html")
+
+    logout(client)
+    dell_test_dish()